@@ -0,0 +1,943 @@
+# Servidor IMAP4 falso que se ejecuta dentro del propio proceso, para medir
+# el rendimiento del motor sin una cuenta de correo real.
+#
+# Sirve buzones sintéticos en memoria e implementa el subconjunto de IMAP4rev1
+# (más CONDSTORE, QRESYNC, UIDPLUS, MOVE, MULTIAPPEND, LITERAL+ y
+# COMPRESS=DEFLATE) que usa el motor de sincronización. Permite inyectar
+# latencia por comando y limitaciones del servidor ([THROTTLED] y BYE) para
+# reproducir las condiciones de un proveedor real.
+import os
+import random
+import re
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from email.utils import formatdate
+
+DEFAULT_CAPABILITIES = [
+    "IMAP4rev1", "LITERAL+", "UIDPLUS", "MOVE", "MULTIAPPEND", "ENABLE",
+    "CONDSTORE", "QRESYNC", "COMPRESS=DEFLATE", "ID",
+]
+
+_LITERAL_RE = re.compile(rb'\{(\d+)(\+?)\}\r\n$')
+_PARTIAL_RE = re.compile(r'<(\d+)(?:\.(\d+))?>$')
+
+
+class FakeMessage:
+    """Mensaje almacenado en un buzón falso."""
+    __slots__ = ("uid", "flags", "internaldate", "body", "modseq")
+
+    def __init__(self, uid, body, flags=(), internaldate=None, modseq=1):
+        self.uid = uid
+        self.body = body
+        self.flags = set(flags)
+        self.internaldate = internaldate if internaldate is not None else time.time()
+        self.modseq = modseq
+
+
+class FakeMailbox:
+    """Buzón en memoria con UIDVALIDITY, UIDNEXT y HIGHESTMODSEQ."""
+
+    def __init__(self, name, uidvalidity=None):
+        self.name = name
+        self.uidvalidity = uidvalidity or random.randint(1, 2**31 - 1)
+        self.uidnext = 1
+        self.highestmodseq = 1
+        self.messages = []
+        self.vanished = []  # Lista de (uid, modseq) para QRESYNC
+        self.lock = threading.RLock()
+
+    def add(self, body, flags=(), internaldate=None):
+        with self.lock:
+            self.highestmodseq += 1
+            msg = FakeMessage(self.uidnext, body, flags, internaldate, self.highestmodseq)
+            self.uidnext += 1
+            self.messages.append(msg)
+            return msg
+
+    def bump_modseq(self):
+        with self.lock:
+            self.highestmodseq += 1
+            return self.highestmodseq
+
+    def expunge(self, uids=None):
+        """Elimina los mensajes con \\Deleted. Devuelve los números de secuencia eliminados."""
+        with self.lock:
+            removed = []
+            kept = []
+            for seq, msg in enumerate(self.messages, 1):
+                if "\\Deleted" in msg.flags and (uids is None or msg.uid in uids):
+                    removed.append(seq - len(removed))
+                    self.vanished.append((msg.uid, self.bump_modseq()))
+                else:
+                    kept.append(msg)
+            self.messages = kept
+            return removed
+
+
+class FakeAccount:
+    """Cuenta de correo falsa con sus carpetas."""
+
+    def __init__(self, user, password, separator="/"):
+        self.user = user
+        self.password = password
+        self.separator = separator
+        self.mailboxes = {"INBOX": FakeMailbox("INBOX")}
+        self.subscribed = set()
+        self.lock = threading.RLock()
+
+    def get_or_create(self, name):
+        with self.lock:
+            if name.upper() == "INBOX":
+                name = "INBOX"
+            if name not in self.mailboxes:
+                self.mailboxes[name] = FakeMailbox(name)
+            return self.mailboxes[name]
+
+    def get(self, name):
+        if name.upper() == "INBOX":
+            name = "INBOX"
+        return self.mailboxes.get(name)
+
+
+_FILLER_WORDS = [b"lorem", b"ipsum", b"dolor", b"sit", b"amet", b"correo", b"migracion", b"imap"]
+_filler_text = None
+
+
+def _filler():
+    """Texto de relleno (1 MB en líneas de ~72 caracteres), generado una sola vez."""
+    global _filler_text
+    if _filler_text is None:
+        rng = random.Random(12345)
+        lines, size = [], 0
+        while size < 1024 * 1024:
+            line = b" ".join(rng.choice(_FILLER_WORDS) for _ in range(12)) + b"\r\n"
+            lines.append(line)
+            size += len(line)
+        _filler_text = b"".join(lines)
+    return _filler_text
+
+
+def make_message(index, size, domain="example.com", rng=None):
+    """Genera un mensaje RFC822 sintético de aproximadamente ``size`` bytes."""
+    rng = rng or random
+    headers = (
+        f"Message-ID: <{index}.{rng.randint(0, 10**9)}@{domain}>\r\n"
+        f"Date: {formatdate(1_600_000_000 + index * 60, localtime=False)}\r\n"
+        f"From: Remitente {index % 97} <remitente{index % 97}@{domain}>\r\n"
+        f"To: destinatario@{domain}\r\n"
+        f"Subject: Mensaje de prueba {index}\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "\r\n"
+    ).encode("ascii")
+    # El cuerpo es un trozo del texto de relleno que empieza en un punto al azar
+    filler = _filler()
+    target = max(size - len(headers), 2)
+    start = filler.index(b"\r\n", rng.randrange(len(filler) // 2)) + 2
+    body = bytearray()
+    while len(body) < target:
+        body += filler[start:start + target - len(body)]
+        start = 0
+    body = bytes(body[:target - 2]).rstrip(b"\r")  # Sin CR sueltos antes del CRLF final
+    return headers + body + b"\r\n"
+
+
+# Tamaños de mensaje (bytes) de cada distribución. "huge" supera LARGE_MESSAGE_BYTES
+# del motor, así que esos correos se copian por partes a través de un fichero temporal.
+SIZE_DISTRIBUTIONS = {
+    "small": lambda rng: rng.randint(2_000, 8_000),
+    "large": lambda rng: rng.randint(100_000, 1_000_000),
+    "mixed": lambda rng: rng.choice([
+        rng.randint(2_000, 8_000), rng.randint(2_000, 8_000), rng.randint(2_000, 8_000),
+        rng.randint(20_000, 200_000), rng.randint(300_000, 1_000_000),
+    ]),
+    "huge": lambda rng: rng.randint(17_000_000, 40_000_000),
+}
+
+
+def populate_mailbox(mailbox, count, distribution="small", seed=0, domain="example.com"):
+    """Rellena un buzón con ``count`` mensajes sintéticos según la distribución de tamaños."""
+    rng = random.Random(seed)
+    size_fn = SIZE_DISTRIBUTIONS[distribution] if isinstance(distribution, str) else distribution
+    for i in range(count):
+        flags = ("\\Seen",) if rng.random() < 0.7 else ()
+        mailbox.add(make_message(i, size_fn(rng), domain, rng), flags, 1_600_000_000 + i * 60)
+    return mailbox
+
+
+# --- ANÁLISIS DE COMANDOS ---
+
+def _tokenize(text, literals):
+    """Convierte los argumentos de un comando en una lista anidada de tokens."""
+    pos = 0
+    root = []
+    stack = [root]
+    n = len(text)
+    while pos < n:
+        c = text[pos]
+        if c == " ":
+            pos += 1
+        elif c == "(":
+            new = []
+            stack[-1].append(new)
+            stack.append(new)
+            pos += 1
+        elif c == ")":
+            if len(stack) > 1:
+                stack.pop()
+            pos += 1
+        elif c == '"':
+            pos += 1
+            out = []
+            while pos < n and text[pos] != '"':
+                if text[pos] == "\\" and pos + 1 < n:
+                    pos += 1
+                out.append(text[pos])
+                pos += 1
+            pos += 1
+            stack[-1].append("".join(out))
+        elif c == "\x00":
+            end = text.index("\x00", pos + 1)
+            stack[-1].append(literals[int(text[pos + 1:end])])
+            pos = end + 1
+        else:
+            start = pos
+            depth = 0
+            while pos < n and (depth > 0 or text[pos] not in " ()"):
+                if text[pos] == "[":
+                    depth += 1
+                elif text[pos] == "]":
+                    depth -= 1
+                pos += 1
+            stack[-1].append(text[start:pos])
+    return root
+
+
+def _parse_set(spec, maximum):
+    """Expande un conjunto de secuencia/UID ("1:5,7,9:*") a un conjunto de enteros."""
+    result = set()
+    for part in str(spec).split(","):
+        if ":" in part:
+            a, b = part.split(":", 1)
+            a = maximum if a == "*" else int(a)
+            b = maximum if b == "*" else int(b)
+            if a > b:
+                a, b = b, a
+            result.update(range(a, b + 1))
+        elif part == "*":
+            result.add(maximum)
+        elif part:
+            result.add(int(part))
+    return result
+
+
+def _compact_set(numbers):
+    numbers = sorted(numbers)
+    if not numbers:
+        return ""
+    parts = []
+    start = prev = numbers[0]
+    for n in numbers[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        parts.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = n
+    parts.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(parts)
+
+
+def _quote(s):
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _header_fields(body, names, exclude=False):
+    """Devuelve las cabeceras indicadas (con sus líneas plegadas) seguidas de CRLF."""
+    end = body.find(b"\r\n\r\n")
+    header = body[:end + 2] if end >= 0 else body
+    wanted = {n.upper() for n in names}
+    out = []
+    keep = False
+    for line in header.split(b"\r\n"):
+        if not line:
+            continue
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                out.append(line)
+            continue
+        name = line.split(b":", 1)[0].decode("latin-1").strip().upper()
+        keep = (name in wanted) != exclude
+        if keep:
+            out.append(line)
+    return b"\r\n".join(out) + (b"\r\n" if out else b"") + b"\r\n"
+
+
+# --- SERVIDOR ---
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    """Atiende una sesión IMAP completa."""
+
+    def setup(self):
+        self.srv = self.server.fake
+        self.sock = self.request
+        self.rbuf = bytearray()
+        self.account = None
+        self.mailbox = None
+        self.readonly = False
+        self.enabled = set()
+        self.decompressor = None
+        self.compressor = None
+        self.alive = True
+
+    # -- E/S con soporte de COMPRESS=DEFLATE --
+    def _recv_more(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("cliente desconectado")
+        self.srv._count("bytes_in", len(data))
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.rbuf += data
+
+    def _readline(self):
+        start = 0
+        while (end := self.rbuf.find(b"\r\n", start)) < 0:
+            start = max(len(self.rbuf) - 1, 0)
+            self._recv_more()
+        line = bytes(self.rbuf[:end + 2])
+        del self.rbuf[:end + 2]
+        return line
+
+    def _read_exact(self, size):
+        while len(self.rbuf) < size:
+            self._recv_more()
+        data = bytes(self.rbuf[:size])
+        del self.rbuf[:size]
+        return data
+
+    def _send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.srv._count("bytes_out", len(data))
+        self.sock.sendall(data)
+
+    def _read_command(self):
+        """Lee un comando completo, incluidos sus literales."""
+        literals = []
+        text_parts = []
+        while True:
+            line = self._readline()
+            m = _LITERAL_RE.search(line)
+            if not m:
+                text_parts.append(line[:-2].decode("utf-8", "replace"))
+                break
+            text_parts.append(line[:m.start()].decode("utf-8", "replace"))
+            if not m.group(2):
+                # Sin LITERAL+ cada literal cuesta una ida y vuelta más
+                self.srv._count("continuations", 1)
+                self.srv._delay()
+                self._send(b"+ Ready for literal data\r\n")
+            literals.append(self._read_exact(int(m.group(1))))
+            text_parts.append(f"\x00{len(literals) - 1}\x00")
+        return "".join(text_parts), literals
+
+    def handle(self):
+        try:
+            caps = " ".join(self.srv.capabilities)
+            self._send(f"* OK [CAPABILITY {caps}] Servidor IMAP falso listo\r\n")
+            while self.alive:
+                text, literals = self._read_command()
+                if not text.strip():
+                    continue
+                parts = text.split(" ", 2)
+                tag = parts[0]
+                name = parts[1].upper() if len(parts) > 1 else ""
+                rest = parts[2] if len(parts) > 2 else ""
+                self.srv._count("commands", 1)
+                self.srv._count(f"cmd_{name.lower()}", 1)
+                if name == "UID" and rest:
+                    sub = rest.split(" ", 1)
+                    self.srv._count(f"cmd_uid_{sub[0].lower()}", 1)
+                self.srv._delay()
+                injected = self.srv._inject_failure()
+                if injected == "bye":
+                    self._send("* BYE [UNAVAILABLE] Demasiadas conexiones, inténtelo más tarde\r\n")
+                    return
+                if injected == "throttle" and name not in ("LOGOUT", "LOGIN", "CAPABILITY"):
+                    self._send(f"{tag} NO [THROTTLED] Limite de peticiones superado\r\n")
+                    continue
+                handler = getattr(self, "cmd_" + name.lower(), None)
+                if handler is None:
+                    self._send(f"{tag} BAD Comando desconocido\r\n")
+                    continue
+                try:
+                    handler(tag, _tokenize(rest, literals), rest)
+                except (ConnectionError, OSError):
+                    raise
+                except Exception as e:  # Errores de sintaxis del cliente
+                    self._send(f"{tag} BAD {type(e).__name__}: {e}\r\n")
+        except (ConnectionError, OSError, ssl.SSLError):
+            pass
+
+    # -- Comandos --
+    def cmd_capability(self, tag, args, raw):
+        self._send(f"* CAPABILITY {' '.join(self.srv.capabilities)}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def cmd_noop(self, tag, args, raw):
+        self._send(f"{tag} OK NOOP completed\r\n")
+
+    def cmd_id(self, tag, args, raw):
+        self._send(f'* ID ("name" "fake-imap")\r\n{tag} OK ID completed\r\n')
+
+    def cmd_logout(self, tag, args, raw):
+        self._send(f"* BYE Hasta luego\r\n{tag} OK LOGOUT completed\r\n")
+        self.alive = False
+
+    def cmd_login(self, tag, args, raw):
+        user, password = str(args[0]), args[1]
+        if isinstance(password, bytes):
+            password = password.decode()
+        account = self.srv.accounts.get(user)
+        if account is None or account.password != password:
+            self._send(f"{tag} NO [AUTHENTICATIONFAILED] Credenciales incorrectas\r\n")
+            return
+        self.account = account
+        self._send(f"{tag} OK [CAPABILITY {' '.join(self.srv.capabilities)}] LOGIN completed\r\n")
+
+    def _require_auth(self, tag):
+        if self.account is None:
+            self._send(f"{tag} NO No autenticado\r\n")
+            return False
+        return True
+
+    def cmd_enable(self, tag, args, raw):
+        if not self._require_auth(tag):
+            return
+        enabled = [a.upper() for a in args if a.upper() in ("CONDSTORE", "QRESYNC")]
+        if "QRESYNC" in enabled:
+            enabled.append("CONDSTORE")
+        self.enabled.update(enabled)
+        self._send(f"* ENABLED {' '.join(sorted(set(enabled)))}\r\n{tag} OK ENABLE completed\r\n")
+
+    def cmd_compress(self, tag, args, raw):
+        if not args or str(args[0]).upper() != "DEFLATE" or "COMPRESS=DEFLATE" not in self.srv.capabilities:
+            self._send(f"{tag} BAD Algoritmo no soportado\r\n")
+            return
+        if self.compressor is not None:
+            self._send(f"{tag} NO [COMPRESSIONACTIVE] Ya activo\r\n")
+            return
+        self._send(f"{tag} OK DEFLATE active\r\n")
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+        if self.rbuf:  # Datos ya recibidos tras el comando vienen comprimidos
+            pending, self.rbuf = bytes(self.rbuf), bytearray()
+            self.rbuf = bytearray(self.decompressor.decompress(pending))
+
+    def cmd_list(self, tag, args, raw, command="LIST"):
+        if not self._require_auth(tag):
+            return
+        sep = self.account.separator
+        names = self.account.mailboxes if command == "LIST" else self.account.subscribed & set(self.account.mailboxes)
+        lines = []
+        for name in sorted(names):
+            lines.append(f'* {command} (\\HasNoChildren) "{sep}" {_quote(name)}\r\n')
+        self._send("".join(lines) + f"{tag} OK {command} completed\r\n")
+
+    def cmd_lsub(self, tag, args, raw):
+        self.cmd_list(tag, args, raw, command="LSUB")
+
+    def cmd_create(self, tag, args, raw):
+        if not self._require_auth(tag):
+            return
+        name = str(args[0])
+        if self.account.get(name) is not None:
+            self._send(f"{tag} NO [ALREADYEXISTS] La carpeta ya existe\r\n")
+            return
+        self.account.get_or_create(name)
+        self._send(f"{tag} OK CREATE completed\r\n")
+
+    def cmd_subscribe(self, tag, args, raw):
+        if not self._require_auth(tag):
+            return
+        self.account.subscribed.add(str(args[0]))
+        self._send(f"{tag} OK SUBSCRIBE completed\r\n")
+
+    def cmd_status(self, tag, args, raw):
+        if not self._require_auth(tag):
+            return
+        name = str(args[0])
+        mbox = self.account.get(name)
+        if mbox is None:
+            self._send(f"{tag} NO [NONEXISTENT] No existe\r\n")
+            return
+        items = []
+        for item in args[1]:
+            item = item.upper()
+            value = {
+                "MESSAGES": len(mbox.messages), "UIDNEXT": mbox.uidnext,
+                "UIDVALIDITY": mbox.uidvalidity, "UNSEEN": sum(1 for m in mbox.messages if "\\Seen" not in m.flags),
+                "HIGHESTMODSEQ": mbox.highestmodseq, "RECENT": 0,
+            }.get(item)
+            if value is not None:
+                items.append(f"{item} {value}")
+        self._send(f"* STATUS {_quote(name)} ({' '.join(items)})\r\n{tag} OK STATUS completed\r\n")
+
+    def _select(self, tag, args, readonly):
+        if not self._require_auth(tag):
+            return
+        name = str(args[0])
+        mbox = self.account.get(name)
+        if mbox is None:
+            self.mailbox = None
+            self._send(f"{tag} NO [NONEXISTENT] No existe la carpeta\r\n")
+            return
+        if len(args) > 1 and isinstance(args[1], list):
+            params = [str(p).upper() for p in args[1] if not isinstance(p, list)]
+            if "CONDSTORE" in params:
+                self.enabled.add("CONDSTORE")
+        self.mailbox = mbox
+        self.readonly = readonly
+        lines = [
+            "* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n",
+            f"* {len(mbox.messages)} EXISTS\r\n",
+            "* 0 RECENT\r\n",
+            f"* OK [UIDVALIDITY {mbox.uidvalidity}] UIDs valid\r\n",
+            f"* OK [UIDNEXT {mbox.uidnext}] Predicted next UID\r\n",
+            f"* OK [HIGHESTMODSEQ {mbox.highestmodseq}] Highest\r\n",
+        ]
+        mode = "READ-ONLY" if readonly else "READ-WRITE"
+        self._send("".join(lines) + f"{tag} OK [{mode}] Select completed\r\n")
+
+    def cmd_select(self, tag, args, raw):
+        self._select(tag, args, False)
+
+    def cmd_examine(self, tag, args, raw):
+        self._select(tag, args, True)
+
+    def cmd_close(self, tag, args, raw):
+        if self.mailbox is not None and not self.readonly:
+            self.mailbox.expunge()
+        self.mailbox = None
+        self._send(f"{tag} OK CLOSE completed\r\n")
+
+    def _require_selected(self, tag):
+        if self.mailbox is None:
+            self._send(f"{tag} NO No hay carpeta seleccionada\r\n")
+            return False
+        return True
+
+    def _resolve(self, spec, by_uid):
+        """Devuelve [(seq, mensaje)] para un conjunto de UIDs o de secuencia."""
+        msgs = self.mailbox.messages
+        if not msgs:
+            return []
+        if by_uid:
+            wanted = _parse_set(spec, msgs[-1].uid)
+            return [(i, m) for i, m in enumerate(msgs, 1) if m.uid in wanted]
+        wanted = _parse_set(spec, len(msgs))
+        return [(i, msgs[i - 1]) for i in sorted(wanted) if 1 <= i <= len(msgs)]
+
+    def cmd_uid(self, tag, args, raw):
+        sub = str(args[0]).upper()
+        handler = getattr(self, "_do_" + sub.lower(), None)
+        if handler is None:
+            self._send(f"{tag} BAD UID {sub} no soportado\r\n")
+            return
+        handler(tag, args[1:], True)
+
+    def cmd_fetch(self, tag, args, raw):
+        self._do_fetch(tag, args, False)
+
+    def cmd_search(self, tag, args, raw):
+        self._do_search(tag, args, False)
+
+    def cmd_store(self, tag, args, raw):
+        self._do_store(tag, args, False)
+
+    def cmd_copy(self, tag, args, raw):
+        self._do_copy(tag, args, False)
+
+    def cmd_move(self, tag, args, raw):
+        self._do_move(tag, args, False)
+
+    def cmd_expunge(self, tag, args, raw):
+        self._do_expunge(tag, [], False)
+
+    def _do_search(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        with self.mailbox.lock:
+            msgs = list(enumerate(self.mailbox.messages, 1))
+            i = 0
+            crit = [str(a).upper() if not isinstance(a, list) else a for a in args]
+            if crit and crit[0] == "CHARSET":
+                crit = crit[2:]
+            selected = msgs
+            while i < len(crit):
+                c = crit[i]
+                if c == "ALL":
+                    pass
+                elif c == "UID":
+                    wanted = _parse_set(crit[i + 1], msgs[-1][1].uid if msgs else 0)
+                    selected = [(s, m) for s, m in selected if m.uid in wanted]
+                    i += 1
+                elif c == "MODSEQ":
+                    modseq = int(crit[i + 1])
+                    selected = [(s, m) for s, m in selected if m.modseq > modseq]
+                    i += 1
+                elif c == "UNDELETED":
+                    selected = [(s, m) for s, m in selected if "\\Deleted" not in m.flags]
+                elif c == "DELETED":
+                    selected = [(s, m) for s, m in selected if "\\Deleted" in m.flags]
+                elif c[:1].isdigit() or c == "*":
+                    wanted = _parse_set(c, len(msgs))
+                    selected = [(s, m) for s, m in selected if s in wanted]
+                i += 1
+            values = [str(m.uid if by_uid else s) for s, m in selected]
+        self._send(f"* SEARCH {' '.join(values)}\r\n".replace("SEARCH \r\n", "SEARCH\r\n")
+                   + f"{tag} OK SEARCH completed\r\n")
+
+    def _fetch_item(self, msg, item):
+        """Devuelve la representación de un elemento de FETCH para un mensaje."""
+        upper = item.upper()
+        if upper == "UID":
+            return f"UID {msg.uid}".encode()
+        if upper == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(msg.flags))})".encode()
+        if upper == "INTERNALDATE":
+            date = time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime(msg.internaldate))
+            return f'INTERNALDATE "{date}"'.encode()
+        if upper == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(msg.body)}".encode()
+        if upper == "MODSEQ":
+            return f"MODSEQ ({msg.modseq})".encode()
+        if upper in ("RFC822", "BODY[]", "BODY.PEEK[]", "RFC822.PEEK"):
+            name = "RFC822" if upper.startswith("RFC822") else "BODY[]"
+            return f"{name} {{{len(msg.body)}}}\r\n".encode() + msg.body
+        if upper in ("RFC822.HEADER", "BODY.PEEK[HEADER]", "BODY[HEADER]"):
+            end = msg.body.find(b"\r\n\r\n")
+            data = msg.body[:end + 4] if end >= 0 else msg.body
+            name = "RFC822.HEADER" if upper.startswith("RFC822") else "BODY[HEADER]"
+            return f"{name} {{{len(data)}}}\r\n".encode() + data
+        if upper.startswith("BODY"):
+            section_start = item.index("[")
+            section_end = item.index("]")
+            section = item[section_start + 1:section_end]
+            partial = _PARTIAL_RE.search(item[section_end + 1:])
+            section_upper = section.upper()
+            if section_upper.startswith("HEADER.FIELDS"):
+                exclude = section_upper.startswith("HEADER.FIELDS.NOT")
+                names = section[section.index("(") + 1:section.rindex(")")].split()
+                data = _header_fields(msg.body, names, exclude)
+            elif section_upper == "TEXT":
+                end = msg.body.find(b"\r\n\r\n")
+                data = msg.body[end + 4:] if end >= 0 else b""
+            else:
+                data = msg.body
+            name = f"BODY[{section}]"
+            if partial:
+                offset = int(partial.group(1))
+                length = int(partial.group(2)) if partial.group(2) else len(data)
+                data = data[offset:offset + length]
+                name += f"<{offset}>"
+            return f"{name} {{{len(data)}}}\r\n".encode() + data
+        raise ValueError(f"elemento FETCH no soportado: {item}")
+
+    def _do_fetch(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        spec, items = args[0], args[1]
+        modifiers = args[2] if len(args) > 2 else []
+        if not isinstance(items, list):
+            items = {"ALL": ["FLAGS", "INTERNALDATE", "RFC822.SIZE"],
+                     "FAST": ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]}.get(str(items).upper(), [items])
+        items = list(items)
+        changedsince = None
+        vanished = False
+        i = 0
+        while i < len(modifiers):
+            mod = str(modifiers[i]).upper()
+            if mod == "CHANGEDSINCE":
+                changedsince = int(modifiers[i + 1])
+                i += 1
+            elif mod == "VANISHED":
+                vanished = True
+            i += 1
+        if by_uid and not any(str(it).upper() == "UID" for it in items):
+            items.insert(0, "UID")
+        if changedsince is not None and not any(str(it).upper() == "MODSEQ" for it in items):
+            items.append("MODSEQ")
+        out = []
+        with self.mailbox.lock:
+            if vanished and "QRESYNC" in self.enabled and changedsince is not None:
+                maximum = self.mailbox.uidnext
+                wanted = _parse_set(spec, maximum)
+                gone = [u for u, ms in self.mailbox.vanished if ms > changedsince and u in wanted]
+                if gone:
+                    out.append(f"* VANISHED (EARLIER) {_compact_set(gone)}\r\n".encode())
+            for seq, msg in self._resolve(spec, by_uid):
+                if changedsince is not None and msg.modseq <= changedsince:
+                    continue
+                parts = [self._fetch_item(msg, str(it)) for it in items]
+                out.append(f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        out.append(f"{tag} OK FETCH completed\r\n".encode())
+        self._send(b"".join(out))
+
+    def _do_store(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        if self.readonly:
+            self._send(f"{tag} NO Carpeta en solo lectura\r\n")
+            return
+        spec = args[0]
+        i = 1
+        if isinstance(args[i], list):  # (UNCHANGEDSINCE n)
+            i += 1
+        action = str(args[i]).upper()
+        flags = args[i + 1] if isinstance(args[i + 1], list) else [args[i + 1]]
+        flags = {str(f) for f in flags}
+        silent = action.endswith(".SILENT")
+        out = []
+        with self.mailbox.lock:
+            for seq, msg in self._resolve(spec, by_uid):
+                before = set(msg.flags)
+                if action.startswith("+"):
+                    msg.flags |= flags
+                elif action.startswith("-"):
+                    msg.flags -= flags
+                else:
+                    msg.flags = set(flags)
+                if msg.flags != before:
+                    msg.modseq = self.mailbox.bump_modseq()
+                if not silent:
+                    out.append(f"* {seq} FETCH (UID {msg.uid} FLAGS ({' '.join(sorted(msg.flags))}) MODSEQ ({msg.modseq}))\r\n")
+        self._send("".join(out) + f"{tag} OK STORE completed\r\n")
+
+    def _copy_messages(self, tag, args, by_uid):
+        spec, target_name = args[0], str(args[1])
+        target = self.account.get(target_name)
+        if target is None:
+            self._send(f"{tag} NO [TRYCREATE] No existe la carpeta destino\r\n")
+            return None
+        with self.mailbox.lock:
+            selected = self._resolve(spec, by_uid)
+        src_uids, dst_uids = [], []
+        for _, msg in selected:
+            new = target.add(msg.body, msg.flags, msg.internaldate)
+            src_uids.append(msg.uid)
+            dst_uids.append(new.uid)
+        code = f"COPYUID {target.uidvalidity} {_compact_set(src_uids)} {_compact_set(dst_uids)}" if src_uids else ""
+        return selected, code
+
+    def _do_copy(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        result = self._copy_messages(tag, args, by_uid)
+        if result is None:
+            return
+        _, code = result
+        self._send(f"{tag} OK [{code}] COPY completed\r\n" if code else f"{tag} OK COPY completed\r\n")
+
+    def _do_move(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        result = self._copy_messages(tag, args, by_uid)
+        if result is None:
+            return
+        selected, code = result
+        uids = {m.uid for _, m in selected}
+        with self.mailbox.lock:
+            for _, msg in selected:
+                msg.flags.add("\\Deleted")
+            removed = self.mailbox.expunge(uids)
+        out = f"* OK [{code}] Moved\r\n" if code else ""
+        out += "".join(f"* {seq} EXPUNGE\r\n" for seq in removed)
+        self._send(out + f"{tag} OK MOVE completed\r\n")
+
+    def _do_expunge(self, tag, args, by_uid):
+        if not self._require_selected(tag):
+            return
+        uids = None
+        if by_uid and args:
+            msgs = self.mailbox.messages
+            uids = _parse_set(args[0], msgs[-1].uid if msgs else 0)
+        removed = self.mailbox.expunge(uids)
+        self._send("".join(f"* {seq} EXPUNGE\r\n" for seq in removed) + f"{tag} OK EXPUNGE completed\r\n")
+
+    def cmd_append(self, tag, args, raw):
+        if not self._require_auth(tag):
+            return
+        name = str(args[0])
+        mbox = self.account.get(name)
+        if mbox is None:
+            self._send(f"{tag} NO [TRYCREATE] No existe la carpeta\r\n")
+            return
+        uids = []
+        i = 1
+        while i < len(args):
+            flags, date = (), None
+            if isinstance(args[i], list):
+                flags = [str(f) for f in args[i]]
+                i += 1
+            if isinstance(args[i], str):
+                try:
+                    date = time.mktime(time.strptime(args[i][:20], "%d-%b-%Y %H:%M:%S"))
+                except ValueError:
+                    date = None
+                i += 1
+            body = args[i]
+            i += 1
+            if not isinstance(body, bytes):
+                raise ValueError("se esperaba un literal")
+            uids.append(mbox.add(body, flags, date).uid)
+        self._send(f"{tag} OK [APPENDUID {mbox.uidvalidity} {_compact_set(uids)}] APPEND completed\r\n")
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fake, ssl_context=None):
+        self.fake = fake
+        self.ssl_context = ssl_context
+        super().__init__(address, _ClientHandler)
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, addr
+
+
+def _self_signed_context():
+    """Genera un certificado autofirmado con openssl y devuelve el contexto TLS del servidor."""
+    if shutil.which("openssl") is None:
+        raise RuntimeError("Para servir TLS hace falta el comando openssl (o usa tls=False).")
+    workdir = tempfile.mkdtemp(prefix="fakeimap-")
+    try:
+        cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+        result = subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+             "-days", "1", "-subj", "/CN=localhost"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"openssl no pudo generar el certificado: {result.stderr.decode(errors='replace')}")
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        return context
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class FakeIMAPServer:
+    """
+    Servidor IMAP falso que se ejecuta en un hilo del propio proceso.
+
+    :param latency: Segundos de espera antes de responder a cada comando (simula el RTT).
+    :param throttle_every: Cada N comandos responde NO [THROTTLED] sin ejecutarlo (0 = nunca).
+    :param disconnect_every: Cada N comandos envía BYE y cierra la conexión (0 = nunca).
+    :param tls: Si es True, sirve IMAP sobre TLS con un certificado autofirmado (necesita openssl).
+    :param capabilities: Capacidades anunciadas (por defecto ``DEFAULT_CAPABILITIES``).
+
+    ``stats`` cuenta los comandos (``commands``, ``cmd_<nombre>``), las esperas
+    de literal (``continuations``) y los bytes en cada sentido.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, throttle_every=0,
+                 disconnect_every=0, tls=True, capabilities=None):
+        self.accounts = {}
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.disconnect_every = disconnect_every
+        self.capabilities = list(capabilities if capabilities is not None else DEFAULT_CAPABILITIES)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._command_counter = 0
+        context = _self_signed_context() if tls else None
+        self.tls = tls
+        self._server = _ThreadingServer((host, port), self, context)
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def add_account(self, user, password):
+        account = FakeAccount(user, password)
+        self.accounts[user] = account
+        return account
+
+    def _count(self, key, amount):
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _inject_failure(self):
+        with self._stats_lock:
+            self._command_counter += 1
+            n = self._command_counter
+        if self.disconnect_every and n % self.disconnect_every == 0:
+            self._count("injected_bye", 1)
+            return "bye"
+        if self.throttle_every and n % self.throttle_every == 0:
+            self._count("injected_throttle", 1)
+            return "throttle"
+        return None
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {}
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor IMAP falso para pruebas")
+    parser.add_argument("--port", type=int, default=1993)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--distribution", choices=sorted(SIZE_DISTRIBUTIONS), default="small")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de espera por comando")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Responde NO [THROTTLED] cada N comandos")
+    parser.add_argument("--disconnect-every", type=int, default=0, help="Envía BYE y corta cada N comandos")
+    parser.add_argument("--plain", action="store_true", help="Sin TLS")
+    opts = parser.parse_args()
+    server = FakeIMAPServer(port=opts.port, latency=opts.latency, throttle_every=opts.throttle_every,
+                            disconnect_every=opts.disconnect_every, tls=not opts.plain)
+    origin = server.add_account("origen@example.com", "secreto")
+    server.add_account("destino@example.com", "secreto")
+    populate_mailbox(origin.get("INBOX"), opts.messages, opts.distribution)
+    print(f"Escuchando en {server.address} (TLS={server.tls}). Ctrl+C para salir.")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,324 @@
+# Banco de pruebas de rendimiento del motor contra el servidor IMAP falso
+# (bench/fake_imap_server.py), sin necesidad de una cuenta de correo real.
+#
+# Cada escenario se ejecuta en un proceso cliente nuevo, para que el pico de
+# memoria medido sea solo el suyo, y el servidor corre en otro proceso, así
+# los buzones sintéticos no cuentan como memoria del motor. Se mide el
+# análisis de una carpeta (get_fingerprint_index) y la copia completa
+# (run_sync_jobs con la tubería de descarga y subida). Los resultados se
+# añaden a bench/results.jsonl y se comparan con la ejecución anterior del
+# mismo escenario en la misma máquina.
+#
+#   python bench/run_benchmarks.py                  # small, large y mixed
+#   python bench/run_benchmarks.py huge --latency 0.02 --scale 0.5
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import mailtransfer_core as core
+from fake_imap_server import FakeIMAPServer, populate_mailbox
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = {
+    'small': {'messages': 10_000, 'distribution': 'small', 'description': "10.000 correos pequeños (2-8 KB)"},
+    'large': {'messages': 1_000, 'distribution': 'large', 'description': "1.000 correos grandes (100 KB-1 MB)"},
+    'mixed': {'messages': 3_000, 'distribution': 'mixed', 'description': "3.000 correos de tamaños mezclados"},
+    'huge': {'messages': 20, 'distribution': 'huge',
+             'description': "20 correos enormes (17-40 MB, se copian por partes)"},
+}
+DEFAULT_SCENARIOS = ['small', 'large', 'mixed']
+MODES = {'safe': core.SYNC_MODE_SAFE, 'incremental': core.SYNC_MODE_INCREMENTAL, 'force': core.SYNC_MODE_FORCE}
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results.jsonl')
+
+SOURCE_USER, DEST_USER, PASSWORD = 'origen@example.com', 'destino@example.com', 'secreto'
+# Campos que deben coincidir para comparar dos resultados
+COMPARABLE_FIELDS = ('machine', 'scenario', 'messages', 'distribution', 'mode', 'latency', 'throttle_every',
+                     'compress')
+
+
+def _serve(conn, messages, distribution, latency):
+    """Proceso del servidor: crea los buzones, sirve IMAP y atiende las peticiones del cliente."""
+    server = FakeIMAPServer(latency=latency)
+    source = server.add_account(SOURCE_USER, PASSWORD)
+    server.add_account(DEST_USER, PASSWORD)
+    populate_mailbox(source.get("INBOX"), messages, distribution)
+    server.start()
+    conn.send(server.port)
+    while True:
+        request, *args = conn.recv()
+        if request == 'stats':
+            conn.send(dict(server.stats))
+        elif request == 'reset':
+            server.reset_stats()
+            conn.send(True)
+        elif request == 'throttle':
+            server.throttle_every = args[0]
+            conn.send(True)
+        elif request == 'dest_messages':
+            mailbox = server.accounts[DEST_USER].get("INBOX")
+            conn.send(len(mailbox.messages))
+        elif request == 'stop':
+            server.stop()
+            conn.send(True)
+            return
+
+
+def _round_trips(stats):
+    """Idas y vueltas con el servidor: un comando, más una espera por cada literal sin LITERAL+."""
+    return stats.get('commands', 0) + stats.get('continuations', 0)
+
+
+def _traffic(hosts):
+    """Bytes de datos y bytes por la red (tras COMPRESS=DEFLATE) de varios servidores."""
+    payload = sum(h['sent_bytes'] + h['received_bytes'] for h in hosts)
+    wire = sum(h['sent_wire_bytes'] + h['received_wire_bytes'] for h in hosts)
+    return {'payload_bytes': payload, 'wire_bytes': wire}
+
+
+def _peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KB y macOS en bytes
+        return round(peak / (1048576 if sys.platform == 'darwin' else 1024), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return round(psutil.Process().memory_info().peak_wset / 1048576, 1)
+
+
+def _quiet(*args):
+    pass
+
+
+def _client(conn, scenario, options):
+    """Proceso cliente de un escenario: lanza el servidor, mide y devuelve el resultado por ``conn``."""
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    server_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=_serve, args=(child_conn, scenario['messages'], scenario['distribution'], options['latency']),
+        daemon=True)
+    server.start()
+    try:
+        host = f"127.0.0.1:{server_conn.recv()}"
+
+        def request(*message):
+            server_conn.send(message)
+            return server_conn.recv()
+
+        # Análisis de la carpeta de origen (cabeceras de todos los correos)
+        connection = core.connect_imap(host)
+        connection.login(SOURCE_USER, PASSWORD)
+        core.refresh_capabilities(connection)
+        if options['compress']:
+            connection.compress()
+        core.select_folder(connection, 'INBOX', readonly=True)
+        before = connection.traffic.snapshot()
+        request('reset')
+        start = time.perf_counter()
+        index = core.get_fingerprint_index(connection, _quiet, None)
+        seconds = time.perf_counter() - start
+        stats = request('stats')
+        after = connection.traffic.snapshot()
+        connection.logout()
+        scan = {
+            'messages': len(index), 'seconds': round(seconds, 3),
+            'messages_per_second': round(len(index) / seconds, 1) if seconds else None,
+            'round_trips': _round_trips(stats),
+            'payload_bytes': after['received_bytes'] - before['received_bytes'],
+            'wire_bytes': after['received_wire_bytes'] - before['received_wire_bytes'],
+        }
+
+        # Copia completa de la carpeta a un destino vacío
+        request('throttle', options['throttle_every'])
+        request('reset')
+        job = {'host1': host, 'user1': SOURCE_USER, 'pass1': PASSWORD,
+               'host2': host, 'user2': DEST_USER, 'pass2': PASSWORD,
+               'sync_mode': MODES[options['mode']], 'selected_folders': ['INBOX'], 'name': 'bench'}
+        summary = {}
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory(prefix='mailtransfer-bench-') as workdir:
+            os.chdir(workdir)  # El índice de estado local se crea aquí y se descarta
+            try:
+                start = time.perf_counter()
+                runs = core.run_sync_jobs([job], _quiet, _quiet, metrics_callback=summary.update,
+                                          compress=options['compress'])
+                seconds = time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+        stats = request('stats')
+        copied = summary['jobs'][0]
+        copy = {
+            'status': runs[0].status, 'messages': copied['appended'], 'bytes': copied['appended_bytes'],
+            'seconds': round(seconds, 3),
+            'messages_per_second': round(copied['appended'] / seconds, 1) if seconds else None,
+            'bytes_per_second': round(copied['appended_bytes'] / seconds, 1) if seconds else None,
+            'round_trips': _round_trips(stats),
+            'appends': stats.get('cmd_append', 0),
+            **_traffic(summary['traffic']),
+            'latency': {c['command']: {'count': c['count'], 'avg': c['avg'], 'p95': c['p95']}
+                        for c in summary['commands']},
+            'verified': request('dest_messages') == scenario['messages'],
+        }
+        request('stop')
+        conn.send({'scan': scan, 'copy': copy, 'peak_rss_mb': _peak_rss_mb()})
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+
+def run_scenario(name, options):
+    """
+    Ejecuta un escenario en un proceso nuevo.
+
+    :param options: Diccionario con ``scale``, ``mode``, ``latency``, ``throttle_every`` y ``compress``.
+    :return: Registro del resultado (ver ``COMPARABLE_FIELDS``), listo para guardar.
+    """
+    base = SCENARIOS[name]
+    scenario = {**base, 'messages': max(1, int(base['messages'] * options['scale']))}
+    parent_conn, child_conn = multiprocessing.Pipe()
+    client = multiprocessing.Process(target=_client, args=(child_conn, scenario, options))
+    client.start()
+    result = parent_conn.recv() if parent_conn.poll(options['timeout']) else {'error': "tiempo de espera agotado"}
+    client.join(5)
+    if client.is_alive():
+        client.terminate()
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(), 'machine': platform.node(), 'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenario': name, 'messages': scenario['messages'], 'distribution': scenario['distribution'],
+        'mode': options['mode'], 'latency': options['latency'], 'throttle_every': options['throttle_every'],
+        'compress': options['compress'],
+        **result,
+    }
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def load_results(path):
+    """Lee los resultados guardados (una línea JSON por escenario y ejecución)."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def previous_result(records, record):
+    """Último resultado comparable (misma máquina y mismos parámetros) sin error."""
+    for candidate in reversed(records):
+        if 'error' not in candidate and all(candidate.get(k) == record.get(k) for k in COMPARABLE_FIELDS):
+            return candidate
+    return None
+
+
+def _traffic_text(phase):
+    text = f"{phase['wire_bytes'] / 1048576:.1f} MB"
+    if phase['wire_bytes'] and phase['wire_bytes'] != phase['payload_bytes']:
+        text += f" ({phase['payload_bytes'] / 1048576:.1f} MB de datos, {phase['payload_bytes'] / phase['wire_bytes']:.1f}x)"
+    return text
+
+
+def _change(now, before):
+    if not now or not before:
+        return ""
+    return f"{100 * (now - before) / before:+.1f}%"
+
+
+def format_record(record, previous=None):
+    """Líneas de texto con el resultado de un escenario y su variación frente al anterior."""
+    header = (f"{record['scenario']} ({record['messages']} correos, {record['distribution']}, modo {record['mode']}"
+              f"{'' if record['compress'] else ', sin COMPRESS'})")
+    if 'error' in record:
+        return [header, f"  ERROR: {record['error']}"]
+    scan, copy = record['scan'], record['copy']
+    lines = [
+        header,
+        f"  análisis: {scan['messages']} correos en {scan['seconds']:.2f} s "
+        f"({scan['messages_per_second']:.0f} correos/s, {scan['round_trips']} idas y vueltas)",
+        f"  copia:    {copy['messages']} correos, {copy['bytes'] / 1048576:.1f} MB en {copy['seconds']:.2f} s "
+        f"({copy['messages_per_second']:.0f} correos/s, {copy['bytes_per_second'] / 1048576:.1f} MB/s, "
+        f"{copy['round_trips']} idas y vueltas, {copy['appends']} APPEND) [{copy['status']}]"
+        f"{'' if copy['verified'] else ' ¡FALTAN CORREOS EN EL DESTINO!'}",
+        f"  red:      análisis {_traffic_text(scan)}, copia {_traffic_text(copy)}",
+        f"  pico de memoria del cliente: {record['peak_rss_mb']} MB" if record['peak_rss_mb'] is not None
+        else "  pico de memoria del cliente: no disponible (instala psutil)",
+    ]
+    if previous is not None:
+        lines.append(
+            f"  frente a {previous['time']} ({previous.get('commit') or '?'}): "
+            f"análisis {_change(scan['messages_per_second'], previous['scan']['messages_per_second'])}, "
+            f"copia {_change(copy['messages_per_second'], previous['copy']['messages_per_second'])} correos/s, "
+            f"red {_change(copy['wire_bytes'], previous['copy'].get('wire_bytes'))}, "
+            f"memoria {_change(record['peak_rss_mb'], previous.get('peak_rss_mb'))}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el rendimiento del motor contra un servidor IMAP falso local.")
+    parser.add_argument("scenarios", nargs="*", metavar="ESCENARIO",
+                        help=f"Escenarios a ejecutar: {', '.join(SCENARIOS)} "
+                             f"(por defecto {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplica el número de correos de cada escenario")
+    parser.add_argument("--mode", choices=sorted(MODES), default="safe", help="Modo de sincronización de la copia")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de latencia del servidor por comando")
+    parser.add_argument("--throttle-every", type=int, default=0,
+                        help="Durante la copia el servidor responde NO [THROTTLED] cada N comandos")
+    parser.add_argument("--no-compress", action="store_true", help="No usa COMPRESS=DEFLATE")
+    parser.add_argument("--timeout", type=float, default=3600, help="Segundos máximos por escenario")
+    parser.add_argument("--results", default=RESULTS_FILE, help=f"Fichero de resultados (por defecto {RESULTS_FILE})")
+    parser.add_argument("--no-save", action="store_true", help="No guarda los resultados")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"escenario desconocido: {', '.join(unknown)}")
+
+    options = {'scale': args.scale, 'mode': args.mode, 'latency': args.latency,
+               'throttle_every': args.throttle_every, 'compress': not args.no_compress, 'timeout': args.timeout}
+    history = load_results(args.results)
+    failed = False
+    for name in args.scenarios or DEFAULT_SCENARIOS:
+        print(f"Ejecutando {name}: {SCENARIOS[name]['description']}...", flush=True)
+        record = run_scenario(name, options)
+        print("\n".join(format_record(record, previous_result(history, record))), flush=True)
+        failed = failed or 'error' in record or not record['copy']['verified']
+        if not args.no_save:
+            with open(args.results, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        history.append(record)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
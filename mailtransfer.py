@@ -1,229 +1,37 @@
 import tkinter as tk
 from tkinter import messagebox
 import customtkinter as ctk
-import imaplib
 import threading
-import email
-import time
-import re
-from queue import Queue
-import traceback
 import logging
+from queue import Queue
 
-# --- CONFIGURACIÓN DEL LOGGING ---
-# Crea un archivo de log que registrará todos los eventos y errores.
-logging.basicConfig(
-    filename='sincronizacion.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding='utf-8'
+from mailtransfer_core import (
+    setup_logging, list_folders_native, run_sync_jobs, SYNC_MODES, SYNC_MODE_SAFE,
+    MAX_PARALLEL_FOLDERS, MAX_CONNECTIONS_PER_HOST, MAX_CONNECTIONS_PER_ACCOUNT,
 )
+from mailtransfer_metrics import format_duration
 
-# --- LÓGICA DE SINCRONIZACIÓN ---
-
-def get_message_id_map(connection, log_callback, widgets):
-    """
-    Analiza una carpeta de correo para obtener un diccionario que mapea
-    el Message-ID de cada correo a su UID.
-
-    Este método procesa los correos uno a uno para garantizar la máxima fiabilidad,
-    aunque sea más lento que los métodos por lotes.
-
-    :param connection: Conexión imaplib activa.
-    :param log_callback: Función para enviar actualizaciones a la GUI.
-    :param widgets: Diccionario de widgets de la GUI para el callback.
-    :return: Diccionario con {message_id: uid}.
-    """
-    id_map = {}
-    typ, data = connection.uid('search', None, 'ALL')
-    if typ != 'OK' or not data[0]:
-        return {}
-    
-    uid_list = data[0].split()
-    if not uid_list:
-        return {}
-
-    total_uids = len(uid_list)
-    log_callback(widgets, f"Análisis Seguro: {total_uids} correos...", "gray")
-    logging.info(f"Iniciando análisis de {total_uids} correos.")
-    
-    for i, uid in enumerate(uid_list):
-        if (i + 1) % 50 == 0:  # Actualiza la UI cada 50 correos para no saturar
-            log_callback(widgets, f"Análisis Seguro: {i + 1}/{total_uids}...", "gray")
-        
-        try:
-            typ, fetch_data = connection.uid('fetch', uid, '(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
-            if typ != 'OK' or not fetch_data:
-                continue
-
-            # Une la respuesta por si el servidor la envía fragmentada
-            full_response_str = b"".join(
-                part for part in fetch_data if isinstance(part, bytes)
-            ).decode('utf-8', 'ignore')
-
-            if isinstance(fetch_data[0], tuple):
-                full_response_str += fetch_data[0][0].decode('utf-8', 'ignore') + fetch_data[0][1].decode('utf-8', 'ignore')
-            
-            msg_id_match = re.search(r'Message-ID:\s*<(.*?)>', full_response_str, re.IGNORECASE | re.DOTALL)
-            if msg_id_match:
-                msg_id = msg_id_match.group(1).strip()
-                id_map[msg_id] = uid
-        except Exception:
-            continue
-            
-    logging.info(f"Análisis completado. Se encontraron {len(id_map)} Message-IDs.")
-    return id_map
+setup_logging()
 
+# Cada cuántos segundos se actualizan la velocidad y el tiempo restante de cada tarea
+GUI_METRICS_INTERVAL = 1.0
+# Milisegundos entre dos refrescos de la lista: los hilos del motor solo anotan el
+# último estado de cada tarea y la GUI pinta las filas visibles de una vez a este ritmo
+GUI_FRAME_MS = 100
+# Alto estimado de una fila de cuenta hasta que se puede medir la primera
+JOB_ROW_HEIGHT = 190
+JOB_ROW_PADY = 10
 
-def list_folders_native(host, user, password, queue):
-    """
-    Obtiene la lista de carpetas de una cuenta IMAP y la pone en una cola
-    para ser leída por el hilo principal de la GUI.
-    """
-    try:
-        with imaplib.IMAP4_SSL(host) as mail:
-            mail.login(user, password)
-            status, folders_raw = mail.list()
-            if status != 'OK':
-                queue.put({'status': 'error', 'message': 'El servidor denegó la petición de listar carpetas.'})
-                return
-            
-            folder_names = []
-            pattern = re.compile(r'\((.*?)\)\s+"(.*?)"\s+(.*)')
-            for folder_info_bytes in folders_raw:
-                line = folder_info_bytes.decode('utf-8', 'ignore')
-                match = pattern.match(line)
-                if match:
-                    name = match.group(3).strip().strip('"')
-                    if name:  # Evita añadir carpetas raíz sin nombre
-                        folder_names.append(name)
-            if folder_names:
-                queue.put({'status': 'success', 'folders': sorted(list(set(folder_names)))})
-            else:
-                queue.put({'status': 'error', 'message': "No se encontraron carpetas analizables."})
-    except Exception as e:
-        queue.put({'status': 'error', 'message': f"Error crítico: {e}"})
-
-
-def execute_sync_job_native(job_data, log_callback, progress_callback):
-    """
-    Ejecuta el trabajo de sincronización para una cuenta, usando el modo seleccionado.
-    """
-    widgets = job_data['widgets']
-    # Recoge todos los datos de la GUI
-    host1, user1, pass1, host2, user2, pass2 = (widgets[k].get() for k in ["host1", "user1", "pass1", "host2", "user2", "pass2"])
-    sync_mode = widgets["sync_mode"].get()
-    
-    logging.info("="*60)
-    logging.info(f"INICIO DE SINCRONIZACIÓN ({sync_mode}): {user1} -> {user2}")
-    
-    try:
-        log_callback(widgets, "Conectando...", "cyan")
-        with imaplib.IMAP4_SSL(host1) as source, imaplib.IMAP4_SSL(host2) as dest:
-            source.login(user1, pass1)
-            logging.info(f"Conexión exitosa al origen: {host1}")
-            dest.login(user2, pass2)
-            logging.info(f"Conexión exitosa al destino: {host2}")
-            log_callback(widgets, "Conexión exitosa.", "cyan")
-
-            selected_folders = job_data.get("selected_folders", [])
-            
-            # Si no hay carpetas seleccionadas, obtiene todas las del servidor.
-            if not selected_folders:
-                log_callback(widgets, "Listando todas las carpetas del origen...", "gray")
-                logging.info("No se seleccionaron carpetas, procediendo a listar todas.")
-                status, folders_raw = source.list()
-                if status == 'OK':
-                    folders = []
-                    pattern = re.compile(r'\((.*?)\)\s+"(.*?)"\s+(.*)')
-                    for folder_info_bytes in folders_raw:
-                        line = folder_info_bytes.decode('utf-8', 'ignore')
-                        match = pattern.match(line)
-                        if match:
-                            name = match.group(3).strip().strip('"')
-                            if name: folders.append(name)
-                    selected_folders = sorted(list(set(folders)))
-                    logging.info(f"Se encontraron {len(selected_folders)} carpetas para sincronizar.")
-                else:
-                    log_callback(widgets, "Error: No se pudo obtener la lista de carpetas.", "red")
-                    logging.error("Fallo al ejecutar source.list()")
-                    return
-
-            # Itera sobre cada carpeta para sincronizarla
-            total_folders = len(selected_folders)
-            for i, folder_name in enumerate(selected_folders):
-                try:
-                    log_callback(widgets, f"Carpeta ({i+1}/{total_folders}): {folder_name}", "white")
-                    logging.info(f"--- Procesando carpeta: {folder_name} ---")
-                    
-                    # Crea la carpeta en el destino y se suscribe para que sea visible
-                    dest.create(f'"{folder_name}"')
-                    dest.subscribe(f'"{folder_name}"')
-                    
-                    source.select(f'"{folder_name}"', readonly=True)
-                    
-                    uids_to_fetch = []
-                    # Lógica para el modo "Forzar Copia", que es más rápido pero puede duplicar
-                    if "Forzar Copia" in sync_mode:
-                        log_callback(widgets, "Modo Forzar Copia: Obteniendo todos los correos...", "yellow")
-                        logging.info("Modo Forzar Copia. Obteniendo todos los UIDs del origen.")
-                        typ, data = source.uid('search', None, 'ALL')
-                        if typ == 'OK' and data[0]:
-                            uids_to_fetch = data[0].split()
-                    else:  # Modo por defecto: "Sincronización Segura"
-                        source_id_map = get_message_id_map(source, log_callback, widgets)
-                        dest.select(f'"{folder_name}"')
-                        dest_id_map = get_message_id_map(dest, log_callback, widgets)
-                        missing_message_ids = set(source_id_map.keys()) - set(dest_id_map.keys())
-                        uids_to_fetch = [source_id_map[msg_id] for msg_id in missing_message_ids]
-                    
-                    if not uids_to_fetch:
-                        log_callback(widgets, "No hay correos nuevos que copiar.", "green")
-                        progress_callback(widgets, 1, 1)
-                        logging.info("Carpeta ya sincronizada.")
-                        continue
-                    
-                    log_callback(widgets, f"Copiando {len(uids_to_fetch)} correos...", "cyan")
-                    logging.info(f"Se copiarán {len(uids_to_fetch)} correos nuevos.")
-                    total_missing = len(uids_to_fetch)
-                    progress_callback(widgets, 0, total_missing)
-                    
-                    # Bucle principal para copiar cada correo
-                    for j, uid in enumerate(uids_to_fetch):
-                        _, msg_data = source.uid('fetch', uid, '(INTERNALDATE FLAGS RFC822)')
-                        if not msg_data or msg_data[0] is None: continue
-                        
-                        metadata, content = msg_data[0][0].decode('utf-8', 'ignore'), msg_data[0][1]
-                        
-                        flags_match = re.search(r'FLAGS\s\((.*?)\)', metadata)
-                        flags_string = f"({flags_match.group(1)})" if flags_match else None
-                        
-                        date_match = re.search(r'INTERNALDATE\s"([^"]+)"', metadata)
-                        internal_date = imaplib.Time2Internaldate(time.time())
-                        if date_match:
-                            try:
-                                dt = email.utils.parsedate_to_datetime(date_match.group(1))
-                                internal_date = imaplib.Time2Internaldate(dt.timestamp())
-                            except Exception:
-                                pass
-                        
-                        dest.append(f'"{folder_name}"', flags_string, internal_date, content)
-                        progress_callback(widgets, j + 1, total_missing)
-                except Exception as e:
-                    log_callback(widgets, f"Error en carpeta {folder_name}: {e}", "orange")
-                    logging.error(f"FALLO en la carpeta {folder_name}: {e}\n{traceback.format_exc()}")
-        
-        log_callback(widgets, "¡Sincronización Completada!", "green")
-        logging.info("FIN DE SINCRONIZACIÓN.")
-    except Exception as e:
-        log_callback(widgets, f"Error Crítico: {e}", "red")
-        logging.critical(f"FALLO CRÍTICO en la sincronización: {e}\n{traceback.format_exc()}")
-
+ENTRY_FIELDS = ("host1", "user1", "pass1", "host2", "user2", "pass2", "dest_prefix")
 
 # --- CLASE PRINCIPAL DE LA INTERFAZ GRÁFICA ---
 class ModernSyncApp(ctk.CTk):
     """
     Clase principal de la aplicación con GUI basada en CustomTkinter.
+
+    Las cuentas se guardan en ``self.jobs`` (datos, sin widgets) y la lista solo
+    crea las filas que caben en la ventana: al desplazarse, las mismas filas se
+    vuelven a rellenar con otras cuentas, así cientos de cuentas no pesan más que unas pocas.
     """
     def __init__(self):
         """Inicializa la ventana principal y sus componentes."""
@@ -235,9 +43,11 @@ class ModernSyncApp(ctk.CTk):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
         
-        self.jobs, self.active_threads = [], []
+        self.jobs, self.active_threads, self.jobs_by_name = [], [], {}
+        self.rows, self.first_job, self.running = [], 0, False
         self._create_widgets()
         self.add_job_row()
+        self.after(GUI_FRAME_MS, self.refresh)
 
     def _create_widgets(self):
         """Crea todos los widgets de la ventana principal."""
@@ -253,16 +63,55 @@ class ModernSyncApp(ctk.CTk):
         self.sync_all_button = ctk.CTkButton(controls_frame, text="Sincronizar Todo", command=self.start_all_jobs)
         self.sync_all_button.pack(side="left", padx=5)
         
+        self.stop_button = ctk.CTkButton(controls_frame, text="Detener", command=self.stop_all_jobs, state="disabled", fg_color="#a33", hover_color="#822")
+        self.stop_button.pack(side="left", padx=5)
+        
         self.theme_button = ctk.CTkButton(controls_frame, text="Cambiar Tema", command=self.toggle_theme, fg_color="gray", hover_color="#555555")
         self.theme_button.pack(side="right", padx=5)
         
-        self.scrollable_frame = ctk.CTkScrollableFrame(self, label_text="Cuentas a Sincronizar")
-        self.scrollable_frame.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        # Límites de concurrencia del planificador
+        self.limit_entries = {}
+        for key, label, default in (("max_per_account", "Conex./cuenta", MAX_CONNECTIONS_PER_ACCOUNT),
+                                    ("max_per_host", "Conex./servidor", MAX_CONNECTIONS_PER_HOST),
+                                    ("max_workers", "Carpetas a la vez", MAX_PARALLEL_FOLDERS)):
+            entry = ctk.CTkEntry(controls_frame, width=45)
+            entry.insert(0, str(default))
+            entry.pack(side="right", padx=(0, 10))
+            ctk.CTkLabel(controls_frame, text=label).pack(side="right", padx=(5, 2))
+            self.limit_entries[key] = (entry, default)
+        
+        # Lista virtual de cuentas: un marco con las filas visibles y su propia barra de desplazamiento
+        list_frame = ctk.CTkFrame(self)
+        list_frame.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        list_frame.grid_columnconfigure(0, weight=1)
+        list_frame.grid_rowconfigure(1, weight=1)
+        self.list_title = ctk.CTkLabel(list_frame, text="Cuentas a Sincronizar")
+        self.list_title.grid(row=0, column=0, columnspan=2, pady=(5, 0))
+        self.rows_frame = ctk.CTkFrame(list_frame, fg_color="transparent")
+        self.rows_frame.grid(row=1, column=0, sticky="nsew")
+        self.rows_frame.grid_propagate(False)
+        self.rows_frame.grid_columnconfigure(0, weight=1)
+        self.rows_frame.bind("<Configure>", self.on_list_resize)
+        self.list_scrollbar = ctk.CTkScrollbar(list_frame, command=self.on_list_scroll)
+        self.list_scrollbar.grid(row=1, column=1, sticky="ns", padx=(0, 5), pady=5)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.bind_all(sequence, self.on_mouse_wheel, add="+")
+
+    def new_job(self):
+        """Datos de una cuenta nueva. Los hilos del motor solo escriben ``status``, ``progress`` y ``rate``."""
+        return {"values": {**{field: "" for field in ENTRY_FIELDS}, "sync_mode": SYNC_MODE_SAFE, "propagate_expunge": False},
+                "selected_folders": [], "cancel_event": None,
+                "status": ("Listo.", None), "progress": 0.0, "rate": ""}
 
     def add_job_row(self):
-        """Añade una nueva fila de widgets para una nueva cuenta a sincronizar."""
-        job_frame = ctk.CTkFrame(self.scrollable_frame)
-        job_frame.pack(pady=10, padx=10, fill="x", expand=True)
+        """Añade una nueva cuenta a sincronizar y desplaza la lista hasta ella."""
+        self.jobs.append(self.new_job())
+        self.first_job = len(self.jobs)
+        self.show_rows()
+
+    def _create_row(self):
+        """Crea los widgets de una fila de la lista, sin cuenta asignada."""
+        job_frame = ctk.CTkFrame(self.rows_frame)
         
         for i in range(6): job_frame.grid_columnconfigure(i, weight=1 if i % 2 != 0 else 0)
         
@@ -291,12 +140,22 @@ class ModernSyncApp(ctk.CTk):
         selected_folders_label = ctk.CTkLabel(options_frame, text="Carpetas: Todas", text_color="gray", anchor="w")
         selected_folders_label.pack(side="left", padx=10, fill="x", expand=True)
         
+        # Prefijo opcional para reorganizar: las carpetas se copian como <prefijo>/<carpeta> en el destino
+        ctk.CTkLabel(options_frame, text="Prefijo destino:").pack(side="left", padx=(10, 5))
+        entries["dest_prefix"] = ctk.CTkEntry(options_frame, placeholder_text="(ninguno)", width=140)
+        entries["dest_prefix"].pack(side="left")
+        
         ctk.CTkLabel(options_frame, text="Modo:").pack(side="left", padx=(10, 5))
-        sync_mode_combo = ctk.CTkComboBox(options_frame, values=["Sincronización Segura (lenta)", "Forzar Copia (rápida)"], width=220)
-        sync_mode_combo.set("Sincronización Segura (lenta)")
+        sync_mode_combo = ctk.CTkComboBox(options_frame, values=SYNC_MODES, width=220)
+        sync_mode_combo.set(SYNC_MODE_SAFE)
         sync_mode_combo.pack(side="left")
         entries["sync_mode"] = sync_mode_combo
         
+        # Solo se usa en modo incremental: borra en el destino lo que se borró en el origen
+        propagate_expunge_check = ctk.CTkCheckBox(options_frame, text="Propagar borrados")
+        propagate_expunge_check.pack(side="left", padx=(10, 0))
+        entries["propagate_expunge"] = propagate_expunge_check
+        
         # Widgets para el progreso
         progress_frame = ctk.CTkFrame(job_frame, fg_color="transparent")
         progress_frame.grid(row=3, column=0, columnspan=6, pady=5, padx=10, sticky="ew")
@@ -305,15 +164,125 @@ class ModernSyncApp(ctk.CTk):
         progress_bar = ctk.CTkProgressBar(progress_frame)
         progress_bar.set(0)
         progress_bar.pack(side="right", fill="x")
+        # Velocidad y tiempo restante, junto a la barra de progreso
+        rate_label = ctk.CTkLabel(progress_frame, text="", anchor="e", text_color="gray")
+        rate_label.pack(side="right", padx=10)
         
-        job_data = {"selected_folders": [], "widgets": {**entries, "progress_bar": progress_bar, "status_label": status_label, "list_folders_button": list_folders_button, "selected_folders_label": selected_folders_label}}
-        list_folders_button.configure(command=lambda j=job_data: self.show_folder_selection(j))
-        self.jobs.append(job_data)
+        # 'shown' guarda lo que la fila está mostrando, para no reconfigurar widgets sin cambios
+        row = {"frame": job_frame, "job": None, "shown": {}, "default_color": status_label.cget("text_color"),
+               "widgets": {**entries, "progress_bar": progress_bar, "status_label": status_label, "rate_label": rate_label, "list_folders_button": list_folders_button, "selected_folders_label": selected_folders_label}}
+        list_folders_button.configure(command=lambda r=row: self.show_folder_selection(r["job"]))
+        job_frame.grid(row=len(self.rows), column=0, pady=JOB_ROW_PADY // 2, padx=10, sticky="ew")
+        return row
+
+    def _store_row(self, row):
+        """Guarda en la cuenta de la fila lo que el usuario ha escrito en ella."""
+        job, widgets = row["job"], row["widgets"]
+        if job is None:
+            return
+        job["values"].update({key: widgets[key].get() for key in (*ENTRY_FIELDS, "sync_mode")},
+                             propagate_expunge=bool(widgets["propagate_expunge"].get()))
+
+    def _store_rows(self):
+        for row in self.rows:
+            self._store_row(row)
+
+    def _bind_row(self, row, job):
+        """Muestra en la fila los datos de otra cuenta (o la oculta si no hay)."""
+        row["job"], row["shown"] = job, {}
+        if job is None:
+            row["frame"].grid_remove()
+            return
+        row["frame"].grid()
+        widgets, values = row["widgets"], job["values"]
+        self._set_row_state(row, "normal")
+        for key in ENTRY_FIELDS:
+            widgets[key].delete(0, "end")
+            if values[key]:
+                widgets[key].insert(0, values[key])
+        widgets["sync_mode"].set(values["sync_mode"])
+        widgets["propagate_expunge"].select() if values["propagate_expunge"] else widgets["propagate_expunge"].deselect()
+        self._set_row_state(row, "disabled" if self.running else "normal")
+        self._render_row(row)
+
+    def _render_row(self, row):
+        """Pinta el estado de la cuenta de la fila; solo toca los widgets cuyo valor ha cambiado."""
+        job, widgets, shown = row["job"], row["widgets"], row["shown"]
+        num = len(job["selected_folders"])
+        current = {"status": job["status"], "progress": job["progress"], "rate": job["rate"],
+                   "folders": f"Carpetas: {num} seleccionadas" if num > 0 else "Carpetas: Todas"}
+        for key, value in current.items():
+            if shown.get(key) == value:
+                continue
+            shown[key] = value
+            if key == "status":
+                widgets["status_label"].configure(text=value[0], text_color=value[1] or row["default_color"])
+            elif key == "progress":
+                widgets["progress_bar"].set(value)
+            elif key == "rate":
+                widgets["rate_label"].configure(text=value)
+            else:
+                widgets["selected_folders_label"].configure(text=value)
+
+    def show_rows(self):
+        """Asigna a las filas visibles las cuentas a partir de ``self.first_job``."""
+        visible = len(self.rows)
+        self.first_job = max(0, min(self.first_job, len(self.jobs) - visible))
+        # Primero se guardan todas: una cuenta puede pasar de una fila a otra
+        self._store_rows()
+        for i, row in enumerate(self.rows):
+            index = self.first_job + i
+            job = self.jobs[index] if index < len(self.jobs) else None
+            if row["job"] is not job:
+                self._bind_row(row, job)
+        total = len(self.jobs)
+        if visible and total > visible:
+            self.list_scrollbar.set(self.first_job / total, (self.first_job + visible) / total)
+            self.list_title.configure(text=f"Cuentas a Sincronizar ({self.first_job + 1}-{min(self.first_job + visible, total)} de {total})")
+        else:
+            self.list_scrollbar.set(0, 1)
+            self.list_title.configure(text="Cuentas a Sincronizar")
+
+    def on_list_resize(self, event):
+        """Crea o quita filas para que la lista tenga las que caben en su alto."""
+        row_height = self.rows[0]["frame"].winfo_reqheight() + JOB_ROW_PADY if self.rows else JOB_ROW_HEIGHT
+        visible = max(1, event.height // max(row_height, 1))
+        if visible == len(self.rows):
+            return
+        self._store_rows()
+        while len(self.rows) < visible:
+            self.rows.append(self._create_row())
+            self._bind_row(self.rows[-1], None)
+        while len(self.rows) > visible:
+            self.rows.pop()["frame"].destroy()
+        self.show_rows()
+
+    def scroll_jobs(self, first_job):
+        if first_job != self.first_job:
+            self.first_job = first_job
+            self.show_rows()
+
+    def on_list_scroll(self, action, value, unit=None):
+        """Comando de la barra de desplazamiento: ('moveto', fracción) o ('scroll', n, 'units'/'pages')."""
+        if action == "moveto":
+            self.scroll_jobs(round(float(value) * len(self.jobs)))
+        else:
+            step = len(self.rows) if unit == "pages" else 1
+            self.scroll_jobs(self.first_job + int(value) * step)
+
+    def on_mouse_wheel(self, event):
+        """Desplaza la lista una cuenta por paso de la rueda, si el ratón está sobre ella."""
+        widget = self.winfo_containing(event.x_root, event.y_root)
+        if widget is None or not str(widget).startswith(str(self.rows_frame)):
+            return
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.scroll_jobs(self.first_job + (-1 if up else 1))
     
     def show_folder_selection(self, job_data):
         """Abre una ventana emergente para que el usuario seleccione las carpetas."""
-        widgets = job_data["widgets"]
-        host, user, password = widgets["host1"].get(), widgets["user1"].get(), widgets["pass1"].get()
+        self._store_rows()
+        values = job_data["values"]
+        host, user, password = values["host1"], values["user1"], values["pass1"]
         if not all([host, user, password]):
             messagebox.showerror("Error", "Rellena los datos de la Cuenta de Origen."); return
         
@@ -355,46 +324,117 @@ class ModernSyncApp(ctk.CTk):
             ctk.CTkCheckBox(scroll_frame, text=folder, variable=var).pack(anchor="w", padx=10, pady=2)
             
         def save():
+            # La fila de la cuenta muestra el número de carpetas en el siguiente refresco
             job_data["selected_folders"] = [f for f, v in vars.items() if v.get()]
-            label = job_data["widgets"]["selected_folders_label"]
-            num = len(job_data['selected_folders'])
-            label.configure(text=f"Carpetas: {num} seleccionadas" if num > 0 else "Carpetas: Todas")
             popup.destroy()
             
         ctk.CTkButton(button_frame, text="Guardar Selección", command=save).pack()
     
+    def read_limits(self):
+        """Lee los límites de concurrencia de la GUI; los valores no válidos usan el predeterminado."""
+        limits = {}
+        for key, (entry, default) in self.limit_entries.items():
+            try:
+                limits[key] = max(1, int(entry.get()))
+            except ValueError:
+                limits[key] = default
+        return limits
+
+    def job_config(self, job_data, number):
+        """Convierte los datos de una cuenta de la GUI en la tarea que espera el motor."""
+        config = dict(job_data["values"])
+        name = f"{number}:{config['user1']}->{config['user2']}"
+        # El motor pasa 'widgets' tal cual a los callbacks: aquí es el nombre de la tarea
+        config.update(selected_folders=list(job_data["selected_folders"]), name=name,
+                      widgets=name, cancel_event=job_data["cancel_event"])
+        return config
+
     def start_all_jobs(self):
-        """Inicia todos los hilos de sincronización para cada cuenta configurada."""
+        """Inicia la sincronización de todas las cuentas configuradas en un planificador común."""
+        self._store_rows()
         self.toggle_buttons_state("disabled")
-        self.active_threads = []
-        for job in self.jobs:
-            self.update_status(job["widgets"], "Iniciando...", "cyan")
-            job["widgets"]["progress_bar"].set(0)
-            thread = threading.Thread(target=execute_sync_job_native, args=(job, self.update_status, self.update_progress), daemon=True)
-            self.active_threads.append(thread)
-            thread.start()
-        self.after(100, self.check_all_threads_done)
+        jobs = []
+        self.jobs_by_name = {}
+        for number, job in enumerate(self.jobs, 1):
+            job.update(cancel_event=threading.Event(), status=("Iniciando...", "cyan"), progress=0.0, rate="")
+            # El desplegable del modo es editable: un modo mal escrito solo deja fuera su cuenta
+            sync_mode = job["values"]["sync_mode"]
+            if sync_mode not in SYNC_MODES:
+                job["status"] = (f"Error: modo de sincronización desconocido '{sync_mode}'.", "red")
+                logging.error(f"Cuenta {number}: modo de sincronización desconocido '{sync_mode}', no se sincroniza.")
+                continue
+            config = self.job_config(job, number)
+            jobs.append(config)
+            self.jobs_by_name[config["name"]] = job
+        if not jobs:
+            self.toggle_buttons_state("normal")
+            return
+        thread = threading.Thread(target=run_sync_jobs, args=(jobs, self.update_status, self.update_progress),
+                                  kwargs={**self.read_limits(), "metrics_callback": self.update_metrics,
+                                          "metrics_interval": GUI_METRICS_INTERVAL}, daemon=True)
+        self.active_threads = [thread]
+        thread.start()
     
-    def check_all_threads_done(self):
-        """Verifica si todos los hilos de trabajo han terminado."""
-        if any(t.is_alive() for t in self.active_threads):
-            self.after(200, self.check_all_threads_done)
-        else:
+    def stop_all_jobs(self):
+        """Pide a todas las sincronizaciones en curso que se detengan."""
+        for job in self.jobs:
+            if job.get("cancel_event"):
+                job["cancel_event"].set()
+                job["status"] = ("Deteniendo...", "yellow")
+        logging.info("Detención solicitada por el usuario.")
+
+    def refresh(self):
+        """
+        Refresco periódico de la GUI: pinta en una sola pasada el último estado de
+        las filas visibles y comprueba si el planificador ha terminado.
+        """
+        for row in self.rows:
+            if row["job"] is not None:
+                self._render_row(row)
+        if self.active_threads and not any(t.is_alive() for t in self.active_threads):
+            self.active_threads = []
             self.toggle_buttons_state("normal")
             logging.info("Todas las tareas han finalizado.")
+        self.after(GUI_FRAME_MS, self.refresh)
     
     # --- Funciones de actualización de la GUI ---
-    def update_status(self, widgets, message, color): self.after(0, lambda: widgets["status_label"].configure(text=message, text_color=color))
-    def update_progress(self, widgets, value, total): self.after(0, lambda: widgets["progress_bar"].set(value / total if total > 0 else 0))
+    # Se llaman desde los hilos del motor: solo anotan el último valor de la tarea
+    # (una asignación, sin bloqueos ni eventos de Tk) y refresh() lo pinta.
+    def update_status(self, job_name, message, color):
+        job = self.jobs_by_name.get(job_name)
+        if job is not None:
+            job["status"] = (message, color)
+    def update_progress(self, job_name, value, total):
+        job = self.jobs_by_name.get(job_name)
+        if job is not None:
+            job["progress"] = value / total if total > 0 else 0
+    def update_metrics(self, snapshot):
+        """Anota la velocidad de cada tarea y el tiempo restante (o el total al terminar)."""
+        for job in snapshot["jobs"]:
+            job_data = self.jobs_by_name.get(job["name"])
+            if job_data is None:
+                continue
+            text = f"{job['messages_per_second']:.1f} correos/s · {job['bytes_per_second'] / 1048576:.2f} MB/s"
+            if snapshot["final"]:
+                text += f" · {format_duration(job['seconds'])}"
+            elif job["eta_seconds"] is not None:
+                text += f" · quedan {format_duration(job['eta_seconds'])}"
+            job_data["rate"] = text
     def toggle_theme(self): ctk.set_appearance_mode("light" if ctk.get_appearance_mode() == "Dark" else "dark")
+    def _set_row_state(self, row, state):
+        for key in ("list_folders_button", "sync_mode", "propagate_expunge", "dest_prefix"):
+            row["widgets"][key].configure(state=state)
     def toggle_buttons_state(self, state):
+        self.running = state == "disabled"
         self.add_button.configure(state=state)
         self.sync_all_button.configure(state=state)
         self.theme_button.configure(state=state)
-        for job in self.jobs: 
-            job["widgets"]["list_folders_button"].configure(state=state)
-            job["widgets"]["sync_mode"].configure(state=state)
+        self.stop_button.configure(state="normal" if state == "disabled" else "disabled")
+        for entry, _ in self.limit_entries.values():
+            entry.configure(state=state)
+        for row in self.rows:
+            self._set_row_state(row, state)
 
 if __name__ == "__main__":
     app = ModernSyncApp()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from mailtransfer_core import (
+    setup_logging, run_sync_jobs, LOG_FILE, SYNC_MODES, SYNC_MODE_SAFE, SYNC_MODE_INCREMENTAL, SYNC_MODE_FORCE,
+    MAX_PARALLEL_FOLDERS, MAX_CONNECTIONS_PER_HOST, MAX_CONNECTIONS_PER_ACCOUNT,
+)
+
+# Segundos entre dos líneas de métricas por defecto (0 = solo el resumen final)
+DEFAULT_METRICS_INTERVAL = 10.0
+
+# --- CÓDIGOS DE SALIDA ---
+# Cada tarea termina con uno de estos códigos; el proceso sale con el peor de ellos.
+EXIT_OK = 0
+EXIT_FOLDER_ERRORS = 1   # La tarea terminó, pero alguna carpeta falló
+EXIT_CONFIG_ERROR = 2    # Fichero de tareas o argumentos no válidos
+EXIT_JOB_FAILED = 3      # La tarea no pudo ejecutarse (conexión, login...)
+EXIT_CANCELLED = 130     # Detenida con Ctrl+C / SIGTERM
+
+STATUS_EXIT_CODES = {
+    'ok': EXIT_OK,
+    'partial': EXIT_FOLDER_ERRORS,
+    'failed': EXIT_JOB_FAILED,
+    'cancelled': EXIT_CANCELLED,
+}
+
+# Nombres cortos aceptados en el fichero de tareas para cada modo
+MODE_ALIASES = {
+    'safe': SYNC_MODE_SAFE, 'segura': SYNC_MODE_SAFE,
+    'incremental': SYNC_MODE_INCREMENTAL, 'condstore': SYNC_MODE_INCREMENTAL,
+    'force': SYNC_MODE_FORCE, 'forzar': SYNC_MODE_FORCE,
+}
+
+# Colores de los mensajes del motor -> nivel en la salida JSON
+COLOR_LEVELS = {'red': 'error', 'orange': 'warning', 'yellow': 'warning', 'green': 'success'}
+
+ACCOUNT_FIELDS = ["host1", "user1", "pass1", "host2", "user2", "pass2"]
+
+
+class JobFileError(Exception):
+    """Error en el fichero de tareas."""
+
+
+def read_job_file(path):
+    """
+    Lee las tareas de un fichero CSV, JSON o YAML (según su extensión).
+
+    El JSON/YAML puede ser una lista de tareas o un objeto con la clave ``jobs``.
+    En CSV cada fila es una tarea y la columna ``folders`` separa las carpetas con ';'.
+
+    :return: Lista de diccionarios tal como vienen en el fichero.
+    :raises JobFileError: Si el fichero no se puede leer o no tiene el formato esperado.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            if extension == '.csv':
+                return [dict(row) for row in csv.DictReader(f)]
+            if extension == '.json':
+                data = json.load(f)
+            elif extension in ('.yaml', '.yml'):
+                try:
+                    import yaml
+                except ImportError:
+                    raise JobFileError("Para leer YAML hace falta PyYAML: pip install pyyaml")
+                data = yaml.safe_load(f)
+            else:
+                raise JobFileError(f"Formato no soportado: {extension or path} (usa .csv, .json, .yaml o .yml)")
+    except OSError as e:
+        raise JobFileError(f"No se pudo leer {path}: {e}")
+    except ValueError as e:  # json.JSONDecodeError y errores de CSV
+        raise JobFileError(f"{path} no es válido: {e}")
+    if isinstance(data, dict):
+        data = data.get('jobs')
+    if not isinstance(data, list) or not all(isinstance(job, dict) for job in data):
+        raise JobFileError(f"{path} debe contener una lista de tareas (o un objeto con la clave 'jobs').")
+    return data
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'si', 'sí', 'y', 's')
+
+
+def normalize_job(raw, number):
+    """
+    Convierte una tarea del fichero en el diccionario que espera el motor.
+
+    Las contraseñas pueden darse con ``pass1_env``/``pass2_env``, el nombre de
+    la variable de entorno que las contiene, para no escribirlas en el fichero.
+
+    :param number: Posición de la tarea en el fichero (empieza en 1), para los mensajes.
+    :raises JobFileError: Si falta algún dato o el modo no es válido.
+    """
+    job = {k: str(v).strip() if isinstance(v, (str, int)) else v for k, v in raw.items() if k is not None}
+    for field in ("pass1", "pass2"):
+        env_name = job.get(f"{field}_env")
+        if not job.get(field) and env_name:
+            if env_name not in os.environ:
+                raise JobFileError(f"Tarea {number}: la variable de entorno {env_name} no está definida.")
+            job[field] = os.environ[env_name]
+    missing = [field for field in ACCOUNT_FIELDS if not job.get(field)]
+    if missing:
+        raise JobFileError(f"Tarea {number}: faltan los campos {', '.join(missing)}.")
+
+    mode = job.get("mode") or job.get("sync_mode") or SYNC_MODE_SAFE
+    mode = MODE_ALIASES.get(str(mode).lower(), mode)
+    if mode not in SYNC_MODES:
+        raise JobFileError(f"Tarea {number}: modo desconocido '{mode}' (usa safe, incremental o force).")
+
+    folders = job.get("folders") or job.get("selected_folders") or []
+    if isinstance(folders, str):
+        folders = [folder.strip() for folder in folders.split(';') if folder.strip()]
+
+    name = job.get("name") or f"{number}:{job['user1']}->{job['user2']}"
+    return {
+        **{field: job[field] for field in ACCOUNT_FIELDS},
+        "name": name,
+        "sync_mode": mode,
+        "selected_folders": list(folders),
+        "propagate_expunge": _parse_bool(job.get("propagate_expunge")),
+        "dest_prefix": job.get("dest_prefix") or "",
+        "widgets": name,
+        "cancel_event": threading.Event(),
+    }
+
+
+class JsonLinesReporter:
+    """
+    Escribe el progreso como líneas JSON en la salida estándar, una por evento.
+    El progreso de cada tarea se limita a una línea por ``progress_interval`` segundos.
+    """
+    def __init__(self, stream=sys.stdout, progress_interval=1.0):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.last_progress = {}
+
+    def emit(self, event, **fields):
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, job, message, color):
+        self.emit("log", job=job, level=COLOR_LEVELS.get(color, 'info'), message=message)
+
+    def progress(self, job, value, total):
+        now = time.monotonic()
+        with self.lock:
+            if value < total and now - self.last_progress.get(job, 0) < self.progress_interval:
+                return
+            self.last_progress[job] = now
+        self.emit("progress", job=job, done=value, total=total,
+                  percent=round(100 * value / total, 1) if total > 0 else 0.0)
+
+    def metrics(self, snapshot):
+        """Instantánea de ``SyncMetrics``: evento ``metrics`` o, la última, ``summary``."""
+        self.emit("summary" if snapshot["final"] else "metrics",
+                  **{key: value for key, value in snapshot.items() if key != "final"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sincroniza cuentas IMAP sin interfaz gráfica a partir de un fichero de tareas (CSV, JSON o YAML).")
+    parser.add_argument("jobs_file", help="Fichero con las tareas: .csv, .json, .yaml o .yml")
+    parser.add_argument("--workers", type=int, default=MAX_PARALLEL_FOLDERS,
+                        help=f"Carpetas sincronizadas a la vez entre todas las tareas (por defecto {MAX_PARALLEL_FOLDERS})")
+    parser.add_argument("--per-host", type=int, default=MAX_CONNECTIONS_PER_HOST,
+                        help=f"Conexiones simultáneas por servidor (por defecto {MAX_CONNECTIONS_PER_HOST})")
+    parser.add_argument("--per-account", type=int, default=MAX_CONNECTIONS_PER_ACCOUNT,
+                        help=f"Conexiones simultáneas por cuenta (por defecto {MAX_CONNECTIONS_PER_ACCOUNT})")
+    parser.add_argument("--log-file", default=LOG_FILE, help=f"Archivo de log (por defecto {LOG_FILE})")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="Segundos mínimos entre dos líneas de progreso de una tarea")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_METRICS_INTERVAL,
+                        help="Segundos entre dos líneas de métricas (0: solo el resumen final)")
+    parser.add_argument("--prometheus-file",
+                        help="Fichero que se reescribe con las métricas en formato de Prometheus (textfile collector)")
+    parser.add_argument("--summary-file", help="Fichero JSON donde se guarda el resumen final de métricas")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="No usa COMPRESS=DEFLATE aunque el servidor lo anuncie (p. ej. en una red local rápida)")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_file)
+    reporter = JsonLinesReporter(progress_interval=args.progress_interval)
+    try:
+        jobs = [normalize_job(raw, number) for number, raw in enumerate(read_job_file(args.jobs_file), 1)]
+    except JobFileError as e:
+        reporter.emit("error", message=str(e))
+        return EXIT_CONFIG_ERROR
+    names = [job["widgets"] for job in jobs]
+    if len(set(names)) != len(names):
+        reporter.emit("error", message="Los nombres de tarea ('name') deben ser únicos.")
+        return EXIT_CONFIG_ERROR
+
+    def cancel(signum, frame):
+        reporter.emit("cancel", signal=signal.Signals(signum).name)
+        for job in jobs:
+            job["cancel_event"].set()
+    signal.signal(signal.SIGINT, cancel)
+    signal.signal(signal.SIGTERM, cancel)
+
+    reporter.emit("start", jobs=len(jobs), workers=args.workers)
+    # El motor corre en otro hilo para que el principal pueda atender las señales
+    result = {}
+
+    def on_metrics(snapshot):
+        if snapshot["final"]:
+            result["summary"] = snapshot
+        reporter.metrics(snapshot)
+
+    worker = threading.Thread(target=lambda: result.update(runs=run_sync_jobs(
+        jobs, reporter.log, reporter.progress, max_workers=max(1, args.workers),
+        max_per_host=max(1, args.per_host), max_per_account=max(1, args.per_account),
+        metrics_callback=on_metrics, metrics_interval=max(0.0, args.metrics_interval),
+        prometheus_file=args.prometheus_file, compress=not args.no_compress)), daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(0.5)
+    if "runs" not in result:
+        reporter.emit("error", message="El planificador terminó de forma inesperada; ver el log.")
+        return EXIT_JOB_FAILED
+    if args.summary_file and "summary" in result:
+        try:
+            with open(args.summary_file, "w", encoding="utf-8") as f:
+                json.dump(result["summary"], f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            reporter.emit("error", message=f"No se pudo guardar el resumen en {args.summary_file}: {e}")
+
+    exit_code = EXIT_OK
+    for run in result["runs"]:
+        code = STATUS_EXIT_CODES[run.status]
+        reporter.emit("job_done", job=run.widgets, status=run.status, code=code,
+                      folders=run.total_folders, folder_errors=run.folder_errors)
+        exit_code = max(exit_code, code)
+    reporter.emit("done", code=exit_code)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
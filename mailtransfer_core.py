@@ -0,0 +1,2778 @@
+# Motor de sincronización IMAP, sin dependencias de la interfaz gráfica.
+#
+# Lo usan tanto la GUI (mailtransfer.py) como la línea de comandos
+# (mailtransfer_cli.py). Los callbacks de log y progreso reciben como primer
+# argumento el valor 'widgets' de la tarea, que el motor no interpreta: la GUI
+# y la CLI pasan el nombre de la tarea.
+import imaplib
+import threading
+import email
+import time
+import re
+from queue import Queue, Empty, PriorityQueue
+from collections import deque
+import traceback
+import logging
+import sqlite3
+import socket
+import ssl
+import itertools
+import tempfile
+import hashlib
+import struct
+import random
+import zlib
+import errno
+from bisect import bisect_left
+
+from mailtransfer_metrics import SyncMetrics, ConnectionTraffic
+
+# --- CONFIGURACIÓN DEL LOGGING ---
+# Archivo de log que registra todos los eventos y errores.
+LOG_FILE = 'sincronizacion.log'
+
+
+def setup_logging(filename=LOG_FILE):
+    """Configura el log de la aplicación. La llaman los puntos de entrada (GUI y CLI), no el motor."""
+    logging.basicConfig(
+        filename=filename,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        encoding='utf-8'
+    )
+
+# --- ÍNDICE LOCAL DEL ESTADO DE SINCRONIZACIÓN ---
+# Archivo SQLite donde se guarda lo ya analizado y copiado entre ejecuciones.
+SYNC_STATE_DB = 'sincronizacion_estado.db'
+
+
+class SyncStateIndex:
+    """
+    Índice local persistente (SQLite) del estado de cada carpeta sincronizada.
+
+    Para cada carpeta, identificada por (host, usuario, carpeta, UIDVALIDITY),
+    guarda la huella (ver ``message_fingerprint``) de cada UID ya analizado, el UIDNEXT
+    visto en el último análisis y qué UIDs del origen ya se han copiado a cada
+    destino. Si el servidor cambia el UIDVALIDITY de la carpeta, los UIDs
+    guardados dejan de ser válidos y la carpeta se reconstruye desde cero.
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS folders (
+            id INTEGER PRIMARY KEY,
+            host TEXT NOT NULL,
+            user TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            uidvalidity INTEGER NOT NULL,
+            uidnext INTEGER,
+            highestmodseq INTEGER,
+            UNIQUE (host, user, folder)
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            folder_id INTEGER NOT NULL,
+            uid INTEGER NOT NULL,
+            fingerprint BLOB NOT NULL,
+            PRIMARY KEY (folder_id, uid)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS copied (
+            source_folder_id INTEGER NOT NULL,
+            dest_folder_id INTEGER NOT NULL,
+            uid INTEGER NOT NULL,
+            PRIMARY KEY (source_folder_id, dest_folder_id, uid)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=SYNC_STATE_DB):
+        """Abre (o crea) la base de datos del índice."""
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self._SCHEMA)
+        # Índices creados por versiones anteriores no tienen la columna HIGHESTMODSEQ
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(folders)")}
+        if 'highestmodseq' not in columns:
+            self.db.execute("ALTER TABLE folders ADD COLUMN highestmodseq INTEGER")
+        # ... y guardaban el Message-ID en lugar de la huella: las carpetas se vuelven a analizar
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(messages)")}
+        if 'fingerprint' not in columns:
+            logging.info("Índice local con Message-IDs: se reconstruye con huellas de contenido.")
+            with self.db:
+                self.db.execute("DROP TABLE messages")
+                self.db.execute("UPDATE folders SET uidnext = NULL, highestmodseq = NULL")
+            self.db.executescript(self._SCHEMA)
+        # ... o huellas calculadas de otra forma, que no casarían con las nuevas
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != FINGERPRINT_VERSION:
+            with self.db:
+                self.db.execute("DELETE FROM messages")
+                self.db.execute("UPDATE folders SET uidnext = NULL, highestmodseq = NULL")
+            self.db.execute(f"PRAGMA user_version = {FINGERPRINT_VERSION}")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def open_folder(self, host, user, folder, uidvalidity):
+        """
+        Devuelve el identificador interno de la carpeta, creándola si no existe.
+        Si el UIDVALIDITY ha cambiado, descarta todo lo guardado para ella.
+        """
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT id, uidvalidity FROM folders WHERE host = ? AND user = ? AND folder = ?",
+                (host, user, folder)
+            ).fetchone()
+            if row is None:
+                cursor = self.db.execute(
+                    "INSERT INTO folders (host, user, folder, uidvalidity) VALUES (?, ?, ?, ?)",
+                    (host, user, folder, uidvalidity)
+                )
+                return cursor.lastrowid
+
+            folder_id, stored_uidvalidity = row
+            if stored_uidvalidity != uidvalidity:
+                logging.info(f"UIDVALIDITY de {user}@{host}/{folder} ha cambiado, se reconstruye su índice.")
+                self.db.execute("DELETE FROM messages WHERE folder_id = ?", (folder_id,))
+                self.db.execute(
+                    "DELETE FROM copied WHERE source_folder_id = ? OR dest_folder_id = ?",
+                    (folder_id, folder_id)
+                )
+                self.db.execute(
+                    "UPDATE folders SET uidvalidity = ?, uidnext = NULL, highestmodseq = NULL WHERE id = ?",
+                    (uidvalidity, folder_id)
+                )
+            return folder_id
+
+    def get_uidnext(self, folder_id):
+        with self.lock:
+            row = self.db.execute("SELECT uidnext FROM folders WHERE id = ?", (folder_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_uidnext(self, folder_id, uidnext):
+        with self.lock, self.db:
+            self.db.execute("UPDATE folders SET uidnext = ? WHERE id = ?", (uidnext, folder_id))
+
+    def get_highestmodseq(self, folder_id):
+        with self.lock:
+            row = self.db.execute("SELECT highestmodseq FROM folders WHERE id = ?", (folder_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_highestmodseq(self, folder_id, highestmodseq):
+        with self.lock, self.db:
+            self.db.execute("UPDATE folders SET highestmodseq = ? WHERE id = ?", (highestmodseq, folder_id))
+
+    def count_messages(self, folder_id):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM messages WHERE folder_id = ?", (folder_id,)).fetchone()[0]
+
+    def load_uids(self, folder_id):
+        """Devuelve la lista de UIDs analizados de la carpeta."""
+        with self.lock:
+            rows = self.db.execute("SELECT uid FROM messages WHERE folder_id = ?", (folder_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def load_fingerprints(self, folder_id):
+        """Devuelve un ``FingerprintIndex`` con todos los correos analizados de la carpeta."""
+        with self.lock:
+            cursor = self.db.execute(
+                "SELECT fingerprint, uid FROM messages WHERE folder_id = ? ORDER BY fingerprint, uid", (folder_id,)
+            )
+            return FingerprintIndex(b"".join(fingerprint + _UID_BYTES.pack(uid) for fingerprint, uid in cursor))
+
+    def fingerprints_for_uids(self, folder_id, uids):
+        """Devuelve {uid: huella} de los UIDs indicados que estén en el índice."""
+        uids = [int(uid) for uid in uids]
+        found = {}
+        with self.lock:
+            for offset in range(0, len(uids), 500):
+                chunk = uids[offset:offset + 500]
+                found.update(self.db.execute(
+                    f"SELECT uid, fingerprint FROM messages WHERE folder_id = ? AND uid IN ({','.join('?' * len(chunk))})",
+                    (folder_id, *chunk)
+                ).fetchall())
+        return found
+
+    def add_messages(self, folder_id, uid_to_fingerprint):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO messages (folder_id, uid, fingerprint) VALUES (?, ?, ?)",
+                ((folder_id, int(uid), fingerprint) for uid, fingerprint in uid_to_fingerprint.items())
+            )
+
+    def copy_messages(self, source_folder_id, dest_folder_id, uid_map):
+        """
+        Apunta en la carpeta destino los correos copiados del origen con su misma huella.
+
+        :param uid_map: {uid en el origen: uid en el destino}.
+        """
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO messages (folder_id, uid, fingerprint) "
+                "SELECT ?, ?, fingerprint FROM messages WHERE folder_id = ? AND uid = ?",
+                ((dest_folder_id, int(dest_uid), source_folder_id, int(uid)) for uid, dest_uid in uid_map.items())
+            )
+
+    def remove_messages(self, folder_id, uids):
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM messages WHERE folder_id = ? AND uid = ?",
+                ((folder_id, int(uid)) for uid in uids)
+            )
+
+    def copied_uids(self, source_folder_id, dest_folder_id):
+        """Devuelve el conjunto de UIDs del origen ya copiados a la carpeta destino."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uid FROM copied WHERE source_folder_id = ? AND dest_folder_id = ?",
+                (source_folder_id, dest_folder_id)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_copied(self, source_folder_id, dest_folder_id, uids):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO copied (source_folder_id, dest_folder_id, uid) VALUES (?, ?, ?)",
+                ((source_folder_id, dest_folder_id, int(uid)) for uid in uids)
+            )
+
+
+# --- LÓGICA DE SINCRONIZACIÓN ---
+
+# Número de correos cuyas cabeceras se piden en un único comando UID FETCH.
+HEADER_SCAN_CHUNK_SIZE = 2000
+
+# Una respuesta FETCH empieza por "<número de secuencia> (".
+_FETCH_START_RE = re.compile(rb'^\d+ \(')
+_FETCH_UID_RE = re.compile(rb'\bUID (\d+)')
+_FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+
+# Cabeceras que identifican un correo (ver ``message_fingerprint``).
+FINGERPRINT_HEADERS = (b'message-id', b'date', b'from', b'subject')
+# Bytes de cada huella: 128 bits hacen despreciable una colisión incluso con millones de correos.
+FINGERPRINT_SIZE = 16
+# Cambia cuando cambia el cálculo de la huella: el índice local se vuelve a analizar.
+FINGERPRINT_VERSION = 2
+
+_FOLDED_LINE_RE = re.compile(rb'\r?\n[ \t]+')
+_ANGLE_ADDR_RE = re.compile(rb'<([^>]*)>')
+_UID_BYTES = struct.Struct('>I')
+
+
+def compress_uid_set(uids):
+    """
+    Convierte una lista de UIDs en un conjunto IMAP compacto ("1:5,7,9:12").
+
+    :param uids: Iterable de UIDs (int, str o bytes).
+    :return: Cadena con el conjunto de UIDs.
+    """
+    numbers = sorted({int(uid) for uid in uids})
+    if not numbers:
+        return ""
+    ranges = []
+    start = prev = numbers[0]
+    for n in numbers[1:]:
+        if n != prev + 1:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = n
+        prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def iter_fetch_responses(fetch_data):
+    """
+    Agrupa la respuesta de imaplib a un FETCH por mensaje.
+
+    imaplib devuelve una lista plana en la que cada literal llega como una tupla
+    (cabecera, datos) y el resto de la respuesta como bytes sueltos (por ejemplo
+    el ")" final). Esta función reúne los fragmentos de cada mensaje.
+
+    :param fetch_data: Lista devuelta por ``connection.uid('fetch', ...)``.
+    :return: Generador de tuplas (metadatos en bytes, lista de literales).
+    """
+    current = None
+    for part in fetch_data or []:
+        if isinstance(part, tuple):
+            meta, literal = part
+            if _FETCH_START_RE.match(meta):
+                if current is not None:
+                    yield current
+                current = (meta, [literal])
+            elif current is not None:
+                current = (current[0] + meta, current[1] + [literal])
+        elif isinstance(part, bytes):
+            if _FETCH_START_RE.match(part):
+                if current is not None:
+                    yield current
+                current = (part, [])
+            elif current is not None:
+                current = (current[0] + part, current[1])
+    if current is not None:
+        yield current
+
+
+def parse_header_fields(header_block):
+    """
+    Extrae las cabeceras de un bloque ``BODY[HEADER.FIELDS (...)]``.
+
+    Desdobla las cabeceras partidas en varias líneas (RFC 5322) y reduce los
+    espacios de cada valor a uno solo, ya que algunos servidores las repliegan
+    de otra forma al guardar el correo.
+
+    :return: Diccionario {nombre en minúsculas (bytes): valor (bytes)}. Las
+             cabeceras repetidas se unen con un espacio.
+    """
+    fields = {}
+    for line in _FOLDED_LINE_RE.sub(b' ', header_block).splitlines():
+        name, sep, value = line.partition(b':')
+        if not sep or not name.strip():
+            continue
+        name = name.strip().lower()
+        value = b' '.join(value.split())
+        fields[name] = fields[name] + b' ' + value if name in fields else value
+    return fields
+
+
+def message_fingerprint(header_block, size):
+    """
+    Calcula la huella de un correo: un resumen de ``FINGERPRINT_SIZE`` bytes de
+    sus cabeceras Message-ID, Date, From y Subject y, solo si no tiene Message-ID,
+    de su RFC822.SIZE.
+
+    A diferencia del Message-ID solo, distingue correos distintos que comparten
+    Message-ID y permite identificar los que no lo tienen o lo tienen mal formado.
+    El tamaño no cuenta cuando hay Message-ID porque muchos servidores no guardan
+    el mismo que el origen (normalizan los saltos de línea al subirlo, o dan un
+    tamaño estimado, como Exchange): la huella del destino no coincidiría.
+
+    :param header_block: Bloque de cabeceras devuelto por ``BODY.PEEK[HEADER.FIELDS (...)]``.
+    :param size: RFC822.SIZE del correo (None si el servidor no lo dio).
+    :return: Huella (bytes de longitud fija).
+    """
+    fields = parse_header_fields(header_block)
+    message_id = fields.get(b'message-id', b'')
+    angle = _ANGLE_ADDR_RE.search(message_id)
+    if angle:
+        message_id = angle.group(1).strip()
+    parts = [message_id] + [fields.get(name, b'') for name in FINGERPRINT_HEADERS[1:]]
+    if not message_id:
+        parts.append(str(size).encode())
+    return hashlib.blake2b(b'\0'.join(parts), digest_size=FINGERPRINT_SIZE).digest()
+
+
+class FingerprintIndex:
+    """
+    Multiconjunto compacto de correos de una carpeta por su huella.
+
+    Guarda registros de ancho fijo (huella + UID de 4 bytes) ordenados en un
+    único ``bytes``: unos 20 bytes por correo en lugar de los cientos de un
+    diccionario, y búsquedas por bisección. Los correos repetidos (misma
+    huella) se conservan todos, de modo que se copian tantas veces como falten.
+    """
+    RECORD_SIZE = FINGERPRINT_SIZE + _UID_BYTES.size
+
+    def __init__(self, data=b''):
+        """:param data: Registros ya ordenados (ver ``from_pairs`` para construirlo a partir de pares)."""
+        self.data = bytes(data)
+        self._keys = _FingerprintKeys(self)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Construye el índice a partir de pares (huella, uid)."""
+        return cls(b''.join(fingerprint + _UID_BYTES.pack(int(uid)) for fingerprint, uid in sorted(
+            (fingerprint, int(uid)) for fingerprint, uid in pairs)))
+
+    def __len__(self):
+        return len(self.data) // self.RECORD_SIZE
+
+    def fingerprint(self, position):
+        start = position * self.RECORD_SIZE
+        return self.data[start:start + FINGERPRINT_SIZE]
+
+    def uid(self, position):
+        start = position * self.RECORD_SIZE + FINGERPRINT_SIZE
+        return _UID_BYTES.unpack_from(self.data, start)[0]
+
+    def _group(self, fingerprint, lo=0):
+        """Devuelve el rango [inicio, fin) de los registros con la huella dada."""
+        start = bisect_left(self._keys, fingerprint, lo)
+        end = start
+        while end < len(self) and self.fingerprint(end) == fingerprint:
+            end += 1
+        return start, end
+
+    def uids_for(self, fingerprint):
+        """Devuelve los UIDs (int) de los correos con esa huella."""
+        start, end = self._group(fingerprint)
+        return [self.uid(position) for position in range(start, end)]
+
+    def missing_from(self, other):
+        """
+        Diferencia de multiconjuntos: UIDs (bytes) de los correos de este índice
+        que no tienen equivalente en ``other``. Si una huella aparece n veces aquí
+        y m en ``other``, faltan los n - m correos de UID más alto.
+        """
+        missing = []
+        position, other_position, total = 0, 0, len(self)
+        while position < total:
+            fingerprint = self.fingerprint(position)
+            end = position + 1
+            while end < total and self.fingerprint(end) == fingerprint:
+                end += 1
+            other_start, other_position = other._group(fingerprint, other_position)
+            already = other_position - other_start
+            missing.extend(str(self.uid(p)).encode() for p in range(position + already, end))
+            position = end
+        return missing
+
+    def without_uids(self, uids):
+        """Devuelve una copia del índice sin los UIDs indicados."""
+        uids = {int(uid) for uid in uids}
+        size = self.RECORD_SIZE
+        return FingerprintIndex(b''.join(
+            self.data[start:start + size] for start in range(0, len(self.data), size)
+            if _UID_BYTES.unpack_from(self.data, start + FINGERPRINT_SIZE)[0] not in uids))
+
+
+class _FingerprintKeys:
+    """Vista de las huellas de un ``FingerprintIndex`` como secuencia, para ``bisect``."""
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        return self.index.fingerprint(position)
+
+
+def _fetch_fingerprints(connection, uid_set):
+    """
+    Pide en un solo comando las cabeceras y el tamaño de un conjunto de UIDs
+    y calcula la huella de cada correo.
+
+    :return: Diccionario {uid (bytes): huella}.
+    :raises imaplib.IMAP4.error: Si el servidor rechaza el comando.
+    """
+    fields = " ".join(name.decode().upper() for name in FINGERPRINT_HEADERS)
+    typ, fetch_data = connection.uid('fetch', uid_set, f'(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({fields})])')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"FETCH {uid_set} devolvió {typ}")
+
+    found = {}
+    for meta, literals in iter_fetch_responses(fetch_data):
+        uid_match = _FETCH_UID_RE.search(meta)
+        if not uid_match:
+            continue
+        size_match = _FETCH_SIZE_RE.search(meta)
+        size = int(size_match.group(1)) if size_match else None
+        found[uid_match.group(1)] = message_fingerprint(b"".join(literals), size)
+    return found
+
+
+def scan_fingerprints(connection, uid_list, log_callback, widgets, chunk_size=HEADER_SCAN_CHUNK_SIZE, on_chunk=None):
+    """
+    Obtiene la huella de los UIDs indicados de la carpeta seleccionada.
+
+    Las cabeceras se piden por lotes de ``chunk_size`` UIDs en un único
+    UID FETCH, de modo que el número de peticiones al servidor no crece con
+    cada correo. Si un lote falla, solo ese lote se repite correo a correo.
+
+    :param connection: Conexión imaplib activa con la carpeta ya seleccionada.
+    :param uid_list: Lista de UIDs (bytes) a analizar.
+    :param log_callback: Función para enviar actualizaciones a la GUI.
+    :param widgets: Valor de la tarea que se pasa tal cual al callback.
+    :param chunk_size: Número de correos por lote.
+    :param on_chunk: Si se indica, recibe el {uid: huella} de cada lote en cuanto
+        llega (para guardarlo sin esperar al final) y no se acumulan en memoria.
+    :return: Diccionario con {uid: huella} de los correos analizados (vacío con ``on_chunk``).
+    """
+    uid_to_fingerprint = {}
+    analyzed = 0
+    total_uids = len(uid_list)
+    if not total_uids:
+        return uid_to_fingerprint
+
+    log_callback(widgets, f"Análisis Seguro: {total_uids} correos...", "gray")
+    logging.info(f"Iniciando análisis de {total_uids} correos en lotes de {chunk_size}.")
+    start_time = time.monotonic()
+    
+    for offset in range(0, total_uids, chunk_size):
+        chunk = uid_list[offset:offset + chunk_size]
+        try:
+            found = _fetch_fingerprints(connection, compress_uid_set(chunk))
+        except imaplib.IMAP4.abort:
+            raise  # La conexión se ha perdido: no tiene sentido reintentar aquí
+        except Exception as e:
+            logging.warning(f"Fallo el lote de {len(chunk)} correos ({e}), reintentando uno a uno.")
+            found = {}
+            for uid in chunk:
+                try:
+                    found.update(_fetch_fingerprints(connection, uid.decode()))
+                except imaplib.IMAP4.abort:
+                    raise
+                except Exception:
+                    continue
+
+        analyzed += len(found)
+        if on_chunk is not None:
+            on_chunk(found)
+        else:
+            uid_to_fingerprint.update(found)
+        scanned = min(offset + chunk_size, total_uids)
+        rate = scanned / max(time.monotonic() - start_time, 1e-6)
+        log_callback(widgets, f"Análisis Seguro: {scanned}/{total_uids} ({rate:.0f} correos/s)...", "gray")
+            
+    elapsed = time.monotonic() - start_time
+    logging.info(
+        f"Análisis completado: {analyzed} de {total_uids} correos "
+        f"({elapsed:.1f} s, {total_uids / max(elapsed, 1e-6):.0f} correos/s)."
+    )
+    return uid_to_fingerprint
+
+
+def get_fingerprint_index(connection, log_callback, widgets, chunk_size=HEADER_SCAN_CHUNK_SIZE):
+    """
+    Analiza una carpeta de correo entera y devuelve las huellas de sus correos.
+
+    :param connection: Conexión imaplib activa.
+    :param log_callback: Función para enviar actualizaciones a la GUI.
+    :param widgets: Valor de la tarea que se pasa tal cual al callback.
+    :param chunk_size: Número de correos por lote (ver ``scan_fingerprints``).
+    :return: ``FingerprintIndex`` de la carpeta.
+    """
+    typ, data = connection.uid('search', None, 'ALL')
+    if typ != 'OK' or not data[0]:
+        return FingerprintIndex()
+    
+    uid_list = data[0].split()
+    if not uid_list:
+        return FingerprintIndex()
+
+    found = scan_fingerprints(connection, uid_list, log_callback, widgets, chunk_size)
+    return FingerprintIndex.from_pairs((fingerprint, uid) for uid, fingerprint in found.items())
+
+
+def select_folder(connection, folder_name, readonly=False, condstore=False):
+    """
+    Selecciona una carpeta y devuelve su estado según la respuesta del servidor.
+
+    :param condstore: Si es True, pide CONDSTORE al seleccionar para recibir HIGHESTMODSEQ.
+    :return: Diccionario con 'exists', 'uidvalidity', 'uidnext' y 'highestmodseq'
+             (None si el servidor no los envía).
+    :raises imaplib.IMAP4.error: Si la carpeta no se puede seleccionar.
+    """
+    mailbox = f'"{folder_name}" (CONDSTORE)' if condstore else f'"{folder_name}"'
+    typ, data = connection.select(mailbox, readonly=readonly)
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"No se pudo seleccionar la carpeta {folder_name}: {data}")
+
+    def last_int(key):
+        values = connection.untagged_responses.get(key) or [None]
+        try:
+            return int(values[-1])
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        'exists': last_int('EXISTS') or 0,
+        'uidvalidity': last_int('UIDVALIDITY'),
+        'uidnext': last_int('UIDNEXT'),
+        'highestmodseq': last_int('HIGHESTMODSEQ'),
+    }
+
+
+def refresh_capabilities(connection):
+    """
+    Actualiza las capacidades tras el login, ya que muchos servidores anuncian
+    extensiones (CONDSTORE, QRESYNC, UIDPLUS...) solo a usuarios autenticados.
+    Si el servidor ya las envió en la respuesta al LOGIN ([CAPABILITY ...]) se
+    usan esas; si no, se pide CAPABILITY.
+
+    :return: Tupla con las capacidades en mayúsculas.
+    """
+    data = connection.untagged_responses.pop('CAPABILITY', None)
+    if not data or not data[-1]:
+        typ, data = connection.capability()
+        if typ != 'OK':
+            data = None
+    if data and data[-1]:
+        connection.capabilities = tuple(data[-1].decode('ascii', 'ignore').upper().split())
+    return connection.capabilities
+
+
+def enable_condstore(connection):
+    """
+    Activa QRESYNC (que incluye CONDSTORE) o CONDSTORE si el servidor los anuncia.
+    Debe llamarse antes de seleccionar ninguna carpeta y después de
+    ``refresh_capabilities``.
+
+    :return: Conjunto con las extensiones activas ({'CONDSTORE', 'QRESYNC'}, {'CONDSTORE'} o vacío).
+    """
+    capabilities = connection.capabilities
+    if 'ENABLE' in capabilities:
+        for extension in ('QRESYNC', 'CONDSTORE'):
+            if extension in capabilities:
+                typ, _ = connection.enable(extension)
+                if typ == 'OK':
+                    return {'CONDSTORE', extension}
+    # Sin ENABLE, CONDSTORE se activa igualmente al seleccionar con el parámetro (CONDSTORE)
+    return {'CONDSTORE'} if 'CONDSTORE' in capabilities else set()
+
+
+def parse_uid_set(uid_set):
+    """Expande un conjunto IMAP de UIDs ("1:3,7") a una lista de enteros."""
+    uids = []
+    for part in uid_set.split(','):
+        if ':' in part:
+            first, last = sorted(int(n) for n in part.split(':'))
+            uids.extend(range(first, last + 1))
+        elif part.strip():
+            uids.append(int(part))
+    return uids
+
+
+def get_fingerprint_index_cached(connection, state_index, host, user, folder_name, folder_state, log_callback, widgets,
+                                 vanished=None):
+    """
+    Versión incremental de ``get_fingerprint_index`` apoyada en el índice local.
+
+    Solo analiza los UIDs a partir del último UIDNEXT guardado. Si el número de
+    correos no cuadra con el índice (hubo borrados), hace además un UID SEARCH
+    para eliminar del índice los UIDs que ya no existen. Si el UIDVALIDITY ha
+    cambiado se analiza la carpeta entera.
+
+    :param state_index: Instancia de ``SyncStateIndex``.
+    :param folder_state: Estado devuelto por ``select_folder`` para esta carpeta.
+    :param vanished: Diccionario opcional que recibe {uid: huella} de los correos
+        que ya no existen, en lugar de quitarlos del índice: quien llama los quita
+        cuando haya propagado el borrado. El índice devuelto ya no los incluye.
+    :return: Tupla (``FingerprintIndex``, id de la carpeta en el índice o None).
+    """
+    uidvalidity, uidnext = folder_state['uidvalidity'], folder_state['uidnext']
+    if uidvalidity is None or uidnext is None:
+        logging.info(f"El servidor no informa UIDVALIDITY/UIDNEXT para {folder_name}, análisis completo.")
+        return get_fingerprint_index(connection, log_callback, widgets), None
+
+    folder_id = state_index.open_folder(host, user, folder_name, uidvalidity)
+    known_count = state_index.count_messages(folder_id)
+    last_uidnext = state_index.get_uidnext(folder_id)
+
+    if last_uidnext == uidnext and known_count == folder_state['exists']:
+        logging.info(f"Índice de {folder_name} al día ({known_count} correos), no se analiza.")
+    else:
+        new_uids = []
+        if last_uidnext is None:
+            typ, data = connection.uid('search', None, 'ALL')
+        else:
+            # "n:*" siempre incluye el último UID aunque sea menor que n, por eso se filtra.
+            typ, data = connection.uid('search', None, f'UID {last_uidnext}:*')
+        if typ == 'OK' and data[0]:
+            candidates = data[0].split()
+            known = state_index.fingerprints_for_uids(folder_id, candidates) if known_count else {}
+            new_uids = [uid for uid in candidates if int(uid) not in known]
+
+        if known_count + len(new_uids) != folder_state['exists']:
+            typ, data = connection.uid('search', None, 'ALL')
+            if typ == 'OK':
+                current = {int(uid) for uid in (data[0] or b'').split()}
+                known_uids = set(state_index.load_uids(folder_id))
+                gone = known_uids - current
+                if gone and vanished is not None:
+                    logging.info(f"{len(gone)} correos ya no existen en {folder_name}.")
+                    vanished.update(state_index.fingerprints_for_uids(folder_id, gone))
+                elif gone:
+                    logging.info(f"{len(gone)} correos ya no existen en {folder_name}, se quitan del índice.")
+                    state_index.remove_messages(folder_id, gone)
+                new_uids = [str(uid).encode() for uid in sorted(current - known_uids)]
+                known_count = len(known_uids) - len(gone)
+
+        # Cada lote se guarda al llegar: si la conexión se corta, el reintento
+        # no vuelve a analizar lo ya guardado (``known`` lo descarta)
+        scan_fingerprints(connection, new_uids, log_callback, widgets,
+                          on_chunk=lambda found: state_index.add_messages(folder_id, found))
+        state_index.set_uidnext(folder_id, uidnext)
+        logging.info(f"Índice de {folder_name}: {len(new_uids)} correos nuevos analizados, "
+                     f"{known_count + len(new_uids)} en total.")
+
+    index = state_index.load_fingerprints(folder_id)
+    return (index.without_uids(vanished) if vanished else index), folder_id
+
+
+_VANISHED_RE = re.compile(rb'^(?:\(EARLIER\)\s*)?([\d:,]+)')
+_FETCH_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+
+
+def get_folder_changes(connection, state_index, host, user, folder_name, folder_state, qresync, log_callback, widgets):
+    """
+    Obtiene los cambios de una carpeta desde el último HIGHESTMODSEQ guardado
+    usando CONDSTORE (UID FETCH ... (CHANGEDSINCE n)), sin volver a recorrerla.
+
+    Con QRESYNC los correos borrados llegan en la respuesta VANISHED; sin él se
+    detectan con un UID SEARCH solo si el número de correos no cuadra. Si aún no
+    hay HIGHESTMODSEQ guardado (primera ejecución) se hace el análisis normal.
+
+    El HIGHESTMODSEQ nuevo no se guarda aquí: quien llama debe hacerlo con
+    ``set_highestmodseq`` una vez aplicados los cambios, para no perderlos si falla.
+    Por lo mismo, los correos borrados siguen en el índice local hasta que quien
+    llama los quite (``remove_messages``) tras propagar el borrado.
+
+    :param folder_state: Estado devuelto por ``select_folder(..., condstore=True)``.
+    :param qresync: True si QRESYNC está activo en la conexión.
+    :return: Diccionario con 'index' (``FingerprintIndex``), 'folder_id',
+             'flag_changes' ({huella: flags}) y 'vanished' ({uid: huella} de los correos
+             borrados, que el índice devuelto ya no incluye).
+    """
+    changes = {'flag_changes': {}, 'vanished': {}}
+    uidvalidity = folder_state['uidvalidity']
+    modseq = folder_state['highestmodseq']
+    if uidvalidity is None or modseq is None:
+        changes['index'], changes['folder_id'] = get_fingerprint_index(connection, log_callback, widgets), None
+        return changes
+
+    folder_id = state_index.open_folder(host, user, folder_name, uidvalidity)
+    changes['folder_id'] = folder_id
+    last_modseq = state_index.get_highestmodseq(folder_id)
+    if last_modseq is None:
+        logging.info(f"Sin HIGHESTMODSEQ previo para {folder_name}: análisis completo inicial.")
+        changes['index'], _ = get_fingerprint_index_cached(
+            connection, state_index, host, user, folder_name, folder_state, log_callback, widgets,
+            vanished=changes['vanished'])
+        return changes
+
+    if modseq == last_modseq:
+        logging.info(f"{folder_name} sin cambios desde MODSEQ {last_modseq}.")
+    else:
+        log_callback(widgets, f"Incremental: cambios desde MODSEQ {last_modseq}...", "gray")
+        modifiers = f'(CHANGEDSINCE {last_modseq} VANISHED)' if qresync else f'(CHANGEDSINCE {last_modseq})'
+        connection.untagged_responses.pop('VANISHED', None)
+        typ, fetch_data = connection.uid('fetch', '1:*', '(UID FLAGS)', modifiers)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"El servidor rechazó CHANGEDSINCE: {fetch_data}")
+
+        changed = {}
+        for meta, _ in iter_fetch_responses(fetch_data):
+            uid_match, flags_match = _FETCH_UID_RE.search(meta), _FETCH_FLAGS_RE.search(meta)
+            if uid_match:
+                changed[int(uid_match.group(1))] = flags_match.group(1).decode('utf-8', 'ignore') if flags_match else ''
+
+        known_changed = state_index.fingerprints_for_uids(folder_id, changed)
+        new_uids = [str(uid).encode() for uid in sorted(changed) if uid not in known_changed]
+        for uid, fingerprint in known_changed.items():
+            changes['flag_changes'][fingerprint] = changed[uid]
+
+        vanished = set()
+        if qresync:
+            for value in connection.untagged_responses.pop('VANISHED', None) or []:
+                match = _VANISHED_RE.match(value) if isinstance(value, bytes) else None
+                if match:
+                    vanished.update(parse_uid_set(match.group(1).decode()))
+        elif state_index.count_messages(folder_id) + len(new_uids) != folder_state['exists']:
+            typ, data = connection.uid('search', None, 'ALL')
+            if typ == 'OK':
+                current = {int(uid) for uid in (data[0] or b'').split()}
+                vanished = {uid for uid in state_index.load_uids(folder_id) if uid not in current}
+
+        if vanished:
+            changes['vanished'] = state_index.fingerprints_for_uids(folder_id, vanished)
+
+        scan_fingerprints(connection, new_uids, log_callback, widgets,
+                          on_chunk=lambda found: state_index.add_messages(folder_id, found))
+        if folder_state['uidnext'] is not None:
+            state_index.set_uidnext(folder_id, folder_state['uidnext'])
+        logging.info(
+            f"Incremental {folder_name}: {len(new_uids)} nuevos, {len(changes['flag_changes'])} con flags "
+            f"cambiados, {len(changes['vanished'])} borrados."
+        )
+
+    changes['index'] = state_index.load_fingerprints(folder_id).without_uids(changes['vanished'])
+    return changes
+
+
+def apply_flag_changes(dest, flag_changes, dest_index):
+    """
+    Replica en el destino los flags cambiados en el origen con UID STORE.
+    Agrupa los correos con los mismos flags para enviar un solo comando por grupo.
+
+    :param flag_changes: {huella: flags} de los correos cambiados en el origen.
+    :param dest_index: ``FingerprintIndex`` de la carpeta destino.
+    :return: Tupla (correos actualizados, correos cuyo UID STORE rechazó el destino).
+    """
+    by_flags = {}
+    for fingerprint, flags in flag_changes.items():
+        dest_uids = dest_index.uids_for(fingerprint)
+        if not dest_uids:
+            continue
+        # \Recent lo gestiona el servidor y no se puede asignar
+        clean_flags = " ".join(f for f in flags.split() if f.lower() != '\\recent')
+        by_flags.setdefault(clean_flags, []).extend(dest_uids)
+
+    updated = failed = 0
+    for flags, uids in by_flags.items():
+        for offset in range(0, len(uids), HEADER_SCAN_CHUNK_SIZE):
+            chunk = uids[offset:offset + HEADER_SCAN_CHUNK_SIZE]
+            typ, data = dest.uid('store', compress_uid_set(chunk), 'FLAGS.SILENT', f'({flags})')
+            if typ == 'OK':
+                updated += len(chunk)
+            else:
+                failed += len(chunk)
+                logging.warning(f"UID STORE rechazado en el destino: {data}")
+    return updated, failed
+
+
+def apply_expunges(dest, vanished_fingerprints, source_index, dest_index):
+    """
+    Borra del destino los correos que han desaparecido del origen.
+    Con UIDPLUS usa UID EXPUNGE para no afectar a otros correos marcados;
+    sin él los correos solo se marcan como \\Deleted.
+
+    Si quedan en el origen otras copias con la misma huella, en el destino se
+    conservan las mismas que en el origen.
+
+    :param vanished_fingerprints: Huellas de los correos borrados en el origen.
+    :param source_index: ``FingerprintIndex`` del origen, ya sin los correos borrados.
+    :param dest_index: ``FingerprintIndex`` de la carpeta destino.
+    :return: Tupla (UIDs del destino borrados, correos que el destino no dejó borrar).
+    """
+    dest_uids = []
+    for fingerprint in set(vanished_fingerprints):
+        candidates = dest_index.uids_for(fingerprint)
+        excess = len(candidates) - len(source_index.uids_for(fingerprint))
+        if excess > 0:
+            dest_uids.extend(candidates[-excess:])
+    if not dest_uids:
+        return [], 0
+    uid_set = compress_uid_set(dest_uids)
+    typ, data = dest.uid('store', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+    if typ != 'OK':
+        logging.warning(f"No se pudieron marcar como borrados en el destino: {data}")
+        return [], len(dest_uids)
+    if 'UIDPLUS' in dest.capabilities:
+        typ, data = dest.uid('expunge', uid_set)
+        if typ != 'OK':
+            logging.warning(f"UID EXPUNGE rechazado en el destino: {data}")
+            return [], len(dest_uids)
+    else:
+        logging.info("El destino no soporta UIDPLUS: los correos quedan marcados como \\Deleted sin purgar.")
+    return dest_uids, 0
+
+
+# --- TRANSPORTE: RITMO ADAPTATIVO Y LIMITACIONES DEL SERVIDOR ---
+# Códigos de respuesta con los que el servidor indica una limitación temporal
+# (RFC 5530 y los que usan Gmail/Office 365): hay que esperar y reconectar.
+# [OVERQUOTA] y [LIMIT] no están: son permanentes y reintentar no los resuelve.
+THROTTLE_RESPONSE_CODES = (b'[THROTTLED]', b'[UNAVAILABLE]', b'[INUSE]')
+# La latencia media de un comando por encima de este múltiplo de la mejor
+# observada se toma como señal de saturación del servidor.
+RATE_LATENCY_TOLERANCE = 2.0
+# Diferencias menores que esta (segundos) son ruido de la red o de los hilos, no saturación.
+RATE_LATENCY_MIN_EXCESS = 0.1
+RATE_LATENCY_SMOOTHING = 0.2        # Peso de cada medida en la media móvil
+RATE_MIN_INTERVAL = 0.01            # Primer paso al frenar (segundos entre comandos)
+RATE_THROTTLED_INTERVAL = 0.5       # Pausa mínima tras una limitación explícita
+RATE_MAX_INTERVAL = 5.0
+# Las respuestas mayores dependen del ancho de banda, no de la carga del
+# servidor: su latencia no se tiene en cuenta (tampoco la de los APPEND).
+RATE_BULK_RESPONSE_BYTES = 256 * 1024
+# Reintentos de una carpeta o de la planificación tras una desconexión o limitación
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_MAX = 120.0
+# Segundos sin respuesta del servidor antes de dar la conexión por cortada.
+# Holgado para no cortar un APPEND grande ni un FETCH lento de un buzón enorme.
+IMAP_TIMEOUT = 300
+# Errores de OSError del disco local, no de la red: reconectar no los arregla.
+FILE_SYSTEM_ERRNOS = {errno.ENOSPC, errno.EDQUOT, errno.EROFS, errno.EACCES, errno.ENOENT}
+# COMPRESS=DEFLATE (RFC 4978): nivel de zlib de lo que se envía y bytes leídos de cada vez
+COMPRESS_LEVEL = 6
+COMPRESS_READ_BYTES = 64 * 1024
+
+# imaplib no conoce el comando COMPRESS; como ENABLE, solo vale tras el login
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+
+class ServerThrottled(imaplib.IMAP4.abort):
+    """El servidor ha limitado la sesión ([THROTTLED], [UNAVAILABLE]...)."""
+
+
+def is_throttle_response(data):
+    """Indica si el texto de una respuesta NO/BAD/BYE lleva un código de limitación."""
+    text = b' '.join(part if isinstance(part, bytes) else str(part).encode()
+                     for part in (data or []) if part is not None).upper()
+    return any(code in text for code in THROTTLE_RESPONSE_CODES)
+
+
+def _response_size(data):
+    return sum(len(part) for item in data or [] for part in (item if isinstance(item, tuple) else (item,))
+               if isinstance(part, bytes))
+
+
+def _command_label(name, args):
+    """Nombre del comando para las métricas: 'SELECT', 'APPEND', 'UID FETCH'..."""
+    return f"UID {args[0]}".upper() if name == 'UID' and args else name
+
+
+def _command_kind(name, args):
+    """Clave para comparar latencias: UID FETCH de cabeceras y de cuerpos no tardan lo mismo."""
+    kind = _command_label(name, args)
+    if kind == 'UID FETCH' and len(args) > 2:
+        kind += ' ' + re.sub(r'\d+', '', str(args[2]))
+    return kind
+
+
+def is_transient_error(exc):
+    """Errores que se resuelven reconectando: cortes de conexión, BYE y limitaciones."""
+    if isinstance(exc, (socket.gaierror, ssl.SSLCertVerificationError)):
+        return False  # Nombre de servidor o certificado incorrectos: reintentar no sirve
+    if isinstance(exc, OSError) and exc.errno in FILE_SYSTEM_ERRNOS:
+        return False  # Disco lleno o sin permisos (ficheros temporales, índice local)
+    return isinstance(exc, (imaplib.IMAP4.abort, OSError))
+
+
+class AdaptiveRate:
+    """
+    Ritmo de comandos contra un servidor, compartido por todas sus conexiones.
+
+    Mide la latencia de cada tipo de comando y la compara con la mejor vista:
+    si crece por encima de ``RATE_LATENCY_TOLERANCE`` veces, el servidor se está
+    saturando y se espacian los comandos (aumento multiplicativo); mientras
+    responde con normalidad el intervalo se va reduciendo hasta desaparecer.
+    Una limitación explícita ([THROTTLED], BYE) lo dobla de golpe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = 0.0
+        self.next_slot = 0.0
+        self.baseline = {}
+        self.average = {}
+        self.throttle_count = 0
+
+    def wait(self):
+        """Espera el turno del siguiente comando según el intervalo actual."""
+        with self.lock:
+            if not self.interval:
+                return
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, name, seconds):
+        """Apunta la latencia de un comando y ajusta el intervalo."""
+        with self.lock:
+            average = self.average.get(name)
+            average = seconds if average is None else average + RATE_LATENCY_SMOOTHING * (seconds - average)
+            self.average[name] = average
+            # La referencia sube muy despacio para adaptarse a cambios de red duraderos
+            baseline = min(self.baseline.get(name, seconds) * 1.001, seconds)
+            self.baseline[name] = baseline
+            if average > RATE_LATENCY_TOLERANCE * baseline and average - baseline > RATE_LATENCY_MIN_EXCESS:
+                self.interval = min(max(self.interval * 1.5, RATE_MIN_INTERVAL), RATE_MAX_INTERVAL)
+            elif self.interval:
+                self.interval = self.interval * 0.9 if self.interval > RATE_MIN_INTERVAL / 10 else 0.0
+
+    def throttled(self):
+        """El servidor ha limitado o cortado la sesión: frena de inmediato."""
+        with self.lock:
+            self.throttle_count += 1
+            self.interval = min(max(self.interval * 2, RATE_THROTTLED_INTERVAL), RATE_MAX_INTERVAL)
+            self.next_slot = max(self.next_slot, time.monotonic() + self.interval)
+
+
+_host_rates = {}
+_host_rates_lock = threading.Lock()
+
+
+def host_rate(host):
+    """``AdaptiveRate`` compartido por todas las conexiones con un servidor."""
+    with _host_rates_lock:
+        rate = _host_rates.get(host)
+        if rate is None:
+            rate = _host_rates[host] = AdaptiveRate()
+        return rate
+
+
+def reset_host_rates():
+    """Olvida el ritmo aprendido de cada servidor para que una ejecución nueva empiece de cero."""
+    with _host_rates_lock:
+        _host_rates.clear()
+
+
+def split_host_port(host):
+    """
+    Separa el puerto de un servidor escrito como 'host:puerto' (o '[IPv6]:puerto').
+
+    :return: Tupla (host, puerto); sin puerto se usa el de IMAP sobre SSL (993).
+    """
+    host = host.strip()
+    if host.startswith('['):
+        address, _, rest = host[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    elif host.count(':') == 1:
+        address, port = host.split(':')
+    else:
+        address, port = host, ''
+    return address, int(port) if port.isdigit() else imaplib.IMAP4_SSL_PORT
+
+
+class IMAPConnection(imaplib.IMAP4_SSL):
+    """
+    Conexión IMAP4 sobre SSL con el transporte ajustado a copias largas:
+
+    * Desactiva el algoritmo de Nagle: imaplib envía cada APPEND en varias
+      escrituras pequeñas (comando, literal y CRLF) y, con Nagle activo, la
+      última espera al ACK retardado del servidor en cada correo.
+    * Los sockets tienen un tiempo de espera (``IMAP_TIMEOUT``): una sesión que
+      el servidor o un NAT abandona en silencio termina en ``socket.timeout``,
+      que se reintenta como cualquier otro corte.
+    * Cada comando respeta el ritmo adaptativo del servidor (``AdaptiveRate``).
+    * Una respuesta NO/BAD con código de limitación se convierte en
+      ``ServerThrottled``, que el planificador trata como un corte: reconecta
+      tras una espera y retoma la carpeta.
+    * Si tiene ``metrics`` (un ``SyncMetrics``), anota en él la latencia de cada comando.
+    * Con ``compress`` la sesión pasa a COMPRESS=DEFLATE; ``traffic`` cuenta
+      los bytes de la conexión antes y después de comprimir.
+    * Toma las capacidades del saludo del servidor si las trae, sin pedir CAPABILITY.
+
+    La sesión guarda además en caché el LIST, el LSUB y el separador de
+    jerarquía (ver ``list_folders``), que no se vuelven a pedir en ella.
+    """
+    metrics = None
+
+    def __init__(self, host, rate=None):
+        self.rate = rate or host_rate(host)
+        address, port = split_host_port(host)
+        self.traffic = ConnectionTraffic(address)
+        self._compressor = self._decompressor = None
+        self._inflated = bytearray()
+        self.folder_names = self.subscribed_names = self.hierarchy_delimiter = None
+        self.literal_plus = None
+        super().__init__(address, port, timeout=IMAP_TIMEOUT)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def _simple_command(self, name, *args):
+        self.rate.wait()
+        start = time.monotonic()
+        ok = False
+        try:
+            typ, data = super()._simple_command(name, *args)
+            ok = typ == 'OK' or (name == 'LOGOUT' and typ == 'BYE')
+        except self.abort:  # BYE o conexión cortada
+            self.rate.throttled()
+            raise
+        except self.error as e:  # imaplib convierte la respuesta BAD en excepción
+            if is_throttle_response([str(e)]):
+                self.rate.throttled()
+                raise ServerThrottled(f"{name}: {e}") from e
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            if self.metrics is not None:
+                self.metrics.observe_command(self.host, _command_label(name, args), elapsed, ok)
+        if typ != 'OK' and is_throttle_response(data):
+            self.rate.throttled()
+            detail = data[-1] if data else b''
+            raise ServerThrottled(f"{name}: {detail.decode(errors='replace') if isinstance(detail, bytes) else detail}")
+        if is_throttle_response(self.untagged_responses.get('NO')):
+            # Aviso sin cortar ("* NO [THROTTLED] ..."): se frena pero el comando ha funcionado
+            self.rate.throttled()
+        elif name != 'APPEND' and _response_size(data) < RATE_BULK_RESPONSE_BYTES:
+            self.rate.record(_command_kind(name, args), elapsed)
+        return typ, data
+
+    def _command(self, name, *args):
+        # Como ``literal`` en imaplib, ``literal_plus`` vale para el siguiente comando:
+        # trozos que se escriben tras su línea sin esperar continuación (LITERAL+).
+        # Así imaplib no construye (ni guarda en ``_cmd_log``) el comando entero.
+        chunks, self.literal_plus = self.literal_plus, None
+        tag = super()._command(name, *args)
+        if chunks is not None:
+            try:
+                for chunk in chunks:
+                    self.send(chunk)
+            except OSError as e:
+                raise self.abort(f'socket error: {e}')
+        return tag
+
+    def _get_capabilities(self):
+        # La mayoría de servidores las anuncian en el saludo ("* OK [CAPABILITY ...]")
+        data = self.untagged_responses.pop('CAPABILITY', None)
+        if data and data[-1]:
+            self.capabilities = tuple(str(data[-1], self._encoding).upper().split())
+        else:
+            super()._get_capabilities()
+
+    def compress(self):
+        """
+        Activa COMPRESS=DEFLATE si el servidor lo anuncia. Debe llamarse
+        después del login (y de ``refresh_capabilities``).
+
+        :return: True si la sesión queda comprimida.
+        """
+        if self._compressor is None and 'COMPRESS=DEFLATE' in self.capabilities:
+            try:
+                typ, _ = self._simple_command('COMPRESS', 'DEFLATE')
+            except self.abort:
+                raise
+            except self.error:
+                typ = 'BAD'
+            if typ == 'OK':
+                self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+                self._decompressor = zlib.decompressobj(-15)
+                self.traffic.compressed = True
+        return self._compressor is not None
+
+    def _inflate(self):
+        """Lee un bloque comprimido y lo añade descomprimido a ``_inflated``. False si la conexión se cerró."""
+        data = self.file.read1(COMPRESS_READ_BYTES)
+        if not data:
+            return False
+        inflated = self._decompressor.decompress(data)
+        self.traffic.add_received(len(inflated), len(data))
+        self._inflated += inflated
+        return True
+
+    def read(self, size):
+        if self._decompressor is None:
+            data = super().read(size)
+            self.traffic.add_received(len(data), len(data))
+            return data
+        while len(self._inflated) < size and self._inflate():
+            pass
+        data = bytes(self._inflated[:size])
+        del self._inflated[:size]
+        return data
+
+    def readline(self):
+        if self._decompressor is None:
+            line = super().readline()
+            self.traffic.add_received(len(line), len(line))
+            return line
+        start = 0
+        end = self._inflated.find(b'\n')
+        while end < 0:
+            if len(self._inflated) > imaplib._MAXLINE:
+                raise self.error(f"got more than {imaplib._MAXLINE} bytes")
+            start = len(self._inflated)
+            if not self._inflate():
+                end = len(self._inflated) - 1
+                break
+            end = self._inflated.find(b'\n', start)
+        line = bytes(self._inflated[:end + 1])
+        del self._inflated[:end + 1]
+        return line
+
+    def send(self, data):
+        wire = data
+        if self._compressor is not None:
+            wire = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.traffic.add_sent(len(data), len(wire))
+        super().send(wire)
+
+
+def connect_imap(host):
+    """
+    Abre una conexión IMAP4 sobre SSL con el transporte de ``IMAPConnection``.
+
+    :param host: Servidor, con el puerto opcional ('imap.ejemplo.com:1993').
+    """
+    return IMAPConnection(host)
+
+
+# --- MOTOR DE COPIA EN TUBERÍA (DESCARGA -> SUBIDA) ---
+# Bytes máximos de correos descargados que pueden esperar a ser subidos al destino.
+PIPELINE_MAX_BUFFER_BYTES = 64 * 1024 * 1024
+# Límites de cada lote de descarga: nº de correos y bytes (según RFC822.SIZE).
+PIPELINE_FETCH_BATCH_COUNT = 50
+PIPELINE_FETCH_BATCH_BYTES = 4 * 1024 * 1024
+# Cada cuántos segundos se informa del progreso de la tubería.
+PIPELINE_REPORT_INTERVAL = 0.5
+# Límites de cada APPEND múltiple (MULTIAPPEND): nº de correos y bytes.
+APPEND_BATCH_COUNT = 50
+APPEND_BATCH_BYTES = 8 * 1024 * 1024
+# Con LITERAL+ el APPEND múltiple se escribe en el socket en trozos de este tamaño.
+APPEND_SEND_BYTES = 256 * 1024
+# Los correos mayores que este tamaño no se cargan en memoria: se descargan por
+# partes (BODY.PEEK[]<inicio.longitud>) a un fichero temporal y se suben desde él.
+LARGE_MESSAGE_BYTES = 16 * 1024 * 1024
+LARGE_MESSAGE_CHUNK_BYTES = 4 * 1024 * 1024
+
+def parse_fetch_metadata(metadata):
+    """
+    Extrae los flags y la fecha interna de los metadatos de un FETCH.
+
+    :param metadata: Metadatos de la respuesta (str).
+    :return: Tupla (flags para APPEND o None, fecha interna para APPEND).
+    """
+    flags_match = re.search(r'FLAGS\s\((.*?)\)', metadata)
+    flags_string = f"({flags_match.group(1)})" if flags_match else None
+    
+    date_match = re.search(r'INTERNALDATE\s"([^"]+)"', metadata)
+    internal_date = imaplib.Time2Internaldate(time.time())
+    if date_match:
+        try:
+            dt = email.utils.parsedate_to_datetime(date_match.group(1))
+            internal_date = imaplib.Time2Internaldate(dt.timestamp())
+        except Exception:
+            pass
+    return flags_string, internal_date
+
+
+def fetch_message_sizes(connection, uid_list, chunk_size=HEADER_SCAN_CHUNK_SIZE):
+    """
+    Obtiene el tamaño (RFC822.SIZE) de los UIDs indicados, por lotes.
+
+    :return: Diccionario {uid (bytes): tamaño en bytes}. Los UIDs que fallen no aparecen.
+    """
+    sizes = {}
+    for offset in range(0, len(uid_list), chunk_size):
+        chunk = uid_list[offset:offset + chunk_size]
+        try:
+            typ, fetch_data = connection.uid('fetch', compress_uid_set(chunk), '(UID RFC822.SIZE)')
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            logging.warning(f"No se pudo obtener el tamaño de {len(chunk)} correos: {e}")
+            continue
+        if typ != 'OK':
+            continue
+        for meta, _ in iter_fetch_responses(fetch_data):
+            uid_match, size_match = _FETCH_UID_RE.search(meta), _FETCH_SIZE_RE.search(meta)
+            if uid_match and size_match:
+                sizes[uid_match.group(1)] = int(size_match.group(1))
+    return sizes
+
+
+def plan_fetch_batches(uid_list, sizes, max_count=PIPELINE_FETCH_BATCH_COUNT, max_bytes=PIPELINE_FETCH_BATCH_BYTES):
+    """
+    Agrupa los UIDs en lotes de descarga que no superen ``max_count`` correos
+    ni ``max_bytes`` bytes. Un correo de tamaño desconocido va en su propio lote.
+
+    :return: Lista de listas de UIDs.
+    """
+    batches, current, current_bytes = [], [], 0
+    for uid in uid_list:
+        size = sizes.get(uid)
+        if size is None:
+            if current:
+                batches.append(current)
+                current, current_bytes = [], 0
+            batches.append([uid])
+            continue
+        if current and (len(current) >= max_count or current_bytes + size > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(uid)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+class SpooledMessage:
+    """
+    Contenido de un correo grande guardado en un fichero temporal.
+    ``len()`` devuelve su tamaño, como con el contenido en ``bytes``.
+    """
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix='mailtransfer-')
+        self.size = 0
+        self._pending_cr = False
+
+    def write(self, data):
+        """Añade datos normalizando los saltos de línea a CRLF, como hace ``append``."""
+        if self._pending_cr:
+            data = b'\r' + data
+        # Un CR al final puede ser la mitad de un CRLF partido entre dos trozos
+        self._pending_cr = data.endswith(b'\r')
+        if self._pending_cr:
+            data = data[:-1]
+        data = imaplib.MapCRLF.sub(imaplib.CRLF, data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        if self._pending_cr:
+            self._pending_cr = False
+            self.file.write(imaplib.CRLF)
+            self.size += len(imaplib.CRLF)
+        self.file.seek(0)
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        self.file.close()
+
+
+def spool_message(connection, uid, size, chunk_bytes=LARGE_MESSAGE_CHUNK_BYTES):
+    """
+    Descarga un correo por partes con ``BODY.PEEK[]<inicio.longitud>`` a un
+    fichero temporal, de modo que en memoria nunca hay más de ``chunk_bytes``.
+
+    :param size: Tamaño del correo según RFC822.SIZE.
+    :return: Tupla (flags, fecha interna, ``SpooledMessage``), o None si el servidor no devuelve el correo.
+    """
+    typ, fetch_data = connection.uid('fetch', uid, '(UID INTERNALDATE FLAGS)')
+    responses = list(iter_fetch_responses(fetch_data)) if typ == 'OK' else []
+    if not responses:
+        return None
+    flags_string, internal_date = parse_fetch_metadata(responses[0][0].decode('utf-8', 'ignore'))
+
+    spool = SpooledMessage()
+    try:
+        offset = 0
+        while True:
+            typ, fetch_data = connection.uid('fetch', uid, f'(BODY.PEEK[]<{offset}.{chunk_bytes}>)')
+            literals = [literal for _, parts in iter_fetch_responses(fetch_data) for literal in parts] if typ == 'OK' else []
+            if not literals:
+                if offset == 0:
+                    spool.close()
+                    return None
+                break
+            spool.write(literals[0])
+            offset += len(literals[0])
+            # Un trozo incompleto marca el final; RFC822.SIZE solo es orientativo
+            if len(literals[0]) < chunk_bytes:
+                break
+        spool.finish()
+    except Exception:
+        spool.close()
+        raise
+    if offset != size:
+        logging.info(f"UID {uid.decode()}: RFC822.SIZE {size} pero se descargaron {offset} bytes.")
+    return flags_string, internal_date, spool
+
+
+def stream_append(connection, mailbox, flags, internal_date, spool, chunk_bytes=LARGE_MESSAGE_CHUNK_BYTES):
+    """
+    Sube un correo grande enviando el literal del APPEND por trozos desde su
+    fichero temporal, en lugar de construirlo entero en memoria.
+
+    :return: Tupla (tipo, datos) de la respuesta.
+    """
+    args = [mailbox]
+    if flags:
+        args.append(flags if (flags[0], flags[-1]) == ('(', ')') else f'({flags})')
+    if internal_date:
+        args.append(imaplib.Time2Internaldate(internal_date))
+    args.append(f'{{{len(spool)}}}')
+    connection.literal = _LiteralStream(connection, spool, chunk_bytes).send
+    return connection._simple_command('APPEND', *args)
+
+
+class _LiteralStream:
+    """
+    Literal de un APPEND leído de un fichero: al recibir la continuación se
+    envía por trozos y se devuelve b'' para que imaplib solo añada el CRLF final.
+    """
+    def __init__(self, connection, spool, chunk_bytes):
+        self.connection = connection
+        self.spool = spool
+        self.chunk_bytes = chunk_bytes
+
+    def send(self, continuation):
+        self.spool.file.seek(0)
+        for chunk in iter(lambda: self.spool.file.read(self.chunk_bytes), b''):
+            self.connection.send(chunk)
+        return b''
+
+
+def append_mode(connection):
+    """
+    Elige cómo subir correos a la conexión según sus capacidades:
+
+    * ``'MULTIAPPEND+LITERAL+'``: varios correos por APPEND, enviados de una vez.
+    * ``'MULTIAPPEND'``: varios correos por APPEND, esperando la continuación de cada literal.
+    * ``'APPEND'``: un APPEND por correo.
+    """
+    capabilities = connection.capabilities
+    if 'MULTIAPPEND' not in capabilities:
+        return 'APPEND'
+    return 'MULTIAPPEND+LITERAL+' if 'LITERAL+' in capabilities else 'MULTIAPPEND'
+
+
+def multi_append(connection, mailbox, messages, literal_plus):
+    """
+    Sube varios correos con un único APPEND (RFC 3502): el servidor los guarda
+    todos o ninguno y responde una sola vez.
+
+    Con LITERAL+ (RFC 7888) los literales no esperan la continuación del
+    servidor y se escriben seguidos por trozos (``literal_plus`` de
+    ``IMAPConnection``); sin él, cada literal se envía al recibir su
+    continuación (``literal`` invocable de imaplib).
+
+    :param messages: Lista de tuplas (flags o None, fecha interna, contenido) como las de ``append``.
+    :return: Tupla (tipo, datos) de la respuesta.
+    :raises imaplib.IMAP4.error: Si el servidor responde BAD.
+    """
+    parts = []
+    for flags, internal_date, content in messages:
+        prefix = b''
+        if flags:
+            if (flags[0], flags[-1]) != ('(', ')'):
+                flags = f'({flags})'
+            prefix += flags.encode('ascii', 'ignore') + b' '
+        if internal_date:
+            prefix += imaplib.Time2Internaldate(internal_date).encode('ascii') + b' '
+        parts.append((prefix, imaplib.MapCRLF.sub(imaplib.CRLF, content)))
+
+    if literal_plus:
+        prefix, literal = parts[0]
+        connection.literal_plus = _literal_plus_chunks(parts)
+        return connection._simple_command('APPEND', mailbox, prefix + b'{%d+}' % len(literal))
+
+    # Literales síncronos: imaplib llama a ``literal`` en cada continuación del servidor
+    literals = _LiteralSequence(parts)
+    connection.literal = literals.next
+    return connection._simple_command('APPEND', mailbox, literals.first_header)
+
+
+def _literal_plus_chunks(parts, chunk_bytes=APPEND_SEND_BYTES):
+    """
+    Resto de un APPEND múltiple con LITERAL+ tras su primera línea: cada literal
+    seguido de la cabecera del siguiente y el CRLF final, en trozos de hasta
+    ``chunk_bytes`` (los correos pequeños se agrupan en el mismo trozo).
+    """
+    buffer = bytearray()
+    for number, (prefix, literal) in enumerate(parts):
+        if number:
+            buffer += b' ' + prefix + b'{%d+}\r\n' % len(literal)
+        view = memoryview(literal)
+        for start in range(0, len(literal), chunk_bytes):
+            buffer += view[start:start + chunk_bytes]
+            if len(buffer) >= chunk_bytes:
+                yield bytes(buffer)
+                buffer.clear()
+    buffer += imaplib.CRLF
+    yield bytes(buffer)
+
+
+class _LiteralSequence:
+    """
+    Literales de un APPEND múltiple sin LITERAL+: en cada continuación se envía
+    el literal pendiente seguido de la cabecera (flags, fecha, {tamaño}) del siguiente.
+    """
+    def __init__(self, parts):
+        self.pending = deque(parts)
+        prefix, self.literal = self.pending.popleft()
+        self.first_header = prefix + b'{%d}' % len(self.literal)
+
+    def next(self, continuation):
+        literal = self.literal
+        if not self.pending:
+            return literal
+        prefix, self.literal = self.pending.popleft()
+        return literal + b' ' + prefix + b'{%d}' % len(self.literal)
+
+
+def _close_spools(parts):
+    """Cierra los ``SpooledMessage`` de una lista de valores (correos que ya no se subirán)."""
+    for part in parts:
+        if isinstance(part, SpooledMessage):
+            part.close()
+
+
+class ByteBudgetQueue:
+    """
+    Cola entre los hilos de descarga y los de subida acotada por bytes.
+
+    ``put`` se bloquea mientras los correos en espera superen ``max_bytes``,
+    salvo que la cola esté vacía (así un correo mayor que el límite también pasa).
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.bytes = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, item, size):
+        """Añade un elemento. Devuelve False si la cola se ha cerrado mientras esperaba."""
+        with self.cond:
+            while self.items and self.bytes + size > self.max_bytes and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return False
+            self.items.append((item, size))
+            self.bytes += size
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        """Devuelve el siguiente elemento, o None si la cola está cerrada y vacía."""
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            item, size = self.items.popleft()
+            self.bytes -= size
+            self.cond.notify_all()
+            return item
+
+    def get_many(self, max_count, max_bytes):
+        """
+        Espera al siguiente elemento y se lleva además los que ya estén en la
+        cola mientras no se superen ``max_count`` elementos ni ``max_bytes``.
+
+        :return: Lista de elementos; vacía si la cola está cerrada y vacía.
+        """
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            batch, batch_bytes = [], 0
+            while self.items and len(batch) < max_count:
+                item, size = self.items[0]
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                self.items.popleft()
+                self.bytes -= size
+                batch.append(item)
+                batch_bytes += size
+            if batch:
+                self.cond.notify_all()
+            return batch
+
+    def close(self, discard=False):
+        """
+        Cierra la cola. Con ``discard`` se descartan los elementos pendientes,
+        cerrando el fichero temporal de los que llevan un ``SpooledMessage``.
+        """
+        with self.cond:
+            self.closed = True
+            if discard:
+                for item, _ in self.items:
+                    _close_spools(item if isinstance(item, tuple) else (item,))
+                self.items.clear()
+                self.bytes = 0
+            self.cond.notify_all()
+
+    def depth(self):
+        with self.cond:
+            return len(self.items), self.bytes
+
+
+class CopyPipeline:
+    """
+    Copia correos del origen al destino como productor/consumidor.
+
+    Los hilos de descarga (uno por conexión de origen) piden los correos por
+    lotes y dejan (uid, flags, fecha, contenido) en una ``ByteBudgetQueue``;
+    los hilos de subida (uno por conexión de destino) la vacían con APPEND,
+    agrupando varios correos por comando si el destino anuncia MULTIAPPEND.
+    Así ninguna conexión espera a la otra y la memoria queda acotada por
+    ``max_buffer_bytes`` sea cual sea el tamaño de la carpeta.
+
+    Los correos mayores que ``large_message_bytes`` (según ``sizes``) no pasan
+    por memoria: se descargan por partes a un fichero temporal y se suben desde él.
+
+    Cada conexión la usa un único hilo y debe tener ya seleccionada la carpeta
+    (las de origen) o existir la carpeta destino (las de destino).
+
+    Con ``metrics`` (un ``FolderMetrics``) se le pasan los contadores y la
+    profundidad de la cola cada vez que se informa del progreso.
+    """
+    def __init__(self, folder_name, source_connections, dest_connections, log_callback, progress_callback,
+                 widgets, cancel_event=None, max_buffer_bytes=PIPELINE_MAX_BUFFER_BYTES, dest_folder_name=None,
+                 append_batch_count=APPEND_BATCH_COUNT, append_batch_bytes=APPEND_BATCH_BYTES,
+                 large_message_bytes=LARGE_MESSAGE_BYTES, metrics=None):
+        self.folder_name = folder_name
+        self.dest_folder_name = dest_folder_name or folder_name
+        self.append_batch_count = append_batch_count
+        self.append_batch_bytes = append_batch_bytes
+        self.large_message_bytes = large_message_bytes
+        self.sizes = {}
+        self.source_connections = source_connections
+        self.dest_connections = dest_connections
+        self.log_callback = log_callback
+        self.progress_callback = progress_callback
+        self.widgets = widgets
+        self.cancel_event = cancel_event or threading.Event()
+        self.buffer = ByteBudgetQueue(max_buffer_bytes)
+        self.batches = Queue()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        self.fetched = self.appended = self.failed = 0
+        self.fetched_bytes = self.appended_bytes = 0
+        self.pending_appended = []
+        self.metrics = metrics
+        self.reported = (0, 0, 0, 0, 0)
+
+    def _stopping(self):
+        return self.stop_event.is_set() or self.cancel_event.is_set()
+
+    def _fail(self, exc):
+        with self.lock:
+            if self.error is None:
+                self.error = exc
+        self.stop_event.set()
+        self.buffer.close(discard=True)
+
+    def _reader(self, connection):
+        try:
+            while not self._stopping():
+                try:
+                    batch = self.batches.get_nowait()
+                except Empty:
+                    return
+                if len(batch) == 1 and self.sizes.get(batch[0], 0) > self.large_message_bytes:
+                    if not self._read_large(connection, batch[0]):
+                        return
+                    continue
+                typ, fetch_data = connection.uid('fetch', compress_uid_set(batch), '(UID INTERNALDATE FLAGS RFC822)')
+                if typ != 'OK':
+                    logging.warning(f"FETCH rechazado para {len(batch)} correos de {self.folder_name}: {fetch_data}")
+                    with self.lock:
+                        self.failed += len(batch)
+                    continue
+                received = 0
+                for meta, literals in iter_fetch_responses(fetch_data):
+                    uid_match = _FETCH_UID_RE.search(meta)
+                    if not uid_match or not literals:
+                        continue
+                    flags_string, internal_date = parse_fetch_metadata(meta.decode('utf-8', 'ignore'))
+                    content = literals[0]
+                    received += 1
+                    with self.lock:
+                        self.fetched += 1
+                        self.fetched_bytes += len(content)
+                    if not self.buffer.put((uid_match.group(1), flags_string, internal_date, content), len(content)):
+                        return
+                if received < len(batch):
+                    with self.lock:
+                        self.failed += len(batch) - received
+        except Exception as e:
+            self._fail(e)
+
+    def _read_large(self, connection, uid):
+        """Descarga un correo grande a disco. Devuelve False si la cola se ha cerrado."""
+        size = self.sizes[uid]
+        logging.info(f"Correo grande (UID {uid.decode()}, {size / 1048576:.1f} MB) en {self.folder_name}: "
+                     f"se copia por partes a través de un fichero temporal.")
+        result = spool_message(connection, uid, size)
+        if result is None:
+            logging.warning(f"No se pudo descargar el correo grande UID {uid.decode()} de {self.folder_name}.")
+            with self.lock:
+                self.failed += 1
+            return True
+        flags_string, internal_date, spool = result
+        with self.lock:
+            self.fetched += 1
+            self.fetched_bytes += len(spool)
+        if not self.buffer.put((uid, flags_string, internal_date, spool), len(spool)):
+            spool.close()
+            return False
+        return True
+
+    def _writer(self, connection):
+        mailbox = f'"{self.dest_folder_name}"'
+        mode = append_mode(connection)
+        batch_count = self.append_batch_count if mode != 'APPEND' else 1
+        records = []
+        try:
+            while not self._stopping():
+                records = self.buffer.get_many(batch_count, self.append_batch_bytes)
+                if not records:
+                    return
+                for record in [r for r in records if isinstance(r[3], SpooledMessage)]:
+                    records.remove(record)
+                    self._stream(connection, mailbox, record)
+                if len(records) > 1:
+                    try:
+                        typ, data = multi_append(connection, mailbox, [record[1:] for record in records],
+                                                 mode == 'MULTIAPPEND+LITERAL+')
+                    except connection.abort:
+                        raise
+                    except connection.error as e:
+                        # BAD: el servidor no acepta bien el APPEND múltiple, se deja de usar en esta conexión
+                        typ, data = 'BAD', [str(e)]
+                        mode, batch_count = 'APPEND', 1
+                    if typ == 'OK':
+                        self._appended(records)
+                        continue
+                    # El APPEND múltiple es todo o nada: se reintenta correo a correo
+                    logging.warning(f"APPEND múltiple de {len(records)} correos rechazado en {self.folder_name}, "
+                                    f"se suben uno a uno: {data}")
+                for record in records:
+                    uid, flags_string, internal_date, content = record
+                    typ, data = connection.append(mailbox, flags_string, internal_date, content)
+                    if typ == 'OK':
+                        self._appended([record])
+                    else:
+                        with self.lock:
+                            self.failed += 1
+                        logging.warning(f"APPEND rechazado (UID {uid.decode()}) en {self.folder_name}: {data}")
+        except Exception as e:
+            # Los correos grandes del lote que no llegaron a subirse aún tienen su fichero abierto
+            _close_spools(record[3] for record in records)
+            self._fail(e)
+
+    def _stream(self, connection, mailbox, record):
+        uid, flags_string, internal_date, spool = record
+        try:
+            typ, data = stream_append(connection, mailbox, flags_string, internal_date, spool)
+        finally:
+            spool.close()
+        if typ == 'OK':
+            self._appended([record])
+        else:
+            with self.lock:
+                self.failed += 1
+            logging.warning(f"APPEND rechazado (UID {uid.decode()}) en {self.folder_name}: {data}")
+
+    def _appended(self, records):
+        with self.lock:
+            for uid, _, _, content in records:
+                self.appended += 1
+                self.appended_bytes += len(content)
+                self.pending_appended.append(uid)
+
+    def _drain_appended(self):
+        with self.lock:
+            uids, self.pending_appended = self.pending_appended, []
+        return uids
+
+    def run(self, uid_list, sizes=None, on_appended=None):
+        """
+        Copia los UIDs indicados y espera a que termine.
+
+        :param sizes: {uid: tamaño} para agrupar las descargas por lotes (ver ``plan_fetch_batches``)
+                      y detectar los correos grandes.
+        :param on_appended: Función que recibe, periódicamente y desde este hilo, la lista
+                            de UIDs del origen ya subidos al destino.
+        :return: Diccionario con las estadísticas de la copia.
+        :raises Exception: El primer error de conexión de cualquiera de los hilos.
+        """
+        total = len(uid_list)
+        self.sizes = sizes or {}
+        for batch in plan_fetch_batches(uid_list, self.sizes):
+            self.batches.put(batch)
+
+        modes = sorted({append_mode(conn) for conn in self.dest_connections})
+        logging.info(f"Subida a {self.dest_folder_name} con {', '.join(modes)} "
+                     f"(lotes de hasta {self.append_batch_count} correos / {self.append_batch_bytes // 1048576} MB).")
+        if modes != ['APPEND']:
+            self.log_callback(self.widgets, f"Destino con {', '.join(modes)}: varios correos por APPEND.", "cyan")
+
+        readers = [threading.Thread(target=self._reader, args=(conn,), daemon=True) for conn in self.source_connections]
+        writers = [threading.Thread(target=self._writer, args=(conn,), daemon=True) for conn in self.dest_connections]
+        start_time = time.monotonic()
+        for thread in readers + writers:
+            thread.start()
+
+        readers_done = False
+        while any(t.is_alive() for t in writers) or any(t.is_alive() for t in readers):
+            for thread in readers + writers:
+                thread.join(PIPELINE_REPORT_INTERVAL / max(len(readers) + len(writers), 1))
+            if not readers_done and not any(t.is_alive() for t in readers):
+                readers_done = True
+                self.buffer.close(discard=self._stopping())
+            if self.cancel_event.is_set():
+                self.buffer.close(discard=True)
+            self._report(total, start_time)
+            if on_appended:
+                uids = self._drain_appended()
+                if uids:
+                    on_appended(uids)
+
+        if on_appended:
+            uids = self._drain_appended()
+            if uids:
+                on_appended(uids)
+        self._report(total, start_time)
+
+        elapsed = time.monotonic() - start_time
+        stats = {
+            'total': total, 'fetched': self.fetched, 'appended': self.appended, 'failed': self.failed,
+            'bytes': self.appended_bytes, 'seconds': elapsed, 'cancelled': self.cancel_event.is_set(),
+        }
+        logging.info(
+            f"Copia de {self.folder_name}: {self.appended}/{total} subidos, {self.failed} fallidos, "
+            f"{self.appended_bytes / 1048576:.1f} MB en {elapsed:.1f} s "
+            f"({self.appended / max(elapsed, 1e-6):.1f} correos/s)."
+        )
+        if self.error is not None:
+            raise self.error
+        return stats
+
+    def _report(self, total, start_time):
+        """Informa del progreso de cada etapa (descarga, cola y subida)."""
+        with self.lock:
+            fetched, appended = self.fetched, self.appended
+            counters = (self.fetched, self.fetched_bytes, self.appended, self.appended_bytes, self.failed)
+        queued, queued_bytes = self.buffer.depth()
+        if self.metrics is not None:
+            # Se pasan las diferencias: si la carpeta se reintenta, la nueva tubería suma a lo anterior
+            self.metrics.add(*(now - before for now, before in zip(counters, self.reported)))
+            self.metrics.set_queue(queued, queued_bytes)
+            self.reported = counters
+        rate = appended / max(time.monotonic() - start_time, 1e-6)
+        self.progress_callback(self.widgets, appended, total)
+        self.log_callback(
+            self.widgets,
+            f"Descargados {fetched}/{total} | en cola {queued} ({queued_bytes / 1048576:.1f} MB) | "
+            f"subidos {appended}/{total} ({rate:.1f} correos/s)",
+            "cyan"
+        )
+
+
+_LIST_RESPONSE_RE = re.compile(r'\((.*?)\)\s+"(.*?)"\s+(.*)')
+
+
+def parse_folder_list(folders_raw):
+    """
+    Extrae los nombres de carpeta de la respuesta de LIST.
+
+    :return: Lista ordenada y sin duplicados de nombres de carpeta.
+    """
+    folder_names = []
+    for folder_info_bytes in folders_raw:
+        if not isinstance(folder_info_bytes, bytes):
+            continue
+        line = folder_info_bytes.decode('utf-8', 'ignore')
+        match = _LIST_RESPONSE_RE.match(line)
+        if match:
+            name = match.group(3).strip().strip('"')
+            if name:  # Evita añadir carpetas raíz sin nombre
+                folder_names.append(name)
+    return sorted(set(folder_names))
+
+
+def list_folders(connection):
+    """
+    Carpetas de la cuenta (LIST). Se piden una sola vez por sesión: las
+    siguientes llamadas usan la lista guardada en la conexión.
+
+    :return: Lista ordenada de nombres de carpeta, o None si el servidor deniega el LIST.
+    """
+    if connection.folder_names is None:
+        typ, data = connection.list()
+        if typ != 'OK':
+            return None
+        connection.folder_names = set(parse_folder_list(data))
+    return sorted(connection.folder_names)
+
+
+def ensure_folder(connection, folder_name):
+    """
+    Crea la carpeta y se suscribe a ella, salvo lo que el LIST y el LSUB de la
+    sesión (en caché) indican que ya está hecho.
+    """
+    if connection.subscribed_names is None:
+        try:
+            typ, data = connection.lsub()
+            connection.subscribed_names = set(parse_folder_list(data)) if typ == 'OK' else set()
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error:  # Servidores IMAP4rev2 sin LSUB
+            connection.subscribed_names = set()
+    if folder_name not in (list_folders(connection) or ()):
+        connection.create(f'"{folder_name}"')
+        if connection.folder_names is not None:
+            connection.folder_names.add(folder_name)
+    if folder_name not in connection.subscribed_names:
+        typ, _ = connection.subscribe(f'"{folder_name}"')
+        if typ == 'OK':
+            connection.subscribed_names.add(folder_name)
+
+
+def list_folders_native(host, user, password, queue):
+    """
+    Obtiene la lista de carpetas de una cuenta IMAP y la pone en una cola
+    para ser leída por el hilo principal de la GUI.
+    """
+    try:
+        with connect_imap(host) as mail:
+            mail.login(user, password)
+            refresh_capabilities(mail)
+            mail.compress()
+            folder_names = list_folders(mail)
+            if folder_names is None:
+                queue.put({'status': 'error', 'message': 'El servidor denegó la petición de listar carpetas.'})
+                return
+            
+            if folder_names:
+                queue.put({'status': 'success', 'folders': folder_names})
+            else:
+                queue.put({'status': 'error', 'message': "No se encontraron carpetas analizables."})
+    except Exception as e:
+        queue.put({'status': 'error', 'message': f"Error crítico: {e}"})
+
+
+# --- COPIA EN EL SERVIDOR (MISMO SERVIDOR Y MISMA CUENTA) ---
+# Número máximo de UIDs por comando UID COPY (limita la longitud de la línea).
+SERVER_COPY_CHUNK_SIZE = 1000
+
+_COPYUID_RE = re.compile(rb'(\d+) ([\d:,]+) ([\d:,]+)')
+
+
+def resolve_addresses(host):
+    """Devuelve el conjunto de (dirección IP, puerto) de un host (vacío si no se resuelve)."""
+    address, port = split_host_port(host)
+    try:
+        return {(info[4][0], port) for info in socket.getaddrinfo(address, port, proto=socket.IPPROTO_TCP)}
+    except OSError:
+        return set()
+
+
+def is_same_account(host1, user1, host2, user2):
+    """
+    Indica si origen y destino son la misma cuenta en el mismo servidor, el
+    único caso en el que un UID COPY del origen puede dejar el correo en el destino.
+    """
+    if user1.strip().lower() != user2.strip().lower():
+        return False
+    if host1.strip().lower() == host2.strip().lower():
+        return True
+    return bool(resolve_addresses(host1) & resolve_addresses(host2))
+
+
+def get_hierarchy_delimiter(connection):
+    """Obtiene el separador de jerarquía de carpetas del servidor (LIST "" ""), una vez por sesión."""
+    if connection.hierarchy_delimiter is None:
+        connection.hierarchy_delimiter = '/'
+        typ, data = connection.list('""', '""')
+        if typ == 'OK' and data and isinstance(data[0], bytes):
+            match = _LIST_RESPONSE_RE.match(data[0].decode('utf-8', 'ignore'))
+            if match and match.group(2):
+                connection.hierarchy_delimiter = match.group(2)
+    return connection.hierarchy_delimiter
+
+
+def server_side_copy(source, dest_folder_name, uid_list, progress_callback, widgets, cancel_event=None,
+                     on_copied=None):
+    """
+    Copia correos a otra carpeta de la misma cuenta con UID COPY, sin
+    descargarlos. Con UIDPLUS la respuesta COPYUID indica el UID asignado a
+    cada correo en la carpeta destino.
+
+    :param source: Conexión con la carpeta de origen seleccionada (basta en solo lectura).
+    :param on_copied: Función que recibe los UIDs de cada bloque copiado, para retomar tras un corte.
+    :return: Tupla (UIDs copiados, {uid origen (bytes): uid destino (int)}, UIDs que no se pudieron copiar).
+    """
+    copied, mapping, failed = [], {}, []
+    total = len(uid_list)
+    for offset in range(0, total, SERVER_COPY_CHUNK_SIZE):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        chunk = uid_list[offset:offset + SERVER_COPY_CHUNK_SIZE]
+        source.untagged_responses.pop('COPYUID', None)
+        typ, data = source.uid('copy', compress_uid_set(chunk), f'"{dest_folder_name}"')
+        if typ != 'OK':
+            logging.warning(f"UID COPY rechazado para {len(chunk)} correos: {source.untagged_responses.get('NO') or data}")
+            failed.extend(chunk)
+            continue
+        copied.extend(chunk)
+        if on_copied:
+            on_copied(chunk)
+        for value in source.untagged_responses.pop('COPYUID', None) or []:
+            match = _COPYUID_RE.match(value) if isinstance(value, bytes) else None
+            if match:
+                source_uids = parse_uid_set(match.group(2).decode())
+                dest_uids = parse_uid_set(match.group(3).decode())
+                mapping.update({str(s).encode(): d for s, d in zip(source_uids, dest_uids)})
+        progress_callback(widgets, min(offset + len(chunk), total), total)
+    return copied, mapping, failed
+
+
+# --- POOL DE CONEXIONES Y PLANIFICADOR DE CARPETAS ---
+# Carpetas que se sincronizan a la vez, sumando todas las cuentas.
+MAX_PARALLEL_FOLDERS = 8
+# Conexiones abiertas como máximo contra un mismo servidor y con una misma cuenta.
+MAX_CONNECTIONS_PER_HOST = 8
+MAX_CONNECTIONS_PER_ACCOUNT = 2
+# Una conexión inactiva más tiempo que esto se comprueba con NOOP antes de reutilizarla.
+POOL_IDLE_CHECK_SECONDS = 60
+# Cada cuántos segundos se publican las métricas durante la ejecución.
+METRICS_INTERVAL = 5.0
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones IMAP autenticadas compartido por todas las tareas.
+
+    Reutiliza las sesiones ya abiertas entre carpetas y limita cuántas
+    conexiones hay abiertas a la vez contra cada servidor y con cada cuenta.
+    ``acquire`` entrega todas las conexiones pedidas a la vez o ninguna, de
+    modo que dos carpetas no pueden bloquearse esperando la una por la otra.
+    """
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, max_per_account=MAX_CONNECTIONS_PER_ACCOUNT,
+                 metrics=None, compress=True):
+        self.max_per_host = max_per_host
+        self.max_per_account = max_per_account
+        self.cond = threading.Condition()
+        self.idle = {}               # (host, usuario) -> [(conexión, instante en que quedó libre)]
+        self.open_per_host = {}
+        self.open_per_account = {}
+        self.account_of = {}         # conexión -> (host, usuario)
+        self.enabled = {}            # conexión -> extensiones activadas con ENABLE
+        self.metrics = metrics       # SyncMetrics al que las conexiones anotan sus comandos
+        self.compress = compress     # Activar COMPRESS=DEFLATE en las sesiones que lo permitan
+        self.closed = False
+
+    def _reserve(self, accounts):
+        """
+        Intenta reservar conexiones para todas las cuentas pedidas.
+        Se llama con ``self.cond`` adquirido. Devuelve None si hay que esperar.
+        """
+        needed_host, needed_account = {}, {}
+        for host, user, _, _ in accounts:
+            needed_host[host] = needed_host.get(host, 0) + 1
+            needed_account[(host, user)] = needed_account.get((host, user), 0) + 1
+
+        plan, evict, taken = [], [], set()
+        new_host, new_account = {}, {}
+        for host, user, password, condstore in accounts:
+            key = (host, user)
+            candidates = [(conn, since) for conn, since in self.idle.get(key, []) if conn not in taken]
+            if candidates:
+                # Para el modo incremental se prefieren sesiones que ya tengan CONDSTORE/QRESYNC activado
+                if condstore:
+                    candidates.sort(key=lambda item: not self.enabled.get(item[0]))
+                conn, since = candidates[0]
+                taken.add(conn)
+                plan.append(('idle', key, conn, since))
+                continue
+
+            host_limit = max(self.max_per_host, needed_host[host])
+            account_limit = max(self.max_per_account, needed_account[key])
+            if self.open_per_account.get(key, 0) + new_account.get(key, 0) >= account_limit:
+                return None
+            evicted_here = sum(1 for conn in evict if self.account_of[conn][0] == host)
+            if self.open_per_host.get(host, 0) + new_host.get(host, 0) - evicted_here >= host_limit:
+                # Cierra una conexión inactiva de otra cuenta del mismo servidor para dejar sitio
+                victim = next((conn for other_key, conns in self.idle.items() if other_key[0] == host and other_key != key
+                               for conn, _ in conns if conn not in taken), None)
+                if victim is None:
+                    return None
+                taken.add(victim)
+                evict.append(victim)
+            new_host[host] = new_host.get(host, 0) + 1
+            new_account[key] = new_account.get(key, 0) + 1
+            plan.append(('new', key, password, condstore))
+
+        # Confirma la reserva
+        for item in plan:
+            if item[0] == 'idle':
+                self.idle[item[1]] = [(c, t) for c, t in self.idle[item[1]] if c is not item[2]]
+        for conn in evict:
+            key = self.account_of[conn]
+            self.idle[key] = [(c, t) for c, t in self.idle[key] if c is not conn]
+            self._forget(conn)
+        for host, count in new_host.items():
+            self.open_per_host[host] = self.open_per_host.get(host, 0) + count
+        for key, count in new_account.items():
+            self.open_per_account[key] = self.open_per_account.get(key, 0) + count
+        return plan, evict
+
+    def _forget(self, conn):
+        """Descuenta una conexión que se va a cerrar. Se llama con ``self.cond`` adquirido."""
+        host, user = self.account_of.pop(conn)
+        self.enabled.pop(conn, None)
+        if self.metrics is not None:
+            self.metrics.close_connection(conn.traffic)
+        self.open_per_host[host] -= 1
+        self.open_per_account[(host, user)] -= 1
+
+    def _unreserve(self, key):
+        with self.cond:
+            self.open_per_host[key[0]] -= 1
+            self.open_per_account[key] -= 1
+            self.cond.notify_all()
+
+    def _open(self, key, password, condstore):
+        """Abre y autentica una conexión nueva (fuera del bloqueo)."""
+        host, user = key
+        conn = connect_imap(host)
+        conn.metrics = self.metrics
+        conn.traffic.user = user
+        try:
+            conn.login(user, password)
+            refresh_capabilities(conn)
+            if self.compress:
+                conn.compress()
+            enabled = enable_condstore(conn) if condstore else set()
+        except Exception:
+            _close_quietly(conn)
+            raise
+        logging.info(f"Nueva conexión a {host} ({user}){' con COMPRESS=DEFLATE' if conn.traffic.compressed else ''}.")
+        if self.metrics is not None:
+            self.metrics.add_connection(conn.traffic)
+        with self.cond:
+            self.account_of[conn] = key
+            self.enabled[conn] = enabled
+        return conn
+
+    def acquire(self, *accounts, cancel_event=None):
+        """
+        Obtiene una conexión autenticada por cada cuenta pedida.
+
+        :param accounts: Tuplas (host, usuario, contraseña, condstore). Con ``condstore``
+                         las conexiones nuevas activan CONDSTORE/QRESYNC tras el login.
+        :param cancel_event: Si se activa mientras se espera, se devuelve None.
+        :return: Lista de conexiones en el mismo orden, o None si se canceló.
+        """
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError("El pool de conexiones está cerrado.")
+                reserved = self._reserve(accounts)
+                if reserved is not None:
+                    break
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                self.cond.wait(0.5)
+        plan, evict = reserved
+
+        for conn in evict:
+            _close_quietly(conn)
+
+        connections = []
+        try:
+            for item in plan:
+                if item[0] == 'idle':
+                    _, key, conn, since = item
+                    if time.monotonic() - since > POOL_IDLE_CHECK_SECONDS:
+                        try:
+                            conn.noop()
+                        except Exception:
+                            # La sesión caducó en el servidor: se sustituye por una nueva
+                            with self.cond:
+                                self._forget(conn)
+                                self.open_per_host[key[0]] += 1
+                                self.open_per_account[key] += 1
+                            _close_quietly(conn)
+                            account = next(a for a in accounts if (a[0], a[1]) == key)
+                            conn = self._reopen(key, account[2], account[3])
+                    connections.append(conn)
+                else:
+                    _, key, password, condstore = item
+                    connections.append(self._reopen(key, password, condstore))
+        except Exception:
+            self.release(*connections)
+            # Libera también las reservas que no llegaron a abrirse
+            # (la que falló ya se liberó en _reopen)
+            for item in plan[len(connections) + 1:]:
+                if item[0] == 'new':
+                    self._unreserve(item[1])
+                else:
+                    self.release(item[2])
+            raise
+        return connections
+
+    def _reopen(self, key, password, condstore):
+        try:
+            return self._open(key, password, condstore)
+        except Exception:
+            self._unreserve(key)
+            raise
+
+    def release(self, *connections, broken=False):
+        """Devuelve conexiones al pool. Las marcadas como ``broken`` se cierran."""
+        to_close = []
+        with self.cond:
+            for conn in connections:
+                if conn not in self.account_of:
+                    continue
+                if broken or self.closed:
+                    self._forget(conn)
+                    to_close.append(conn)
+                else:
+                    self.idle.setdefault(self.account_of[conn], []).append((conn, time.monotonic()))
+            self.cond.notify_all()
+        for conn in to_close:
+            _close_quietly(conn)
+
+    def extensions(self, conn):
+        """Extensiones CONDSTORE/QRESYNC utilizables en la conexión."""
+        enabled = self.enabled.get(conn)
+        if enabled:
+            return enabled
+        # Sin ENABLE en esta sesión, CONDSTORE sigue disponible con SELECT ... (CONDSTORE)
+        return {'CONDSTORE'} if 'CONDSTORE' in conn.capabilities else set()
+
+    def close_all(self):
+        """Cierra todas las conexiones inactivas; las que estén en uso se cerrarán al liberarse."""
+        with self.cond:
+            self.closed = True
+            to_close = [conn for conns in self.idle.values() for conn, _ in conns]
+            for conn in to_close:
+                self._forget(conn)
+            self.idle = {}
+            self.cond.notify_all()
+        for conn in to_close:
+            _close_quietly(conn)
+
+
+def _close_quietly(connection):
+    """Cierra una conexión IMAP ignorando los errores (puede estar ya caída)."""
+    try:
+        connection.logout()
+    except Exception:
+        try:
+            connection.shutdown()
+        except Exception:
+            pass
+
+
+# Modos de sincronización de una tarea.
+SYNC_MODE_SAFE = "Sincronización Segura (lenta)"
+SYNC_MODE_INCREMENTAL = "Incremental (CONDSTORE)"
+SYNC_MODE_FORCE = "Forzar Copia (rápida)"
+SYNC_MODES = [SYNC_MODE_SAFE, SYNC_MODE_INCREMENTAL, SYNC_MODE_FORCE]
+
+
+class SyncJobRun:
+    """
+    Estado de una tarea (cuenta de origen -> cuenta de destino) durante la
+    ejecución: su configuración, las carpetas pendientes y el progreso.
+
+    La tarea es un diccionario con datos simples:
+
+    * ``host1``, ``user1``, ``pass1``, ``host2``, ``user2``, ``pass2``: cuentas de origen y destino.
+    * ``sync_mode``: uno de ``SYNC_MODES`` (por defecto ``SYNC_MODE_SAFE``).
+    * ``selected_folders``: carpetas a copiar (vacío: todas).
+    * ``propagate_expunge``, ``dest_prefix``: opciones del modo incremental y de la carpeta destino.
+    * ``widgets``: valor que se pasa tal cual a los callbacks de log y progreso.
+    * ``cancel_event``: ``threading.Event`` para detener la tarea.
+    * ``name``: nombre de la tarea en las métricas (por defecto ``usuario1->usuario2``;
+      si se repite en la misma ejecución se numera).
+
+    :param metrics: ``SyncMetrics`` compartido por las tareas de la ejecución (si no, uno propio).
+    """
+    def __init__(self, job_data, log_callback, progress_callback, metrics=None):
+        self.widgets = job_data.get('widgets')
+        self.host1, self.user1, self.pass1, self.host2, self.user2, self.pass2 = (
+            job_data[k] for k in ["host1", "user1", "pass1", "host2", "user2", "pass2"])
+        self.metrics = (metrics or SyncMetrics()).add_job(job_data.get('name') or f"{self.user1}->{self.user2}")
+        self.name = self.metrics.name
+        self.sync_mode = job_data.get("sync_mode") or SYNC_MODE_SAFE
+        if self.sync_mode not in SYNC_MODES:
+            raise ValueError(f"Modo de sincronización desconocido: {self.sync_mode}")
+        self.propagate_expunge = bool(job_data.get("propagate_expunge"))
+        self.dest_prefix = (job_data.get("dest_prefix") or "").strip()
+        self.selected_folders = list(job_data.get("selected_folders") or [])
+        self.cancel_event = job_data.get("cancel_event") or threading.Event()
+        self.log_callback = log_callback
+        self.progress_callback = progress_callback
+
+        self.force_copy = self.sync_mode == SYNC_MODE_FORCE
+        self.incremental = self.sync_mode == SYNC_MODE_INCREMENTAL
+        self.lock = threading.Lock()
+        self.pending_units = 1   # La planificación cuenta como la primera unidad
+        self.total_folders = 0
+        self.folder_fraction = {}
+        self.folder_errors = 0
+        self.failed = False
+        # Se determinan al planificar la tarea
+        self.same_account = False
+        self.dest_delimiter = '/'
+        # UIDs de origen ya subidos en esta ejecución, por carpeta: si la carpeta
+        # se reintenta tras un corte, se retoma donde se quedó (también en Forzar Copia)
+        self.appended = {}
+
+    def record_appended(self, folder_name, uids):
+        with self.lock:
+            self.appended.setdefault(folder_name, set()).update(int(uid) for uid in uids)
+
+    def appended_uids(self, folder_name):
+        with self.lock:
+            return set(self.appended.get(folder_name, ()))
+
+    def appended_count(self):
+        with self.lock:
+            return sum(len(uids) for uids in self.appended.values())
+
+    def dest_folder_name(self, folder_name):
+        """Nombre de la carpeta destino: la de origen, bajo el prefijo de destino si hay."""
+        if not self.dest_prefix:
+            return folder_name
+        return f"{self.dest_prefix.rstrip(self.dest_delimiter)}{self.dest_delimiter}{folder_name}"
+
+    def is_own_copy(self, folder_name, listed=False):
+        """
+        En la misma cuenta, indica si copiar la carpeta la metería dentro de sí
+        misma (su destino es una subcarpeta suya) o, para las carpetas listadas
+        del servidor, si está bajo el prefijo de destino: la creó una ejecución
+        anterior y copiarla daría ``prefijo/prefijo/...``.
+        """
+        if not self.same_account:
+            return False
+        if listed and self.dest_prefix:
+            prefix = self.dest_prefix.rstrip(self.dest_delimiter)
+            if folder_name == prefix or folder_name.startswith(prefix + self.dest_delimiter):
+                return True
+        return self.dest_folder_name(folder_name).startswith(folder_name + self.dest_delimiter)
+
+    def source_account(self):
+        return (self.host1, self.user1, self.pass1, self.incremental)
+
+    def dest_account(self):
+        return (self.host2, self.user2, self.pass2, False)
+
+    def log(self, message, color):
+        self.log_callback(self.widgets, message, color)
+
+    def folder_progress_callback(self, folder_name):
+        """
+        Devuelve un callback de progreso para una carpeta que actualiza la barra
+        de la tarea con la media del avance de todas sus carpetas.
+        """
+        def update(widgets, value, total):
+            with self.lock:
+                self.folder_fraction[folder_name] = value / total if total > 0 else 0
+                done = sum(self.folder_fraction.values())
+                folders = max(self.total_folders, 1)
+            self.metrics.set_progress(done / folders)
+            self.progress_callback(widgets, int(done * 1000), folders * 1000)
+        return update
+
+    def fail(self, exc):
+        self.failed = True
+        self.log(f"Error Crítico: {exc}", "red")
+        logging.critical(f"FALLO CRÍTICO en la sincronización {self.user1} -> {self.user2}: {exc}\n{traceback.format_exc()}")
+
+    def folder_error(self, folder_name, exc):
+        with self.lock:
+            self.folder_errors += 1
+        self.metrics.folder(folder_name).finish('error')
+        self.log(f"Error en carpeta {folder_name}: {exc}", "orange")
+        logging.error(f"FALLO en la carpeta {folder_name} ({self.user1}): {exc}\n{traceback.format_exc()}")
+
+    @property
+    def status(self):
+        """Resultado de la tarea: 'ok', 'partial' (carpetas con error), 'failed' o 'cancelled'."""
+        if self.failed:
+            return 'failed'
+        if self.cancel_event.is_set():
+            return 'cancelled'
+        return 'partial' if self.folder_errors else 'ok'
+
+    def finish(self):
+        """Informa del final de la tarea cuando ya no le quedan carpetas."""
+        self.metrics.finish(self.status)
+        if self.failed:
+            return
+        if self.cancel_event.is_set():
+            self.log("Sincronización detenida.", "yellow")
+            logging.info(f"SINCRONIZACIÓN DETENIDA POR EL USUARIO: {self.user1} -> {self.user2}")
+        else:
+            self.log("¡Sincronización Completada!", "green")
+            logging.info(f"FIN DE SINCRONIZACIÓN: {self.user1} -> {self.user2}")
+
+
+def sync_folder(run, folder_name, folder_number, source, dest, condstore, state_index):
+    """
+    Sincroniza una carpeta de una tarea usando el modo seleccionado.
+
+    :param run: ``SyncJobRun`` de la tarea.
+    :param folder_number: Posición de la carpeta en la tarea (para los mensajes).
+    :param source: Conexión autenticada al origen.
+    :param dest: Conexión autenticada al destino.
+    :param condstore: Extensiones CONDSTORE/QRESYNC del origen (vacío si no es modo incremental).
+    :param state_index: ``SyncStateIndex`` compartido (None en modo Forzar Copia).
+    """
+    widgets = run.widgets
+    log_callback = run.log_callback
+    progress_callback = run.folder_progress_callback(folder_name)
+    dest_folder = run.dest_folder_name(folder_name)
+    metrics = run.metrics.folder(folder_name)
+
+    log_callback(widgets, f"Carpeta ({folder_number}/{run.total_folders}): {folder_name}", "white")
+    logging.info(f"--- Procesando carpeta: {folder_name} -> {dest_folder} ({run.user1}) ---")
+
+    if run.same_account and dest_folder == folder_name:
+        log_callback(widgets, f"{folder_name}: origen y destino son la misma carpeta, se omite.", "yellow")
+        logging.warning(f"Origen y destino son la misma carpeta ({folder_name}), no hay nada que copiar.")
+        progress_callback(widgets, 1, 1)
+        metrics.finish('omitida')
+        return
+
+    # Crea la carpeta en el destino y se suscribe para que sea visible
+    ensure_folder(dest, dest_folder)
+
+    source_state = select_folder(source, folder_name, readonly=True, condstore=bool(condstore))
+
+    uids_to_fetch = []
+    source_folder_id = dest_folder_id = None
+    # Lógica para el modo "Forzar Copia", que es más rápido pero puede duplicar
+    if run.force_copy:
+        log_callback(widgets, "Modo Forzar Copia: Obteniendo todos los correos...", "yellow")
+        logging.info("Modo Forzar Copia. Obteniendo todos los UIDs del origen.")
+        typ, data = source.uid('search', None, 'ALL')
+        if typ == 'OK' and data[0]:
+            uids_to_fetch = data[0].split()
+    else:  # Modo por defecto: "Sincronización Segura"
+        changes = None
+        if condstore:
+            changes = get_folder_changes(
+                source, state_index, run.host1, run.user1, folder_name, source_state,
+                'QRESYNC' in condstore, log_callback, widgets)
+            source_index, source_folder_id = changes['index'], changes['folder_id']
+        else:
+            source_index, source_folder_id = get_fingerprint_index_cached(
+                source, state_index, run.host1, run.user1, folder_name, source_state, log_callback, widgets)
+        dest_state = select_folder(dest, dest_folder)
+        dest_index, dest_folder_id = get_fingerprint_index_cached(
+            dest, state_index, run.host2, run.user2, dest_folder, dest_state, log_callback, widgets)
+
+        # En modo incremental se replican también los cambios de flags y, si se pide, los borrados
+        if changes is not None:
+            store_failed = 0
+            if changes['flag_changes']:
+                updated, store_failed = apply_flag_changes(dest, changes['flag_changes'], dest_index)
+                log_callback(widgets, f"Flags actualizados en {updated} correos.", "gray")
+                logging.info(f"Flags actualizados en el destino: {updated} correos.")
+                if store_failed:
+                    # Sin guardar el HIGHESTMODSEQ, el próximo CHANGEDSINCE vuelve a traer estos cambios
+                    log_callback(widgets, f"El destino rechazó los flags de {store_failed} correos, "
+                                          f"se reintentarán en la próxima ejecución.", "orange")
+            expunge_failed = 0
+            if changes['vanished'] and run.propagate_expunge:
+                removed, expunge_failed = apply_expunges(dest, changes['vanished'].values(), source_index, dest_index)
+                if dest_folder_id is not None:
+                    state_index.remove_messages(dest_folder_id, removed)
+                dest_index = dest_index.without_uids(removed)
+                log_callback(widgets, f"Borrados en el destino: {len(removed)} correos.", "gray")
+                logging.info(f"Borrados propagados al destino: {len(removed)} correos.")
+                if expunge_failed:
+                    log_callback(widgets, f"El destino no dejó borrar {expunge_failed} correos, "
+                                          f"se reintentará en la próxima ejecución.", "orange")
+            # Los borrados solo salen del índice una vez propagados: si algo falla
+            # antes, el reintento los vuelve a encontrar en él
+            store_failed += expunge_failed
+            if changes['vanished'] and source_folder_id is not None and not expunge_failed:
+                state_index.remove_messages(source_folder_id, changes['vanished'])
+            if source_folder_id is not None and source_state['highestmodseq'] is not None and not store_failed:
+                state_index.set_highestmodseq(source_folder_id, source_state['highestmodseq'])
+
+        # Diferencia por huella: un correo repetido en el origen se copia tantas veces como falte
+        uids_to_fetch = source_index.missing_from(dest_index)
+        if source_folder_id is not None and dest_folder_id is not None:
+            # Descarta lo ya copiado en ejecuciones anteriores aunque aún no se haya reanalizado el destino
+            already_copied = state_index.copied_uids(source_folder_id, dest_folder_id)
+            uids_to_fetch = [uid for uid in uids_to_fetch if int(uid) not in already_copied]
+
+    # Reintento tras un corte: no se vuelve a subir lo que ya llegó al destino
+    resumed = run.appended_uids(folder_name)
+    if resumed:
+        uids_to_fetch = [uid for uid in uids_to_fetch if int(uid) not in resumed]
+        logging.info(f"Se retoma {folder_name}: {len(resumed)} correos ya subidos en el intento anterior.")
+
+    if not uids_to_fetch:
+        log_callback(widgets, "No hay correos nuevos que copiar.", "green")
+        progress_callback(widgets, 1, 1)
+        logging.info(f"Carpeta {folder_name} ya sincronizada.")
+        metrics.finish()
+        return
+
+    log_callback(widgets, f"Copiando {len(uids_to_fetch)} correos...", "cyan")
+    logging.info(f"Se copiarán {len(uids_to_fetch)} correos nuevos de {folder_name}.")
+    progress_callback(widgets, 0, len(uids_to_fetch))
+    metrics.start_copy(len(uids_to_fetch))
+
+    # Registra los correos ya subidos al destino, en la tarea y en el índice
+    def on_appended(uids):
+        run.record_appended(folder_name, uids)
+        if source_folder_id is not None and dest_folder_id is not None:
+            state_index.mark_copied(source_folder_id, dest_folder_id, uids)
+
+    uids_to_fetch.sort(key=int)
+
+    # Misma cuenta en el mismo servidor: el propio servidor copia los correos, sin descargarlos
+    if run.same_account:
+        logging.info(f"Copia en el servidor (UID COPY) de {len(uids_to_fetch)} correos: {folder_name} -> {dest_folder}.")
+        log_callback(widgets, f"Copia en el servidor: {len(uids_to_fetch)} correos...", "cyan")
+        def on_copied(uids):
+            on_appended(uids)
+            metrics.add(appended=len(uids))
+
+        copied_uids, copied_map, uids_to_fetch = server_side_copy(
+            source, dest_folder, uids_to_fetch, progress_callback, widgets, run.cancel_event, on_copied)
+        if source_folder_id is not None and dest_folder_id is not None and copied_map:
+            # COPYUID dice qué UID tiene cada correo en el destino: se apunta sin tener que reanalizarlo
+            state_index.copy_messages(source_folder_id, dest_folder_id, copied_map)
+        if not uids_to_fetch:
+            log_callback(widgets, f"Copia en el servidor completada: {len(copied_uids)} correos.", "green")
+            metrics.finish('detenida' if run.cancel_event.is_set() else 'terminada')
+            return
+        log_callback(widgets, f"UID COPY falló para {len(uids_to_fetch)} correos, se copian descargándolos.", "orange")
+
+    # Descarga y subida en paralelo: el origen descarga mientras el destino sube
+    sizes = fetch_message_sizes(source, uids_to_fetch)
+    pipeline = CopyPipeline(folder_name, [source], [dest], log_callback, progress_callback,
+                            widgets, run.cancel_event, dest_folder_name=dest_folder, metrics=metrics)
+    stats = pipeline.run(uids_to_fetch, sizes, on_appended)
+    metrics.finish('detenida' if stats['cancelled'] else 'terminada')
+    if stats['failed']:
+        log_callback(widgets, f"{stats['failed']} correos no se pudieron copiar (ver log).", "orange")
+
+
+class SyncScheduler:
+    """
+    Reparte el trabajo de todas las tareas en unidades (tarea, carpeta) entre
+    ``max_workers`` hilos que comparten un ``ConnectionPool``.
+
+    Cada tarea empieza con una unidad de planificación que lista sus carpetas y
+    su tamaño (STATUS MESSAGES); después las carpetas de todas las tareas se
+    atienden de mayor a menor, para que las más largas (INBOX, Enviados...)
+    empiecen primero y no alarguen el final de la ejecución.
+    """
+    def __init__(self, runs, pool, state_index, max_workers=MAX_PARALLEL_FOLDERS):
+        self.runs = runs
+        self.pool = pool
+        self.state_index = state_index
+        self.max_workers = max(1, max_workers)
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.outstanding = 0
+
+    def _push(self, priority, unit):
+        self.queue.put((priority, next(self.counter), unit))
+
+    def run(self):
+        """Ejecuta todas las tareas y espera a que terminen."""
+        if not self.runs:
+            return
+        self.outstanding = len(self.runs)
+        for run in self.runs:
+            self._push((0, 0), ('plan', run, None, 0))
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.max_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def _worker(self):
+        while True:
+            _, _, unit = self.queue.get()
+            if unit is None:
+                return
+            kind, run, folder_name, folder_number = unit
+            try:
+                if kind == 'plan':
+                    self._plan_job(run)
+                else:
+                    self._sync_unit(run, folder_name, folder_number)
+            except Exception as e:  # Nunca debe detener al hilo trabajador
+                logging.critical(f"Error inesperado en el planificador: {e}\n{traceback.format_exc()}")
+            finally:
+                self._unit_done(run)
+
+    def _unit_done(self, run):
+        with self.lock:
+            self.outstanding -= 1
+            run.pending_units -= 1
+            job_finished = run.pending_units == 0
+            all_done = self.outstanding == 0
+        if job_finished:
+            run.finish()
+        if all_done:
+            for _ in range(self.max_workers):
+                self._push((2, 0), None)
+
+    def _with_connections(self, run, description, work):
+        """
+        Ejecuta ``work(source, dest)`` con conexiones del pool. Si el servidor
+        corta la sesión o la limita, descarta las conexiones, espera un tiempo
+        creciente (con algo de azar, para que los hilos no vuelvan a la vez) y
+        repite con conexiones nuevas, hasta ``RETRY_MAX_ATTEMPTS`` intentos
+        seguidos sin avanzar: si el intento llegó a subir correos, la cuenta
+        vuelve a empezar, para que una carpeta grande no falle solo por ser larga.
+
+        :param description: Qué se está haciendo, para los mensajes de reintento.
+        :return: False si la tarea se canceló antes de terminar el trabajo.
+        :raises Exception: Un error no transitorio, o el último tras agotar los intentos.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            done_before = run.appended_count()
+            try:
+                connections = self.pool.acquire(run.source_account(), run.dest_account(), cancel_event=run.cancel_event)
+                if connections is None:
+                    return False
+                source, dest = connections
+                broken = False
+                try:
+                    work(source, dest)
+                    return True
+                except Exception as e:
+                    broken = is_transient_error(e)
+                    raise
+                finally:
+                    self.pool.release(source, dest, broken=broken)
+            except Exception as e:
+                if run.appended_count() > done_before:
+                    attempt = 1
+                if not is_transient_error(e) or attempt == RETRY_MAX_ATTEMPTS or run.cancel_event.is_set():
+                    raise
+                delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                reason = "limitada por el servidor" if isinstance(e, ServerThrottled) else "cortada"
+                run.log(f"{description}: conexión {reason}, reintento {attempt}/{RETRY_MAX_ATTEMPTS - 1} "
+                        f"en {delay:.0f} s.", "yellow")
+                logging.warning(f"{description} ({run.user1}): conexión {reason} ({e}). "
+                                f"Reintento {attempt}/{RETRY_MAX_ATTEMPTS - 1} en {delay:.1f} s.")
+                if run.cancel_event.wait(delay):
+                    return False
+
+    def _plan_job(self, run):
+        """Conecta con ambas cuentas, lista las carpetas y encola una unidad por carpeta."""
+        logging.info("="*60)
+        logging.info(f"INICIO DE SINCRONIZACIÓN ({run.sync_mode}): {run.user1} -> {run.user2}")
+        if run.cancel_event.is_set():
+            return
+        run.log("Conectando...", "cyan")
+
+        def plan(source, dest):
+            logging.info(f"Conexión exitosa al origen: {run.host1}")
+            logging.info(f"Conexión exitosa al destino: {run.host2}")
+            run.log("Conexión exitosa.", "cyan")
+            run.same_account = is_same_account(run.host1, run.user1, run.host2, run.user2)
+            if run.same_account:
+                logging.info("Origen y destino son la misma cuenta: se copiará en el servidor con UID COPY.")
+            if run.dest_prefix:
+                run.dest_delimiter = get_hierarchy_delimiter(dest)
+            # El modo incremental necesita CONDSTORE en el origen; si no lo hay se comporta como el seguro
+            if run.incremental:
+                condstore = self.pool.extensions(source)
+                if condstore:
+                    logging.info(f"Modo incremental con {', '.join(sorted(condstore))} en el origen.")
+                else:
+                    run.incremental = False
+                    run.log("El origen no soporta CONDSTORE: se usa Sincronización Segura.", "yellow")
+                    logging.warning("El origen no anuncia CONDSTORE, se usa la Sincronización Segura.")
+
+            selected_folders = run.selected_folders
+            listed = not selected_folders
+            # Si no hay carpetas seleccionadas, obtiene todas las del servidor.
+            if listed:
+                run.log("Listando todas las carpetas del origen...", "gray")
+                logging.info("No se seleccionaron carpetas, procediendo a listar todas.")
+                selected_folders = list_folders(source)
+                if selected_folders is None:
+                    run.failed = True
+                    run.log("Error: No se pudo obtener la lista de carpetas.", "red")
+                    logging.error("Fallo al ejecutar source.list()")
+                    return
+                logging.info(f"Se encontraron {len(selected_folders)} carpetas para sincronizar.")
+
+            own_copies = [folder for folder in selected_folders if run.is_own_copy(folder, listed)]
+            if own_copies:
+                selected_folders = [folder for folder in selected_folders if folder not in own_copies]
+                run.log(f"Se omiten {len(own_copies)} carpetas que son el destino de la propia copia.", "yellow")
+                logging.warning(f"Carpetas omitidas por ser destino de la copia en la misma cuenta: {', '.join(own_copies)}")
+
+            # El tamaño de cada carpeta decide el orden: las más grandes primero
+            sizes = {}
+            for folder_name in selected_folders:
+                try:
+                    typ, data = source.status(f'"{folder_name}"', '(MESSAGES)')
+                    match = re.search(rb'MESSAGES (\d+)', data[0]) if typ == 'OK' and data and data[0] else None
+                    sizes[folder_name] = int(match.group(1)) if match else 0
+                except imaplib.IMAP4.abort:
+                    raise
+                except Exception:
+                    sizes[folder_name] = 0
+
+            with self.lock:
+                run.total_folders = len(selected_folders)
+                run.pending_units += len(selected_folders)
+                self.outstanding += len(selected_folders)
+            for number, folder_name in enumerate(selected_folders, 1):
+                self._push((1, -sizes[folder_name]), ('folder', run, folder_name, number))
+
+        try:
+            self._with_connections(run, "Conexión", plan)
+        except Exception as e:
+            run.fail(e)
+
+    def _sync_unit(self, run, folder_name, folder_number):
+        """Sincroniza una carpeta con conexiones tomadas del pool; tras un corte la retoma."""
+        if run.cancel_event.is_set() or run.failed:
+            return
+
+        def sync(source, dest):
+            condstore = self.pool.extensions(source) if run.incremental else set()
+            sync_folder(run, folder_name, folder_number, source, dest, condstore,
+                        None if run.force_copy else self.state_index)
+
+        try:
+            self._with_connections(run, f"Carpeta {folder_name}", sync)
+        except Exception as e:
+            run.folder_error(folder_name, e)
+
+
+def _publish_metrics(metrics, runs, metrics_callback, prometheus_file, final=False):
+    """Toma una muestra de las métricas y la entrega al callback y al fichero de Prometheus."""
+    for host in {run.host1 for run in runs} | {run.host2 for run in runs}:
+        rate = _host_rates.get(host)
+        if rate is not None:
+            metrics.set_host_pacing(host, rate.interval, rate.throttle_count)
+    metrics.sample()
+    try:
+        if prometheus_file:
+            metrics.write_prometheus_file(prometheus_file)
+        if metrics_callback:
+            metrics_callback(metrics.snapshot(final=final))
+    except Exception as e:  # Las métricas nunca deben detener la sincronización
+        logging.error(f"No se pudieron publicar las métricas: {e}")
+
+
+def run_sync_jobs(jobs, log_callback, progress_callback, max_workers=MAX_PARALLEL_FOLDERS,
+                  max_per_host=MAX_CONNECTIONS_PER_HOST, max_per_account=MAX_CONNECTIONS_PER_ACCOUNT,
+                  metrics_callback=None, metrics_interval=METRICS_INTERVAL, prometheus_file=None, compress=True):
+    """
+    Ejecuta varias tareas de sincronización repartiendo sus carpetas entre
+    hilos que comparten un pool de conexiones con límites por servidor y cuenta.
+
+    :param jobs: Lista de diccionarios de tarea (ver ``SyncJobRun``).
+    :param max_workers: Carpetas sincronizadas a la vez entre todas las tareas.
+    :param max_per_host: Conexiones simultáneas como máximo contra un mismo servidor.
+    :param max_per_account: Conexiones simultáneas como máximo con una misma cuenta.
+    :param metrics_callback: Función que recibe cada ``metrics_interval`` segundos una
+                             instantánea de las métricas (``SyncMetrics.snapshot``) y,
+                             al terminar, el resumen final (con ``final`` a True).
+    :param prometheus_file: Fichero que se reescribe con las métricas en formato de Prometheus.
+    :param compress: Usar COMPRESS=DEFLATE con los servidores que lo anuncien.
+    :return: Lista de ``SyncJobRun`` con el resultado de cada tarea.
+    """
+    reset_host_rates()
+    metrics = SyncMetrics()
+    runs = [SyncJobRun(job, log_callback, progress_callback, metrics) for job in jobs]
+    pool = ConnectionPool(max_per_host, max_per_account, metrics, compress)
+    state_index = SyncStateIndex() if any(not run.force_copy for run in runs) else None
+
+    stop_publishing = threading.Event()
+    publisher = None
+    if (metrics_callback or prometheus_file) and metrics_interval > 0:
+        def publish_periodically():
+            while not stop_publishing.wait(metrics_interval):
+                _publish_metrics(metrics, runs, metrics_callback, prometheus_file)
+        publisher = threading.Thread(target=publish_periodically, daemon=True)
+        publisher.start()
+    try:
+        SyncScheduler(runs, pool, state_index, max_workers).run()
+    finally:
+        stop_publishing.set()
+        if publisher is not None:
+            publisher.join()
+        pool.close_all()
+        if state_index is not None:
+            state_index.close()
+    _publish_metrics(metrics, runs, metrics_callback, prometheus_file, final=True)
+    for line in metrics.summary_lines():
+        logging.info(line)
+    return runs
+
+
+def execute_sync_job_native(job_data, log_callback, progress_callback):
+    """
+    Ejecuta el trabajo de sincronización para una cuenta, usando el modo seleccionado.
+    """
+    return run_sync_jobs([job_data], log_callback, progress_callback)[0]
@@ -0,0 +1,471 @@
+# Métricas de la sincronización: latencia de los comandos IMAP por servidor,
+# velocidad y profundidad de cola por tarea y carpeta, hora estimada de fin y
+# bytes de cada servidor antes y después de COMPRESS=DEFLATE.
+# El motor (mailtransfer_core) las actualiza; la interfaz y la línea de comandos
+# las leen como instantáneas (diccionarios) o en formato de texto de Prometheus.
+import os
+import time
+import math
+import tempfile
+import threading
+from collections import deque
+
+# Límites superiores (segundos) de los intervalos de los histogramas de latencia.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Ventana (segundos) para la velocidad actual y la hora estimada de fin.
+RATE_WINDOW_SECONDS = 30.0
+
+
+def format_duration(seconds):
+    """Duración legible: '35 s', '4 min 10 s', '2 h 05 min'. None si no se conoce."""
+    if seconds is None or not math.isfinite(seconds):
+        return None
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds < 3600:
+        return f"{seconds // 60} min {seconds % 60:02d} s"
+    return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+
+
+class LatencyHistogram:
+    """Histograma de latencias con intervalos fijos (``LATENCY_BUCKETS``)."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # El último es +Inf
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, ok=True):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if not ok:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Cuantil aproximado: el límite superior del intervalo en el que cae."""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return round(min(bound, self.max), 4)
+        return round(self.max, 4)
+
+    def snapshot(self):
+        return {
+            'count': self.count, 'errors': self.errors, 'seconds': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 4) if self.count else None,
+            'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'max': round(self.max, 4),
+        }
+
+
+class FolderMetrics:
+    """Contadores de una carpeta. Sus métodos se llaman desde los hilos de la tubería."""
+    def __init__(self, lock, folder):
+        self.lock = lock
+        self.folder = folder
+        self.phase = 'analizando'
+        self.started = time.monotonic()
+        self.copy_started = None
+        self.finished = None
+        self.total = 0
+        self.fetched = self.appended = self.failed = 0
+        self.fetched_bytes = self.appended_bytes = 0
+        self.queue_messages = self.queue_bytes = 0
+
+    def start_copy(self, count):
+        """Empieza (o retoma tras un corte) la copia de ``count`` correos."""
+        with self.lock:
+            self.phase = 'copiando'
+            if self.copy_started is None:
+                self.copy_started = time.monotonic()
+            self.total = self.appended + self.failed + count
+
+    def add(self, fetched=0, fetched_bytes=0, appended=0, appended_bytes=0, failed=0):
+        with self.lock:
+            self.fetched += fetched
+            self.fetched_bytes += fetched_bytes
+            self.appended += appended
+            self.appended_bytes += appended_bytes
+            self.failed += failed
+
+    def set_queue(self, messages, size):
+        with self.lock:
+            self.queue_messages, self.queue_bytes = messages, size
+
+    def finish(self, phase='terminada'):
+        with self.lock:
+            self.phase = phase
+            self.finished = time.monotonic()
+            self.queue_messages = self.queue_bytes = 0
+
+    def snapshot(self, now):
+        """Se llama con ``self.lock`` adquirido."""
+        copy_seconds = ((self.finished or now) - self.copy_started) if self.copy_started is not None else 0.0
+        rate = self.appended / copy_seconds if copy_seconds > 0 else 0.0
+        remaining = max(self.total - self.appended - self.failed, 0)
+        return {
+            'folder': self.folder, 'phase': self.phase,
+            'seconds': round((self.finished or now) - self.started, 3),
+            'total': self.total, 'fetched': self.fetched, 'appended': self.appended, 'failed': self.failed,
+            'fetched_bytes': self.fetched_bytes, 'appended_bytes': self.appended_bytes,
+            'queue_messages': self.queue_messages, 'queue_bytes': self.queue_bytes,
+            'messages_per_second': round(rate, 2),
+            'bytes_per_second': round(self.appended_bytes / copy_seconds, 1) if copy_seconds > 0 else 0.0,
+            'eta_seconds': round(remaining / rate, 1) if rate > 0 and self.finished is None else None,
+        }
+
+
+class JobMetrics:
+    """Métricas de una tarea: sus carpetas, el avance total y la velocidad reciente."""
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+        self.status = 'running'
+        self.started = time.monotonic()
+        self.finished = None
+        self.progress = 0.0
+        self.folders = {}
+        self.samples = deque()   # (instante, correos, bytes, avance)
+
+    def folder(self, folder_name):
+        with self.lock:
+            folder = self.folders.get(folder_name)
+            if folder is None:
+                folder = self.folders[folder_name] = FolderMetrics(self.lock, folder_name)
+            return folder
+
+    def set_progress(self, fraction):
+        with self.lock:
+            self.progress = min(max(fraction, 0.0), 1.0)
+
+    def finish(self, status):
+        with self.lock:
+            self.status = status
+            self.finished = time.monotonic()
+
+    def _totals(self):
+        messages = sum(f.appended for f in self.folders.values())
+        size = sum(f.appended_bytes for f in self.folders.values())
+        return messages, size
+
+    def sample(self, now):
+        """Guarda una muestra para la velocidad reciente. Se llama con ``self.lock`` adquirido."""
+        self.samples.append((now, *self._totals(), self.progress))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW_SECONDS:
+            self.samples.popleft()
+
+    def snapshot(self, now):
+        """Se llama con ``self.lock`` adquirido."""
+        messages, size = self._totals()
+        elapsed = (self.finished or now) - self.started
+        if self.finished is not None or len(self.samples) < 2:
+            # Tarea terminada (o recién empezada): media de toda la ejecución
+            span = elapsed
+            message_rate = messages / span if span > 0 else 0.0
+            byte_rate = size / span if span > 0 else 0.0
+            progress_rate = self.progress / span if span > 0 else 0.0
+        else:
+            (t0, m0, b0, p0), (t1, m1, b1, p1) = self.samples[0], self.samples[-1]
+            span = t1 - t0
+            message_rate = (m1 - m0) / span if span > 0 else 0.0
+            byte_rate = (b1 - b0) / span if span > 0 else 0.0
+            progress_rate = (p1 - p0) / span if span > 0 else 0.0
+        eta = None
+        if self.finished is None and progress_rate > 0:
+            eta = round((1.0 - self.progress) / progress_rate, 1)
+        return {
+            'name': self.name, 'status': self.status, 'seconds': round(elapsed, 3),
+            'progress': round(self.progress, 4),
+            'appended': messages, 'appended_bytes': size,
+            'failed': sum(f.failed for f in self.folders.values()),
+            'queue_messages': sum(f.queue_messages for f in self.folders.values()),
+            'queue_bytes': sum(f.queue_bytes for f in self.folders.values()),
+            'messages_per_second': round(message_rate, 2), 'bytes_per_second': round(byte_rate, 1),
+            'eta_seconds': eta,
+            'folders': [f.snapshot(now) for f in self.folders.values()],
+        }
+
+
+def _ratio(size, wire_size):
+    """Factor de compresión (bytes de datos por byte en la red); None sin tráfico."""
+    return round(size / wire_size, 2) if wire_size else None
+
+
+def _traffic_text(size, wire_size):
+    text = f"{size / 1048576:.2f} MB"
+    if size != wire_size:
+        text += f" ({wire_size / 1048576:.2f} MB por la red, {_ratio(size, wire_size)}x)"
+    return text
+
+
+class ConnectionTraffic:
+    """
+    Bytes de una conexión IMAP: los de los comandos y respuestas (``sent``,
+    ``received``) y los que pasan por la red (``*_wire``), que son menos si la
+    sesión usa COMPRESS=DEFLATE. Solo la actualiza el hilo que usa la
+    conexión, sin bloqueo; las instantáneas leen los contadores tal cual.
+    """
+    def __init__(self, host, user=None):
+        self.host = host
+        self.user = user
+        self.compressed = False
+        self.sent = self.sent_wire = 0
+        self.received = self.received_wire = 0
+
+    def add_sent(self, size, wire_size):
+        self.sent += size
+        self.sent_wire += wire_size
+
+    def add_received(self, size, wire_size):
+        self.received += size
+        self.received_wire += wire_size
+
+    def snapshot(self):
+        return {
+            'host': self.host, 'user': self.user, 'compressed': self.compressed,
+            'sent_bytes': self.sent, 'sent_wire_bytes': self.sent_wire,
+            'received_bytes': self.received, 'received_wire_bytes': self.received_wire,
+            'sent_ratio': _ratio(self.sent, self.sent_wire),
+            'received_ratio': _ratio(self.received, self.received_wire),
+        }
+
+
+def _add_traffic(totals, traffic):
+    """Suma el tráfico de una conexión a los totales de su servidor en ``totals``."""
+    values = totals.setdefault(traffic.host, {
+        'connections': 0, 'compressed_connections': 0, 'sent_bytes': 0, 'sent_wire_bytes': 0,
+        'received_bytes': 0, 'received_wire_bytes': 0})
+    values['connections'] += 1
+    values['compressed_connections'] += traffic.compressed
+    values['sent_bytes'] += traffic.sent
+    values['sent_wire_bytes'] += traffic.sent_wire
+    values['received_bytes'] += traffic.received
+    values['received_wire_bytes'] += traffic.received_wire
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + '}'
+
+
+class SyncMetrics:
+    """
+    Registro de métricas de una ejecución (una o varias tareas).
+
+    Es seguro entre hilos: las conexiones anotan la latencia de cada comando
+    con ``observe_command`` y la tubería actualiza los contadores de su
+    carpeta; ``snapshot`` y ``prometheus_text`` leen el estado en cualquier momento.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.commands = {}   # (host, comando) -> LatencyHistogram
+        self.jobs = {}
+        self.hosts = {}      # host -> {'pacing_seconds': ..., 'throttled': ...}
+        self.connections = []   # ConnectionTraffic de las conexiones abiertas
+        self.closed_traffic = {}   # host -> totales de las conexiones ya cerradas (ver ``_host_traffic``)
+
+    def observe_command(self, host, command, seconds, ok=True):
+        with self.lock:
+            histogram = self.commands.get((host, command))
+            if histogram is None:
+                histogram = self.commands[(host, command)] = LatencyHistogram()
+            histogram.observe(seconds, ok)
+
+    def set_host_pacing(self, host, pacing_seconds, throttled):
+        """Estado del ritmo adaptativo de un servidor (intervalo entre comandos y limitaciones recibidas)."""
+        with self.lock:
+            self.hosts[host] = {'pacing_seconds': round(pacing_seconds, 4), 'throttled': throttled}
+
+    def add_connection(self, traffic):
+        """Registra el ``ConnectionTraffic`` de una conexión nueva."""
+        with self.lock:
+            self.connections.append(traffic)
+
+    def close_connection(self, traffic):
+        """
+        Suma a los totales de su servidor el tráfico de una conexión que se cierra,
+        para que una sesión larga con muchas reconexiones no acumule una entrada por cada una.
+        """
+        with self.lock:
+            if traffic in self.connections:
+                self.connections.remove(traffic)
+                _add_traffic(self.closed_traffic, traffic)
+
+    def _host_traffic(self):
+        """Totales por servidor de las conexiones cerradas y abiertas. Se llama con ``self.lock`` adquirido."""
+        totals = {host: dict(values) for host, values in self.closed_traffic.items()}
+        for traffic in self.connections:
+            _add_traffic(totals, traffic)
+        return [{'host': host, **values,
+                 'sent_ratio': _ratio(values['sent_bytes'], values['sent_wire_bytes']),
+                 'received_ratio': _ratio(values['received_bytes'], values['received_wire_bytes'])}
+                for host, values in sorted(totals.items())]
+
+    def add_job(self, name):
+        """Registra una tarea. Si el nombre ya existe se le añade un número ('a->b #2')."""
+        with self.lock:
+            unique, number = name, 1
+            while unique in self.jobs:
+                number += 1
+                unique = f"{name} #{number}"
+            job = self.jobs[unique] = JobMetrics(self.lock, unique)
+            return job
+
+    def sample(self):
+        """Toma una muestra de cada tarea para la velocidad reciente y la hora estimada de fin."""
+        now = time.monotonic()
+        with self.lock:
+            for job in self.jobs.values():
+                job.sample(now)
+
+    def snapshot(self, final=False):
+        """
+        Estado actual de todas las métricas.
+
+        :param final: Marca la instantánea como el resumen final de la ejecución.
+        :return: Diccionario serializable a JSON.
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'final': final,
+                'seconds': round(now - self.started, 3),
+                'commands': [{'host': host, 'command': command, **histogram.snapshot()}
+                             for (host, command), histogram in sorted(self.commands.items())],
+                'hosts': [{'host': host, **state} for host, state in sorted(self.hosts.items())],
+                'jobs': [job.snapshot(now) for job in self.jobs.values()],
+                'connections': [{'connection': number, **traffic.snapshot()}
+                                for number, traffic in enumerate(self.connections, 1)],
+                'traffic': self._host_traffic(),
+            }
+
+    def prometheus_text(self):
+        """Las métricas en el formato de texto de Prometheus (p. ej. para el textfile collector)."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+        now = time.monotonic()
+        with self.lock:
+            commands = sorted(self.commands.items())
+            buckets = []
+            for (host, command), histogram in commands:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if math.isinf(bound) else repr(bound)
+                    buckets.append((_labels(host=host, command=command, le=le), cumulative))
+            lines.append("# HELP mailtransfer_imap_command_seconds Latencia de los comandos IMAP por servidor.")
+            lines.append("# TYPE mailtransfer_imap_command_seconds histogram")
+            lines.extend(f"mailtransfer_imap_command_seconds_bucket{labels} {value}" for labels, value in buckets)
+            for (host, command), histogram in commands:
+                labels = _labels(host=host, command=command)
+                lines.append(f"mailtransfer_imap_command_seconds_sum{labels} {histogram.sum:.6f}")
+                lines.append(f"mailtransfer_imap_command_seconds_count{labels} {histogram.count}")
+            metric("mailtransfer_imap_command_errors_total", "counter", "Comandos IMAP con respuesta distinta de OK.",
+                   [(_labels(host=host, command=command), h.errors) for (host, command), h in commands])
+            hosts = sorted(self.hosts.items())
+            metric("mailtransfer_host_pacing_seconds", "gauge", "Intervalo actual entre comandos a cada servidor.",
+                   [(_labels(host=host), state['pacing_seconds']) for host, state in hosts])
+            metric("mailtransfer_host_throttled_total", "counter", "Limitaciones o cortes recibidos de cada servidor.",
+                   [(_labels(host=host), state['throttled']) for host, state in hosts])
+            traffic = self._host_traffic()
+            metric("mailtransfer_host_bytes_total", "counter", "Bytes de comandos y respuestas IMAP por servidor.",
+                   [(_labels(host=host['host'], direction=direction), host[f'{direction}_bytes'])
+                    for host in traffic for direction in ('sent', 'received')])
+            metric("mailtransfer_host_wire_bytes_total", "counter",
+                   "Bytes transmitidos por la red a cada servidor (tras COMPRESS=DEFLATE).",
+                   [(_labels(host=host['host'], direction=direction), host[f'{direction}_wire_bytes'])
+                    for host in traffic for direction in ('sent', 'received')])
+
+            jobs = [job.snapshot(now) for job in self.jobs.values()]
+        job_metrics = [
+            ('progress_ratio', 'gauge', 'Avance de la tarea (0 a 1).', 'progress'),
+            ('messages_total', 'counter', 'Correos subidos al destino.', 'appended'),
+            ('bytes_total', 'counter', 'Bytes subidos al destino.', 'appended_bytes'),
+            ('failed_total', 'counter', 'Correos que no se pudieron copiar.', 'failed'),
+            ('messages_per_second', 'gauge', 'Correos subidos por segundo (ventana reciente).', 'messages_per_second'),
+            ('bytes_per_second', 'gauge', 'Bytes subidos por segundo (ventana reciente).', 'bytes_per_second'),
+            ('queue_messages', 'gauge', 'Correos descargados esperando a subirse.', 'queue_messages'),
+            ('queue_bytes', 'gauge', 'Bytes descargados esperando a subirse.', 'queue_bytes'),
+            ('eta_seconds', 'gauge', 'Segundos estimados hasta terminar la tarea.', 'eta_seconds'),
+        ]
+        for suffix, kind, help_text, key in job_metrics:
+            metric(f"mailtransfer_job_{suffix}", kind, help_text,
+                   [(_labels(job=job['name']), job[key]) for job in jobs if job[key] is not None])
+        folder_metrics = [
+            ('messages_total', 'counter', 'Correos subidos al destino por carpeta.', 'appended'),
+            ('bytes_total', 'counter', 'Bytes subidos al destino por carpeta.', 'appended_bytes'),
+            ('pending_messages', 'gauge', 'Correos de la carpeta que faltan por copiar.', None),
+            ('queue_messages', 'gauge', 'Correos de la carpeta esperando a subirse.', 'queue_messages'),
+            ('queue_bytes', 'gauge', 'Bytes de la carpeta esperando a subirse.', 'queue_bytes'),
+        ]
+        for suffix, kind, help_text, key in folder_metrics:
+            metric(f"mailtransfer_folder_{suffix}", kind, help_text, [
+                (_labels(job=job['name'], folder=folder['folder']),
+                 folder[key] if key else max(folder['total'] - folder['appended'] - folder['failed'], 0))
+                for job in jobs for folder in job['folders']])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self, path):
+        """Escribe ``prometheus_text`` en ``path`` de forma atómica (fichero temporal y renombrado)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix='.mailtransfer-', suffix='.prom', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(self.prometheus_text())
+            os.chmod(temp_path, 0o644)  # mkstemp lo crea solo legible por el usuario
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def summary_lines(self):
+        """Resumen legible de la ejecución, para el log."""
+        snapshot = self.snapshot(final=True)
+        lines = [f"RESUMEN DE MÉTRICAS ({format_duration(snapshot['seconds'])})"]
+        for job in snapshot['jobs']:
+            lines.append(
+                f"Tarea {job['name']} [{job['status']}]: {job['appended']} correos, "
+                f"{job['appended_bytes'] / 1048576:.1f} MB en {format_duration(job['seconds'])} "
+                f"({job['messages_per_second']:.1f} correos/s, {job['bytes_per_second'] / 1048576:.2f} MB/s), "
+                f"{job['failed']} fallidos.")
+            for folder in job['folders']:
+                lines.append(
+                    f"  {folder['folder']} [{folder['phase']}]: {folder['appended']}/{folder['total']} correos, "
+                    f"{folder['appended_bytes'] / 1048576:.1f} MB en {format_duration(folder['seconds'])} "
+                    f"({folder['messages_per_second']:.1f} correos/s).")
+        for command in snapshot['commands']:
+            lines.append(
+                f"{command['host']} {command['command']}: {command['count']} comandos, "
+                f"media {command['avg'] * 1000:.0f} ms, p95 <= {command['p95'] * 1000:.0f} ms, "
+                f"máx. {command['max'] * 1000:.0f} ms, {command['errors']} con error.")
+        for host in snapshot['hosts']:
+            if host['throttled']:
+                lines.append(f"{host['host']}: {host['throttled']} limitaciones o cortes del servidor.")
+        for host in snapshot['traffic']:
+            lines.append(
+                f"Tráfico con {host['host']}: {host['connections']} conexiones "
+                f"({host['compressed_connections']} con COMPRESS), "
+                f"recibidos {_traffic_text(host['received_bytes'], host['received_wire_bytes'])}, "
+                f"enviados {_traffic_text(host['sent_bytes'], host['sent_wire_bytes'])}.")
+        return lines
@@ -0,0 +1,270 @@
+# Pruebas de las partes del motor que no necesitan servidor: huellas y
+# diferencia por huella, conjuntos de UIDs, agrupación de respuestas FETCH y
+# normalización de saltos de línea de los correos grandes.
+#
+#   python -m unittest discover tests
+#   python -m pytest tests
+import errno
+import imaplib
+import socket
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailtransfer_core import (
+    FingerprintIndex, SpooledMessage, ByteBudgetQueue, compress_uid_set, parse_uid_set, iter_fetch_responses,
+    parse_header_fields, message_fingerprint, _literal_plus_chunks, is_transient_error, ServerThrottled,
+    host_rate, reset_host_rates,
+)
+from mailtransfer_metrics import SyncMetrics, ConnectionTraffic
+
+
+def header(message_id=None, subject="Hola", date="Mon, 1 Jan 2024 10:00:00 +0000", sender="a@example.com"):
+    lines = [f"Date: {date}", f"From: {sender}", f"Subject: {subject}"]
+    if message_id is not None:
+        lines.insert(0, f"Message-ID: {message_id}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+class CompressUidSetTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(compress_uid_set([b'1', b'2', b'3', b'7', b'9', b'10']), "1:3,7,9:10")
+
+    def test_unsorted_duplicates_and_types(self):
+        self.assertEqual(compress_uid_set([5, '4', b'5', 1]), "1,4:5")
+
+    def test_empty(self):
+        self.assertEqual(compress_uid_set([]), "")
+
+    def test_round_trip(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            uids = sorted(set(rng.sample(range(1, 500), rng.randint(1, 100))))
+            self.assertEqual(parse_uid_set(compress_uid_set(uids)), uids)
+
+    def test_parse_reversed_range(self):
+        # RFC 3501: "5:3" es lo mismo que "3:5"
+        self.assertEqual(parse_uid_set("5:3,9"), [3, 4, 5, 9])
+
+
+class IterFetchResponsesTest(unittest.TestCase):
+    def test_one_literal_per_message(self):
+        data = [(b'1 (UID 10 BODY[HEADER] {5}', b'aaaaa'), b')',
+                (b'2 (UID 11 BODY[HEADER] {3}', b'bbb'), b')']
+        self.assertEqual(list(iter_fetch_responses(data)),
+                         [(b'1 (UID 10 BODY[HEADER] {5})', [b'aaaaa']), (b'2 (UID 11 BODY[HEADER] {3})', [b'bbb'])])
+
+    def test_uid_after_literal(self):
+        data = [(b'1 (BODY[HEADER.FIELDS (SUBJECT)] {9}', b'Subject:x'), b' UID 42 RFC822.SIZE 100)']
+        (meta, literals), = iter_fetch_responses(data)
+        self.assertIn(b'UID 42', meta)
+        self.assertIn(b'RFC822.SIZE 100', meta)
+        self.assertEqual(literals, [b'Subject:x'])
+
+    def test_several_literals_in_one_message(self):
+        data = [(b'3 (UID 7 BODY[HEADER] {2}', b'hh'), (b' BODY[TEXT] {2}', b'tt'), b')',
+                (b'4 (UID 8 BODY[HEADER] {1}', b'x'), b')']
+        responses = list(iter_fetch_responses(data))
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[0][1], [b'hh', b'tt'])
+        self.assertEqual(responses[1][1], [b'x'])
+
+    def test_without_literals_and_unsolicited_noise(self):
+        data = [b'garbage', b'1 (UID 5 FLAGS (\\Seen))', b'2 (UID 6 FLAGS ())', None]
+        self.assertEqual([meta for meta, _ in iter_fetch_responses(data)],
+                         [b'1 (UID 5 FLAGS (\\Seen))', b'2 (UID 6 FLAGS ())'])
+        self.assertEqual(list(iter_fetch_responses(None)), [])
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_folded_headers_and_spacing(self):
+        folded = b"Subject: Un asunto\r\n  muy   largo\r\nFrom: a@example.com\r\n\r\n"
+        self.assertEqual(parse_header_fields(folded)[b'subject'], b"Un asunto muy largo")
+        self.assertEqual(message_fingerprint(folded, 10),
+                         message_fingerprint(b"From: a@example.com\r\nSubject: Un asunto muy largo\r\n", 10))
+
+    def test_message_id_angle_brackets(self):
+        self.assertEqual(message_fingerprint(header("<abc@example.com>"), 10),
+                         message_fingerprint(header("  <abc@example.com> (comentario)"), 10))
+
+    def test_same_message_id_different_content(self):
+        self.assertNotEqual(message_fingerprint(header("<x@example.com>", subject="A"), 10),
+                            message_fingerprint(header("<x@example.com>", subject="B"), 10))
+
+    def test_size_ignored_with_message_id(self):
+        # El destino puede guardar otro tamaño (CRLF normalizados, tamaños estimados)
+        self.assertEqual(message_fingerprint(header("<x@example.com>"), 1000),
+                         message_fingerprint(header("<x@example.com>"), 1017))
+        self.assertEqual(message_fingerprint(header("<x@example.com>"), 1000),
+                         message_fingerprint(header("<x@example.com>"), None))
+
+    def test_without_message_id(self):
+        without = message_fingerprint(header(), 10)
+        self.assertEqual(without, message_fingerprint(header(), 10))
+        self.assertNotEqual(without, message_fingerprint(header(subject="Otro"), 10))
+        self.assertNotEqual(without, message_fingerprint(header(), None))
+        self.assertNotEqual(without, message_fingerprint(header(), 11))
+        # Un Message-ID vacío cuenta como ausente
+        self.assertNotEqual(message_fingerprint(header("<>"), 10), message_fingerprint(header("<>"), 11))
+
+
+class FingerprintIndexTest(unittest.TestCase):
+    A = message_fingerprint(header("<a@example.com>"), 100)
+    B = message_fingerprint(header("<b@example.com>"), 200)
+    C = message_fingerprint(header(), 300)   # Sin Message-ID
+
+    def index(self, *pairs):
+        return FingerprintIndex.from_pairs(pairs)
+
+    def test_lookup(self):
+        index = self.index((self.A, 3), (self.B, 1), (self.A, 2))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.uids_for(self.A), [2, 3])
+        self.assertEqual(index.uids_for(self.C), [])
+
+    def test_missing_from(self):
+        source = self.index((self.A, 1), (self.B, 2), (self.C, 3))
+        dest = self.index((self.B, 50))
+        self.assertEqual(sorted(source.missing_from(dest)), [b'1', b'3'])
+        self.assertEqual(source.missing_from(source), [])
+        self.assertEqual(sorted(source.missing_from(FingerprintIndex())), [b'1', b'2', b'3'])
+
+    def test_duplicates_are_a_multiset(self):
+        # Tres copias en el origen y una en el destino: faltan las dos de UID más alto
+        source = self.index((self.A, 5), (self.A, 9), (self.A, 7), (self.B, 1))
+        dest = self.index((self.A, 100), (self.B, 2), (self.B, 3))
+        self.assertEqual(source.missing_from(dest), [b'7', b'9'])
+        self.assertEqual(dest.missing_from(source), [b'3'])
+
+    def test_duplicates_without_message_id(self):
+        source = self.index((self.C, 1), (self.C, 2))
+        self.assertEqual(source.missing_from(self.index((self.C, 10))), [b'2'])
+        self.assertEqual(source.missing_from(self.index((self.C, 10), (self.C, 11))), [])
+
+    def test_missing_from_random(self):
+        rng = random.Random(2)
+        fingerprints = [message_fingerprint(header(f"<{n}@example.com>"), n) for n in range(20)]
+        for _ in range(30):
+            source = [(rng.choice(fingerprints), uid) for uid in range(1, rng.randint(1, 60))]
+            dest = [(rng.choice(fingerprints), uid) for uid in range(1, rng.randint(1, 60))]
+            missing = FingerprintIndex.from_pairs(source).missing_from(FingerprintIndex.from_pairs(dest))
+            expected = []
+            for fingerprint in fingerprints:
+                uids = sorted(uid for f, uid in source if f == fingerprint)
+                present = sum(1 for f, _ in dest if f == fingerprint)
+                expected.extend(str(uid).encode() for uid in uids[present:])
+            self.assertEqual(sorted(missing), sorted(expected))
+
+    def test_without_uids(self):
+        index = self.index((self.A, 1), (self.A, 2), (self.B, 3))
+        reduced = index.without_uids([b'2', 3, 99])
+        self.assertEqual(len(reduced), 1)
+        self.assertEqual(reduced.uids_for(self.A), [1])
+        self.assertEqual(reduced.uids_for(self.B), [])
+        self.assertEqual(len(index), 3)
+
+
+class SpooledMessageTest(unittest.TestCase):
+    def spool(self, chunks):
+        spool = SpooledMessage()
+        self.addCleanup(spool.close)
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.finish()
+        return spool, spool.file.read()
+
+    def test_crlf_split_between_chunks(self):
+        spool, content = self.spool([b"linea 1\r", b"\nlinea 2\r", b"\r\nfin"])
+        self.assertEqual(content, b"linea 1\r\nlinea 2\r\n\r\nfin")
+        self.assertEqual(len(spool), len(content))
+
+    def test_trailing_cr(self):
+        _, content = self.spool([b"fin\r"])
+        self.assertEqual(content, b"fin\r\n")
+
+    def test_same_as_append_for_any_split(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            message = bytes(rng.choice(b"ab\r\n") for _ in range(rng.randint(0, 40)))
+            cuts = sorted(rng.sample(range(len(message) + 1), rng.randint(0, min(5, len(message) + 1))))
+            chunks = [message[start:end] for start, end in zip([0] + cuts, cuts + [len(message)])]
+            spool, content = self.spool(chunks)
+            self.assertEqual(content, imaplib.MapCRLF.sub(imaplib.CRLF, message), chunks)
+            self.assertEqual(len(spool), len(content))
+
+
+class ByteBudgetQueueTest(unittest.TestCase):
+    def test_discard_closes_spooled_messages(self):
+        spool = SpooledMessage()
+        spool.write(b"correo grande\r\n")
+        spool.finish()
+        queue = ByteBudgetQueue(max_bytes=1024)
+        queue.put((b'1', '', None, b'corto'), 5)
+        queue.put((b'2', '', None, spool), len(spool))
+        queue.close(discard=True)
+        self.assertTrue(spool.file.closed)
+        self.assertEqual(queue.depth(), (0, 0))
+        self.assertIsNone(queue.get())
+
+
+class TransientErrorTest(unittest.TestCase):
+    def test_network_errors_are_retried(self):
+        for exc in (ConnectionResetError(), socket.timeout(), imaplib.IMAP4.abort("BYE"), ServerThrottled("x")):
+            self.assertTrue(is_transient_error(exc), exc)
+
+    def test_local_disk_and_configuration_errors_are_not(self):
+        for exc in (OSError(errno.ENOSPC, "No space left on device"), PermissionError(errno.EACCES, "denied"),
+                    socket.gaierror(-2, "Name or service not known"), imaplib.IMAP4.error("NO"), ValueError()):
+            self.assertFalse(is_transient_error(exc), exc)
+
+
+class SyncMetricsTrafficTest(unittest.TestCase):
+    def traffic(self, host, sent, received, compressed=False):
+        traffic = ConnectionTraffic(host, "u")
+        traffic.compressed = compressed
+        traffic.add_sent(sent, sent // 2 if compressed else sent)
+        traffic.add_received(received, received // 2 if compressed else received)
+        return traffic
+
+    def test_closed_connections_are_added_to_host_totals(self):
+        metrics = SyncMetrics()
+        for n in range(100):
+            traffic = self.traffic("a", 10, 100, compressed=n % 2 == 0)
+            metrics.add_connection(traffic)
+            metrics.close_connection(traffic)
+        metrics.add_connection(self.traffic("b", 1, 2))
+        self.assertEqual(len(metrics.connections), 1)
+        a, b = metrics.snapshot()['traffic']
+        self.assertEqual((a['host'], a['connections'], a['compressed_connections']), ("a", 100, 50))
+        self.assertEqual((a['sent_bytes'], a['received_bytes'], a['received_wire_bytes']), (1000, 10000, 7500))
+        self.assertEqual((b['host'], b['connections'], b['sent_bytes']), ("b", 1, 1))
+        self.assertIn('mailtransfer_host_bytes_total{host="a",direction="received"} 10000', metrics.prometheus_text())
+
+    def test_closing_twice_counts_once(self):
+        metrics = SyncMetrics()
+        traffic = self.traffic("a", 10, 10)
+        metrics.add_connection(traffic)
+        metrics.close_connection(traffic)
+        metrics.close_connection(traffic)
+        self.assertEqual(metrics.snapshot()['traffic'][0]['connections'], 1)
+
+    def test_reset_host_rates(self):
+        host_rate("servidor").throttled()
+        reset_host_rates()
+        self.assertEqual(host_rate("servidor").throttle_count, 0)
+
+
+class LiteralPlusChunksTest(unittest.TestCase):
+    def test_stream_matches_whole_command(self):
+        parts = [(b'(\\Seen) ', b'x' * 10), (b'', b'y' * 25), (b'', b'z' * 3)]
+        chunks = list(_literal_plus_chunks(parts, chunk_bytes=8))
+        self.assertTrue(all(len(chunk) <= 8 + 16 for chunk in chunks))
+        expected = b'x' * 10 + b' {25+}\r\n' + b'y' * 25 + b' {3+}\r\n' + b'zzz\r\n'
+        self.assertEqual(b''.join(chunks), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
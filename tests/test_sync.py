@@ -0,0 +1,102 @@
+# Pruebas de extremo a extremo del motor contra el servidor IMAP falso de
+# bench/ (en el propio proceso). Necesitan openssl para el certificado TLS.
+#
+#   python -m unittest discover tests
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'bench'))
+
+import mailtransfer_core
+from mailtransfer_core import run_sync_jobs, SYNC_MODE_SAFE, SYNC_MODE_INCREMENTAL
+from fake_imap_server import FakeIMAPServer, populate_mailbox
+
+
+@unittest.skipUnless(shutil.which("openssl"), "hace falta openssl para el servidor TLS falso")
+class FakeServerTestCase(unittest.TestCase):
+    """Arranca un servidor falso con la cuenta ``src`` y trabaja en un directorio temporal (índice local)."""
+    def setUp(self):
+        workdir = tempfile.mkdtemp(prefix='mailtransfer-test-')
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(workdir)
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+        self.source = self.server.add_account("src", "p")
+        self.log = []
+
+    def job(self, user2="src", **options):
+        return {"host1": self.server.address, "user1": "src", "pass1": "p",
+                "host2": self.server.address, "user2": user2, "pass2": "p",
+                "sync_mode": SYNC_MODE_SAFE, "widgets": None, **options}
+
+    def run_jobs(self, *jobs):
+        return run_sync_jobs(list(jobs), lambda widgets, message, color: self.log.append(message),
+                             lambda widgets, value, total: None, max_workers=2)
+
+    def counts(self, account):
+        return {name: len(mailbox.messages) for name, mailbox in account.mailboxes.items()}
+
+
+class SameAccountPrefixTest(FakeServerTestCase):
+    def test_second_run_does_not_copy_the_prefix_into_itself(self):
+        populate_mailbox(self.source.get("INBOX"), 20)
+        populate_mailbox(self.source.get_or_create("Sent"), 5, seed=1)
+        for _ in range(2):
+            run, = self.run_jobs(self.job(dest_prefix="Archive"))
+            self.assertEqual(run.status, 'ok')
+        self.assertEqual(self.counts(self.source),
+                         {"INBOX": 20, "Sent": 5, "Archive/INBOX": 20, "Archive/Sent": 5})
+
+    def test_selected_folder_copied_into_its_own_subfolder_is_skipped(self):
+        populate_mailbox(self.source.get_or_create("Archive"), 3)
+        run, = self.run_jobs(self.job(dest_prefix="Archive", selected_folders=["Archive"]))
+        self.assertEqual(run.status, 'ok')
+        self.assertNotIn("Archive/Archive", self.counts(self.source))
+
+
+class ExpungePropagationTest(FakeServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.add_account("dst", "p")
+        populate_mailbox(self.source.get("INBOX"), 10)
+        self.job_options = dict(user2="dst", sync_mode=SYNC_MODE_INCREMENTAL, propagate_expunge=True)
+        run, = self.run_jobs(self.job(**self.job_options))
+        self.assertEqual(run.status, 'ok')
+        inbox = self.source.get("INBOX")
+        inbox.messages[3].flags.add('\\Deleted')
+        inbox.expunge()
+
+    def test_deletion_survives_a_disconnect_before_expunge(self):
+        original = mailtransfer_core.apply_expunges
+        calls = []
+
+        def disconnect_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise mailtransfer_core.imaplib.IMAP4.abort("conexión cortada")
+            return original(*args)
+
+        with mock.patch.object(mailtransfer_core, 'apply_expunges', disconnect_once), \
+                mock.patch.object(mailtransfer_core, 'RETRY_BACKOFF_BASE', 0.0):
+            run, = self.run_jobs(self.job(**self.job_options))
+        self.assertEqual(run.status, 'ok')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.counts(self.server.accounts["dst"])["INBOX"], 9)
+
+    def test_rejected_expunge_is_retried_next_run(self):
+        with mock.patch.object(mailtransfer_core, 'apply_expunges', lambda *args: ([], 1)):
+            self.run_jobs(self.job(**self.job_options))
+        self.assertEqual(self.counts(self.server.accounts["dst"])["INBOX"], 10)
+        self.run_jobs(self.job(**self.job_options))
+        self.assertEqual(self.counts(self.server.accounts["dst"])["INBOX"], 9)
+
+
+if __name__ == '__main__':
+    unittest.main()